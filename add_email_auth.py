@@ -6,10 +6,18 @@
 import requests
 import json
 import logging
+from requests.adapters import HTTPAdapter
+
+from migration_http import configure_http, create_session
+from user_directory import iter_yandex_users
+from user_provisioning import DEFAULT_WORKERS, provision
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Общая сессия с лимитом запросов по хостам (пул соединений настраивается в main)
+session = create_session()
+
 def load_mappings():
     """Загрузка маппингов пользователей"""
     with open('user_mapping.json', 'r') as f:
@@ -31,8 +39,12 @@ def get_yandex_users():
         'Content-Type': 'application/json'
     }
 
-    response = requests.get('https://api.tracker.yandex.net/v2/users', headers=headers)
-    return response.json() if response.status_code == 200 else []
+    # Все страницы через общую сессию (без постраничного чтения оставалась только первая страница)
+    try:
+        return list(iter_yandex_users(session, headers))
+    except requests.RequestException as e:
+        logger.error(f"❌ Ошибка получения пользователей Yandex Tracker: {e}")
+        return []
 
 def add_email_to_user(youtrack_url, token, user_id, email, login):
     """Добавление email аутентификации пользователю"""
@@ -53,7 +65,7 @@ def add_email_to_user(youtrack_url, token, user_id, email, login):
         'changeOnLogin': True
     }
 
-    response = requests.post(credentials_url, headers=headers, json=credential_data)
+    response = session.post(credentials_url, headers=headers, json=credential_data)
 
     if response.status_code in [200, 201]:
         logger.info(f"✅ Email добавлен для {login}: {email}")
@@ -68,29 +80,34 @@ def main():
     logger.info("📧 Добавление email аутентификации для пользователей")
 
     config = load_config()
+    configure_http(config)
+    max_workers = max(1, config.get('migration_options', {}).get('max_workers', DEFAULT_WORKERS))
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
     user_mappings = load_mappings()
     yandex_users = get_yandex_users()
 
     # Создаем словарь yandex_id -> email
-    email_map = {user['id']: user for user in yandex_users if user.get('email')}
-
-    success_count = 0
+    email_map = {str(user['id']): user for user in yandex_users if user.get('email')}
 
+    pending = []
     for yandex_id, youtrack_id in user_mappings.items():
         if yandex_id in email_map:
             yandex_user = email_map[yandex_id]
-            email = yandex_user.get('email')
-            login = yandex_user.get('login', yandex_id)
-
-            if email:
-                if add_email_to_user(
-                        config['youtrack']['url'],
-                        config['youtrack']['token'],
-                        youtrack_id,
-                        email,
-                        login
-                ):
-                    success_count += 1
+            pending.append({
+                'id': youtrack_id,
+                'email': yandex_user.get('email'),
+                'login': yandex_user.get('login', yandex_id)
+            })
+
+    def add_credentials(user):
+        return add_email_to_user(config['youtrack']['url'], config['youtrack']['token'],
+                                 user['id'], user['email'], user['login'])
+
+    # Запросы credentials выполняются параллельно
+    success_count = sum(1 for _, added in provision(pending, add_credentials, max_workers) if added)
 
     logger.info(f"🎉 Email добавлен для {success_count} пользователей")
     logger.info("📝 Сохраните временные пароли и отправьте пользователям")
@@ -3,58 +3,21 @@
 Проверка, есть ли пользователи, которых нет в YouTrack
 """
 
-import requests
 import json
 
+from migration_http import configure_http
+from user_directory import load_config_user_logins
+
 def load_config():
     with open('migration_config.json', 'r') as f:
         return json.load(f)
 
 def main():
     config = load_config()
-
-    # Получаем всех пользователей из Yandex Tracker
-    yandex_headers = {
-        'Authorization': f"OAuth {config['yandex_tracker']['token']}",
-        'X-Cloud-Org-Id': config['yandex_tracker']['org_id'],
-        'Content-Type': 'application/json'
-    }
-
-    youtrack_headers = {
-        'Authorization': f"Bearer {config['youtrack']['token']}",
-        'Content-Type': 'application/json',
-        'Accept': 'application/json'
-    }
+    configure_http(config)
 
     print("🔍 Получение всех пользователей из обеих систем...")
-
-    # Получаем пользователей Yandex Tracker
-    yandex_users = []
-    page = 1
-    while True:
-        response = requests.get(
-            f'https://api.tracker.yandex.net/v2/users?page={page}&perPage=50',
-            headers=yandex_headers
-        )
-        users = response.json()
-        if not users:
-            break
-        yandex_users.extend(users)
-        page += 1
-        if page > 10:  # Ограничение для безопасности
-            break
-
-    # Получаем пользователей YouTrack
-    response = requests.get(
-        f"{config['youtrack']['url']}/api/users",
-        headers=youtrack_headers,
-        params={'fields': 'id,login', '$top': 1000}
-    )
-    youtrack_users = response.json() if response.status_code == 200 else []
-
-    # Создаем множества логинов
-    yandex_logins = {user.get('login') for user in yandex_users if user.get('login')}
-    youtrack_logins = {user.get('login') for user in youtrack_users if user.get('login')}
+    yandex_logins, youtrack_logins = load_config_user_logins(config)
 
     # Находим различия
     only_in_yandex = yandex_logins - youtrack_logins
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Дельта-синхронизация Yandex Tracker -> YouTrack по updatedAt
+Переносит только задачи, обновленные после метки прошлой успешной синхронизации:
+новые задачи создаются, у перенесенных по отпечаткам содержимого обновляются только
+изменившиеся заголовок, описание и комментарии, досоздаются новые связи.
+Повторные короткие проходы во время переключения сокращают заморозку Yandex Tracker до минут
+"""
+
+import os
+import json
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from link_planner import plan_links
+from mapping_store import DELTA_WATERMARK, MappingStore, open_mapping_store
+from migration_filters import MigrationFilters, load_filters, queue_of
+from migration_http import configure_http, log_http_stats
+from step3_issues_migration import (IssueMigrator, YandexTrackerClient, YouTrackClient,
+                                    load_config, load_project_mapping)
+from step4_links_migration import YouTrackClient as LinkClient, create_planned_links
+from yandex_snapshot import SNAPSHOT_DB, SnapshotExporter, SnapshotStore, YandexExportClient
+from youtrack_metadata import metadata_ttl
+
+# Настройка логирования (force: импортированные этапы уже настроили свои файлы логов)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('delta_sync.log'),
+        logging.StreamHandler()
+    ],
+    force=True
+)
+logger = logging.getLogger(__name__)
+
+# Запас по времени на расхождение часов и задержку индексации поиска Yandex Tracker
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+def parse_time(value: Optional[str]) -> Optional[datetime]:
+    """Разбор времени Yandex Tracker (2024-01-01T10:00:00.000+0000) или ISO"""
+    if not value:
+        return None
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f%z', '%Y-%m-%dT%H:%M:%S%z'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def yandex_time(moment: datetime) -> str:
+    """Время в формате фильтров Yandex Tracker"""
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000+0000')
+
+class DeltaSync:
+    """Перенос изменений, сделанных в Yandex Tracker после метки since"""
+
+    def __init__(self, yandex_client: YandexTrackerClient, store: MappingStore, migrator: IssueMigrator,
+                 since: datetime, max_workers: int = 8, filters: Optional[MigrationFilters] = None):
+        self.yandex_client = yandex_client
+        self.filters = filters or MigrationFilters()
+        self.store = store
+        self.migrator = migrator
+        self.since = since
+        self.max_workers = max(1, max_workers)
+        self.lock = threading.Lock()
+        self.stats = {'created': 0, 'updated': 0, 'unchanged': 0, 'errors': 0}
+
+    def count(self, name: str, value: int = 1):
+        with self.lock:
+            self.stats[name] += value
+
+    def find_updated_issues(self, queue_keys: List[str]) -> List[Dict]:
+        """Задачи перенесенных очередей, обновленные после метки (с запасом WATERMARK_OVERLAP)"""
+        issue_filter = self.filters.issue_filter()
+        issue_filter.update({
+            'queue': queue_keys,
+            'updated': {'from': yandex_time(self.since - WATERMARK_OVERLAP)}
+        })
+        return [issue for issues in self.yandex_client.iter_search_pages(issue_filter) for issue in issues]
+
+    def sync_issue(self, issue: Dict, project_id: str):
+        """Создание новой или обновление перенесенной задачи (выполняется в рабочем потоке).
+        Сравнение отпечатков в IssueMigrator отправляет в YouTrack только изменившееся содержимое"""
+        issue_key = issue.get('key')
+        issue_id = self.store.get('issues', issue_key)
+
+        if issue_id and not self.migrator.needs_resume(issue_key) and self.migrator.is_unchanged(issue):
+            self.count('unchanged')
+            return
+
+        outcome = self.migrator.sync_issue(issue, project_id, issue_id)
+        if outcome == 'success':
+            self.count('created')
+            logger.info(f"  ✓ {issue_key}: создана")
+        elif outcome == 'updated':
+            self.count('updated')
+            logger.info(f"  ↻ {issue_key}: обновлена")
+        elif outcome == 'skip':
+            self.count('unchanged')
+        else:
+            self.count('errors')
+
+    def run(self, issues: List[Dict], project_mapping: Dict[str, str]):
+        def process(issue: Dict):
+            try:
+                self.sync_issue(issue, project_mapping[queue_of(issue.get('key'))])
+            except Exception as e:
+                logger.error(f"  ✗ {issue.get('key')}: {e}")
+                self.count('errors')
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='delta') as executor:
+            list(executor.map(process, issues))
+
+def refresh_snapshot(config: Dict, issues: List[Dict], max_workers: int = 8):
+    """Обновленные задачи вместе с комментариями, связями и вложениями перевыгружаются в снимок,
+    поэтому завершенный снимок продолжает использоваться этапами миграции"""
+    if not issues or not os.path.exists(SNAPSHOT_DB):
+        return
+    client = YandexExportClient(
+        config['yandex_tracker']['token'],
+        config['yandex_tracker']['org_id'],
+        config['yandex_tracker'].get('is_cloud_org', False),
+        pool_size=max_workers
+    )
+    snapshot = SnapshotStore(SNAPSHOT_DB)
+    if SnapshotExporter(client, snapshot, max_workers=max_workers).refresh_issues(issues):
+        logger.info(f"📦 Снимок обновлен: {len(issues)} задач")
+    else:
+        logger.warning("⚠ Снимок обновлен не полностью, догрузите данные: python yandex_snapshot.py export")
+    snapshot.close()
+
+def save_delta_report(stats: Dict, since: datetime, watermark: Optional[str]):
+    """Сохранение отчета о дельта-синхронизации"""
+    report_data = {
+        'delta_statistics': stats,
+        'since': since.isoformat(),
+        'watermark': watermark,
+        'timestamp': datetime.now().isoformat(),
+        'step': 'delta_completed'
+    }
+
+    with open('delta_report.json', 'w', encoding='utf-8') as f:
+        json.dump(report_data, f, ensure_ascii=False, indent=2)
+
+    logger.info("Отчет сохранен в delta_report.json")
+
+def main():
+    """Главная функция дельта-синхронизации"""
+    parser = argparse.ArgumentParser(description='Дельта-синхронизация изменений Yandex Tracker')
+    parser.add_argument('--since', help='Переносить изменения начиная с этого времени (ISO), вместо сохраненной метки')
+    parser.add_argument('--dry-run', action='store_true', help='Только показать, сколько задач изменилось')
+    args = parser.parse_args()
+
+    logger.info("=" * 50)
+    logger.info("ДЕЛЬТА-СИНХРОНИЗАЦИЯ")
+    logger.info("=" * 50)
+
+    config = load_config()
+    configure_http(config)
+
+    store = open_mapping_store()
+    filters = load_filters(config)
+    project_mapping = filters.filter_mapping(load_project_mapping(store))
+
+    since = parse_time(args.since or store.get_state(DELTA_WATERMARK))
+    if not since:
+        logger.error("Метка синхронизации не найдена: сначала успешно завершите step3_issues_migration.py "
+                     "или укажите --since")
+        exit(1)
+
+    migration_options = config.get('migration_options', {})
+    max_workers = migration_options.get('max_workers', 8)
+
+    # Дельта всегда читает актуальные данные из Yandex Tracker, а не из снимка
+    yandex_client = YandexTrackerClient(
+        config['yandex_tracker']['token'],
+        config['yandex_tracker']['org_id'],
+        config['yandex_tracker'].get('is_cloud_org', False),
+        pool_size=max_workers
+    )
+
+    youtrack_client = YouTrackClient(
+        config['youtrack']['url'],
+        config['youtrack']['token'],
+        pool_size=max_workers
+    )
+
+    # Время начала прохода станет новой меткой, если проход завершится без ошибок
+    run_started = datetime.now(timezone.utc).isoformat()
+
+    migrator = IssueMigrator(
+        yandex_client,
+        youtrack_client,
+        store,
+        migrate_comments=migration_options.get('migrate_comments', True),
+        max_workers=max_workers
+    )
+    delta = DeltaSync(yandex_client, store, migrator, since, max_workers, filters)
+
+    logger.info(f"🔎 Ищем задачи, измененные после {since.isoformat()}...")
+    issues = delta.find_updated_issues(list(project_mapping))
+    logger.info(f"Изменено задач: {len(issues)}")
+
+    if args.dry_run:
+        for issue in issues:
+            status = 'обновление' if store.contains('issues', issue.get('key')) else 'создание'
+            logger.info(f"  {issue.get('key')}: {status}")
+        migrator.shutdown()
+        return
+
+    delta.run(issues, project_mapping)
+    migrator.shutdown()
+
+    # Связи: планировщик создаст только новые ребра
+    links_stats = {'links_created': 0, 'links_failed': 0, 'link_types_used': {}}
+    issue_keys = {issue.get('key') for issue in issues}
+    issue_links = {key: links for key, links in store.load_issue_links().items() if key in issue_keys and links}
+    if issue_links:
+        link_client = LinkClient(config['youtrack']['url'], config['youtrack']['token'], store,
+                                 metadata_ttl=metadata_ttl(config))
+        issue_mapping = store.load('issues')
+        plan = plan_links(issue_links, issue_mapping, link_client.get_link_types(), store.load('links'))
+        create_planned_links(link_client, store, issue_mapping, plan.edges, links_stats,
+                             migration_options.get('link_mode', 'commands'),
+                             migration_options.get('link_batch_size', 50))
+
+    refresh_snapshot(config, issues, max_workers)
+
+    stats = dict(delta.stats, links_created=links_stats['links_created'], links_failed=links_stats['links_failed'])
+    total_errors = stats['errors'] + stats['links_failed']
+
+    # Метку сдвигаем только после прохода без ошибок, иначе следующий проход повторит изменения
+    watermark = None
+    if total_errors == 0:
+        watermark = run_started
+        store.set_state(DELTA_WATERMARK, watermark)
+
+    store.export_json('issues')
+    save_delta_report(stats, since, watermark)
+
+    logger.info("=" * 50)
+    logger.info("РЕЗУЛЬТАТЫ ДЕЛЬТА-СИНХРОНИЗАЦИИ:")
+    logger.info(f"✓ Создано задач: {stats['created']}")
+    logger.info(f"↻ Обновлено задач: {stats['updated']}")
+    logger.info(f"⏭ Без изменений: {stats['unchanged']}")
+    logger.info(f"🔗 Создано связей: {stats['links_created']}")
+    logger.info(f"✗ Ошибок: {total_errors}")
+    log_http_stats(logger)
+    logger.info("=" * 50)
+
+    if total_errors == 0:
+        logger.info(f"🎉 Синхронизация завершена, новая метка: {watermark}")
+    else:
+        logger.warning("⚠ Синхронизация завершена с ошибками, метка не сдвинута - повторите запуск")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Планировщик связей для этапа 4
+Yandex Tracker возвращает каждую связь с обеих задач, поэтому сначала строится
+граф связей с каноническими ключами ребер, а затем вычисляется минимальный набор
+операций для YouTrack: каждое ребро создается ровно один раз, выполненные ребра
+сохраняются в хранилище маппингов (раздел 'links') и не повторяются при перезапуске
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Set, Tuple
+
+# Правила маппинга типов связей: ключевые слова типа Yandex Tracker ->
+# (ключ типа в словаре get_link_types, направленная ли связь).
+# Для направленных связей источником считается задача, у которой связь имеет
+# направление outward в Yandex Tracker; в YouTrack связь создается от источника
+LINK_TYPE_RULES = (
+    (('depend', 'блокир'), 'depends', True),
+    (('duplicate', 'дубликат'), 'duplicates', True),
+    (('parent', 'subtask', 'epic', 'родител', 'подзадач'), 'parent', True),
+)
+
+@dataclass(frozen=True)
+class LinkEdge:
+    """Ребро графа связей между задачами Yandex Tracker"""
+    source_key: str
+    target_key: str
+    link_type: str
+    directed: bool
+
+    @property
+    def key(self) -> str:
+        """Канонический ключ: одинаков для связи, полученной с любой из двух задач"""
+        if self.directed:
+            return f"{self.link_type}:{self.source_key}->{self.target_key}"
+        first, second = sorted((self.source_key, self.target_key))
+        return f"{self.link_type}:{first}~{second}"
+
+@dataclass
+class LinkPlan:
+    """Результат планирования: ребра для создания и причины пропуска остальных"""
+    edges: List[LinkEdge] = field(default_factory=list)
+    links_found: int = 0
+    duplicates: int = 0
+    already_done: int = 0
+    unmapped: int = 0
+    # Задачи со связями на еще не перенесенные задачи: их связи не считаются перенесенными
+    pending_issues: Set[str] = field(default_factory=set)
+
+def parse_yandex_links(yandex_links: List[Dict]) -> List[Dict]:
+    """Связи задачи из ответа Yandex Tracker в формате графа: target_key, type, direction"""
+    links = []
+    for link in yandex_links:
+        target = link.get('object') or link.get('target') or {}
+        if not target.get('key'):
+            continue
+        link_type = link.get('type', {})
+        links.append({
+            'target_key': target['key'],
+            'type': link_type.get('key') or link_type.get('id') or 'relates',
+            'direction': link.get('direction')
+        })
+    return links
+
+def map_link_type(yandex_link_type: str, direction: str,
+                  youtrack_link_types: Dict[str, str]) -> Tuple[str, bool, bool]:
+    """Маппинг типа связи с учетом направления.
+    Возвращает (имя типа YouTrack, направленная ли связь, нужно ли поменять концы местами)"""
+    yandex_type = (yandex_link_type or '').lower()
+
+    for keywords, youtrack_key, directed in LINK_TYPE_RULES:
+        if any(keyword in yandex_type for keyword in keywords) and youtrack_key in youtrack_link_types:
+            return youtrack_link_types[youtrack_key], directed, directed and direction == 'inward'
+
+    # Тип не найден в YouTrack или не распознан - ненаправленная связь relates
+    return youtrack_link_types.get('relates', 'relates'), False, False
+
+def build_link_graph(issue_links: Dict[str, List[Dict]],
+                     youtrack_link_types: Dict[str, str]) -> Tuple[Dict[str, LinkEdge], int]:
+    """Граф связей с каноническими ключами; возвращает (ребра по ключу, число повторов)"""
+    edges: Dict[str, LinkEdge] = {}
+    duplicates = 0
+
+    for issue_key, links in issue_links.items():
+        for link in links:
+            link_type, directed, flip = map_link_type(link['type'], link.get('direction'), youtrack_link_types)
+            source_key, target_key = (link['target_key'], issue_key) if flip else (issue_key, link['target_key'])
+            edge = LinkEdge(source_key, target_key, link_type, directed)
+            if edge.key in edges:
+                duplicates += 1
+                continue
+            edges[edge.key] = edge
+
+    return edges, duplicates
+
+def plan_links(issue_links: Dict[str, List[Dict]], issue_mapping: Dict[str, str],
+               youtrack_link_types: Dict[str, str], done_keys: Iterable[str]) -> LinkPlan:
+    """Минимальный набор связей для создания в YouTrack"""
+    plan = LinkPlan(links_found=sum(len(links) for links in issue_links.values()))
+    edges, plan.duplicates = build_link_graph(issue_links, youtrack_link_types)
+    done: Set[str] = set(done_keys)
+
+    for key, edge in sorted(edges.items()):
+        if key in done:
+            plan.already_done += 1
+        elif edge.source_key not in issue_mapping or edge.target_key not in issue_mapping:
+            plan.unmapped += 1
+            plan.pending_issues.update((edge.source_key, edge.target_key))
+        else:
+            plan.edges.append(edge)
+
+    return plan
+
+def group_edges(edges: List[LinkEdge], batch_size: int = 50) -> List[List[LinkEdge]]:
+    """Группировка ребер для пакетных команд YouTrack.
+    Команда применяется ко всем задачам пакета и ссылается на все цели пакета, поэтому
+    пакет - это либо один источник с многими целями ('relates to A-1 A-2' к одной задаче),
+    либо одна цель со многими источниками (одна команда к многим задачам).
+    Выбирается вариант с меньшим числом команд"""
+    def batches_by(endpoint) -> List[List[LinkEdge]]:
+        groups: Dict[Tuple[str, str], List[LinkEdge]] = {}
+        for edge in edges:
+            groups.setdefault((endpoint(edge), edge.link_type), []).append(edge)
+        batches = []
+        for group in groups.values():
+            for start in range(0, len(group), max(1, batch_size)):
+                batches.append(group[start:start + batch_size])
+        return batches
+
+    by_source = batches_by(lambda edge: edge.source_key)
+    by_target = batches_by(lambda edge: edge.target_key)
+    return by_target if len(by_target) < len(by_source) else by_source
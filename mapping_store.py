@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+Транзакционное хранилище маппингов миграции (SQLite в режиме WAL)
+Заменяет полную перезапись *_mapping.json на каждой контрольной точке:
+каждая запись - это O(1) upsert, поиск идет по индексу, а сбой посреди записи
+не портит уже сохраненные данные. JSON-файлы выгружаются в конце этапа
+для совместимости с run_migration.py --status и остальными утилитами
+"""
+
+import os
+import json
+import sqlite3
+import logging
+import argparse
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from datetime import datetime
+
+from link_planner import parse_yandex_links
+
+logger = logging.getLogger(__name__)
+
+# Файл базы состояния миграции
+MAPPING_DB = 'migration_state.db'
+
+# Разделы маппинга: users, projects, issues, comments, links,
+# issues_readable (ключ задачи -> читаемый ID задачи в YouTrack, нужен для команд)
+# и state_bundles (хэш набора статусов -> ID общего state bundle)
+MAPPING_KINDS = ('users', 'projects', 'issues', 'issues_readable', 'comments', 'links', 'state_bundles')
+
+# Разделы, которые существуют в виде JSON-файлов: (файл, значение поля step)
+JSON_MAPPINGS = {
+    'users': ('user_mapping.json', 'users_completed'),
+    'projects': ('project_mapping.json', 'projects_completed'),
+    'issues': ('issue_mapping.json', 'issues_completed'),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mappings (
+    kind TEXT NOT NULL,
+    source_key TEXT NOT NULL,
+    target_id TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (kind, source_key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_mappings_target ON mappings (kind, target_id);
+CREATE TABLE IF NOT EXISTS issue_progress (
+    issue_key TEXT PRIMARY KEY,
+    stage TEXT NOT NULL,
+    comments_done INTEGER NOT NULL DEFAULT 0,
+    comments_total INTEGER,
+    links_done INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS issue_links (
+    issue_key TEXT NOT NULL,
+    target_key TEXT NOT NULL,
+    link_type TEXT NOT NULL,
+    direction TEXT,
+    PRIMARY KEY (issue_key, target_key, link_type)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS fingerprints (
+    kind TEXT NOT NULL,
+    source_key TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    source_updated_at TEXT,
+    PRIMARY KEY (kind, source_key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sync_state (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS links_fetched (
+    issue_key TEXT PRIMARY KEY,
+    links_count INTEGER NOT NULL,
+    fetched_at TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS youtrack_metadata (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Метка дельта-синхронизации: время (UTC, ISO), начиная с которого изменения еще не перенесены
+DELTA_WATERMARK = 'delta_watermark'
+
+# Этапы переноса одной задачи: создана -> комментарии перенесены
+STAGE_CREATED = 'created'
+STAGE_DONE = 'done'
+
+class MappingStore:
+    """Хранилище маппингов Yandex Tracker -> YouTrack (потокобезопасное)"""
+
+    def __init__(self, path: str = MAPPING_DB):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # В режиме WAL synchronous=NORMAL не теряет согласованность при сбое процесса
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def get(self, kind: str, source_key: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT target_id FROM mappings WHERE kind = ? AND source_key = ?',
+                (kind, source_key)
+            ).fetchone()
+        return row[0] if row else None
+
+    def contains(self, kind: str, source_key: str) -> bool:
+        return self.get(kind, source_key) is not None
+
+    def set(self, kind: str, source_key: str, target_id: str):
+        """Upsert одной записи (фиксируется сразу)"""
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO mappings (kind, source_key, target_id, updated_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (kind, source_key) DO UPDATE SET target_id = excluded.target_id, '
+                'updated_at = excluded.updated_at',
+                (kind, str(source_key), str(target_id), datetime.now().isoformat())
+            )
+
+    def set_many(self, kind: str, items: Dict[str, str]):
+        """Upsert набора записей одной транзакцией"""
+        now = datetime.now().isoformat()
+        with self.lock:
+            self.conn.execute('BEGIN')
+            try:
+                self.conn.executemany(
+                    'INSERT INTO mappings (kind, source_key, target_id, updated_at) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (kind, source_key) DO UPDATE SET target_id = excluded.target_id, '
+                    'updated_at = excluded.updated_at',
+                    ((kind, str(key), str(value), now) for key, value in items.items())
+                )
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def delete(self, kind: str, source_key: str):
+        with self.lock:
+            self.conn.execute('DELETE FROM mappings WHERE kind = ? AND source_key = ?', (kind, source_key))
+
+    def find_source(self, kind: str, target_id: str) -> Optional[str]:
+        """Обратный поиск по ID в YouTrack"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT source_key FROM mappings WHERE kind = ? AND target_id = ?',
+                (kind, target_id)
+            ).fetchone()
+        return row[0] if row else None
+
+    def count(self, kind: str) -> int:
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM mappings WHERE kind = ?', (kind,)).fetchone()[0]
+
+    def items(self, kind: str) -> Iterator[Tuple[str, str]]:
+        """Перебор записей раздела"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT source_key, target_id FROM mappings WHERE kind = ?',
+                (kind,)
+            ).fetchall()
+        return iter(rows)
+
+    def load(self, kind: str) -> Dict[str, str]:
+        return dict(self.items(kind))
+
+    def import_json(self, kind: str, path: Optional[str] = None) -> int:
+        """Импорт раздела из существующего *_mapping.json"""
+        path = path or JSON_MAPPINGS[kind][0]
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        items = data.get(kind, {})
+        self.set_many(kind, items)
+        logger.info(f"Импортировано {len(items)} записей '{kind}' из {path}")
+        return len(items)
+
+    def export_json(self, kind: str, path: Optional[str] = None, step: Optional[str] = None):
+        """Выгрузка раздела в формате *_mapping.json"""
+        default_path, default_step = JSON_MAPPINGS[kind]
+        path = path or default_path
+        mapping_data = {
+            kind: self.load(kind),
+            'timestamp': datetime.now().isoformat(),
+            'step': step or default_step
+        }
+
+        # Пишем во временный файл и атомарно подменяем, чтобы сбой не испортил JSON
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(mapping_data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        logger.info(f"Маппинг '{kind}' выгружен в {path}")
+
+    def export_combined(self, path: str = 'migration_mappings.json'):
+        """Выгрузка всех разделов одним файлом (формат migration_cleanup.py и migration_validator.py)"""
+        mapping_data = {kind: self.load(kind) for kind in JSON_MAPPINGS}
+        mapping_data['timestamp'] = datetime.now().isoformat()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(mapping_data, f, ensure_ascii=False, indent=2)
+        logger.info(f"Все маппинги выгружены в {path}")
+
+    def get_state(self, name: str) -> Optional[str]:
+        """Значение служебного параметра (например, метки дельта-синхронизации)"""
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM sync_state WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, name: str, value: str):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO sync_state (name, value) VALUES (?, ?)', (name, value))
+
+    def get_metadata(self, name: str) -> Optional[Tuple[str, float]]:
+        """Сохраненный раздел кэша метаданных YouTrack (JSON) и время его получения"""
+        with self.lock:
+            row = self.conn.execute('SELECT value, fetched_at FROM youtrack_metadata WHERE name = ?',
+                                    (name,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set_metadata(self, name: str, value: str, fetched_at: float):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO youtrack_metadata (name, value, fetched_at) VALUES (?, ?, ?)',
+                              (name, value, fetched_at))
+
+    def delete_metadata(self, name: str):
+        with self.lock:
+            self.conn.execute('DELETE FROM youtrack_metadata WHERE name = ?', (name,))
+
+    def get_progress(self, issue_key: str) -> Optional[Dict]:
+        """Прогресс переноса задачи или None, если задача не отслеживалась"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT stage, comments_done, comments_total, links_done FROM issue_progress WHERE issue_key = ?',
+                (issue_key,)
+            ).fetchone()
+        if not row:
+            return None
+        return {'stage': row[0], 'comments_done': row[1], 'comments_total': row[2], 'links_done': bool(row[3])}
+
+    def set_progress(self, issue_key: str, stage: str, comments_done: int = 0,
+                     comments_total: Optional[int] = None):
+        """Фиксация этапа переноса задачи (признак links_done не сбрасывается)"""
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO issue_progress (issue_key, stage, comments_done, comments_total, updated_at) '
+                'VALUES (?, ?, ?, ?, ?) ON CONFLICT (issue_key) DO UPDATE SET stage = excluded.stage, '
+                'comments_done = excluded.comments_done, comments_total = excluded.comments_total, '
+                'updated_at = excluded.updated_at',
+                (issue_key, stage, comments_done, comments_total, datetime.now().isoformat())
+            )
+
+    def record_issue_created(self, issue_key: str, issue_id: str, stage: str = STAGE_CREATED,
+                             readable_id: Optional[str] = None):
+        """Маппинг задачи и ее этап одной транзакцией"""
+        with self.lock:
+            self.conn.execute('BEGIN')
+            try:
+                self.set('issues', issue_key, issue_id)
+                if readable_id:
+                    self.set('issues_readable', issue_key, readable_id)
+                self.set_progress(issue_key, stage)
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def record_comment(self, issue_key: str, comment_key: str, comment_id: str,
+                       comments_done: int, comments_total: int):
+        """Маппинг комментария и счетчик k/N задачи одной транзакцией"""
+        stage = STAGE_DONE if comments_done >= comments_total else STAGE_CREATED
+        with self.lock:
+            self.conn.execute('BEGIN')
+            try:
+                self.set('comments', comment_key, comment_id)
+                self.set_progress(issue_key, stage, comments_done, comments_total)
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def get_fingerprint(self, kind: str, source_key: str) -> Optional[Tuple[str, Optional[str]]]:
+        """Отпечаток перенесенного содержимого и updatedAt исходного объекта на момент переноса"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT digest, source_updated_at FROM fingerprints WHERE kind = ? AND source_key = ?',
+                (kind, source_key)
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set_fingerprint(self, kind: str, source_key: str, digest: str, source_updated_at: Optional[str] = None):
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO fingerprints (kind, source_key, digest, source_updated_at) VALUES (?, ?, ?, ?)',
+                (kind, source_key, digest, source_updated_at)
+            )
+
+    def mark_links_done(self, issue_key: str):
+        """Все связи задачи перенесены (этап 4)"""
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO issue_progress (issue_key, stage, links_done, updated_at) VALUES (?, ?, 1, ?) '
+                'ON CONFLICT (issue_key) DO UPDATE SET links_done = 1, updated_at = excluded.updated_at',
+                (issue_key, STAGE_DONE, datetime.now().isoformat())
+            )
+
+    def links_done_keys(self) -> set:
+        """Ключи задач, связи которых уже перенесены"""
+        with self.lock:
+            rows = self.conn.execute('SELECT issue_key FROM issue_progress WHERE links_done = 1').fetchall()
+        return {row[0] for row in rows}
+
+    def count_unfinished_issues(self) -> int:
+        """Количество созданных задач, перенос комментариев которых не завершен"""
+        with self.lock:
+            return self.conn.execute(
+                'SELECT COUNT(*) FROM issue_progress WHERE stage != ?', (STAGE_DONE,)
+            ).fetchone()[0]
+
+    def save_issue_links(self, issue_key: str, yandex_links: List[Dict]):
+        """Сохранение связей задачи, полученных из Yandex Tracker (заменяет ранее сохраненные)"""
+        rows = [(issue_key, link['target_key'], link['type'], link['direction'])
+                for link in parse_yandex_links(yandex_links)]
+
+        with self.lock:
+            self.conn.execute('BEGIN')
+            try:
+                self.conn.execute('DELETE FROM issue_links WHERE issue_key = ?', (issue_key,))
+                # Новые данные о связях снова должен обработать этап 4
+                self.conn.execute('UPDATE issue_progress SET links_done = 0 WHERE issue_key = ?', (issue_key,))
+                self.conn.executemany(
+                    'INSERT OR IGNORE INTO issue_links (issue_key, target_key, link_type, direction) '
+                    'VALUES (?, ?, ?, ?)', rows
+                )
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO links_fetched (issue_key, links_count, fetched_at) VALUES (?, ?, ?)',
+                    (issue_key, len(rows), datetime.now().isoformat())
+                )
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def links_fetched_keys(self) -> set:
+        """Ключи задач, связи которых уже получены из Yandex Tracker"""
+        with self.lock:
+            rows = self.conn.execute('SELECT issue_key FROM links_fetched').fetchall()
+        return {row[0] for row in rows}
+
+    def load_issue_links(self) -> Dict[str, List[Dict]]:
+        """Сохраненные связи, сгруппированные по задачам (только задачи, у которых есть связи)"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT issue_key, target_key, link_type, direction FROM issue_links ORDER BY issue_key'
+            ).fetchall()
+        links: Dict[str, List[Dict]] = {}
+        for issue_key, target_key, link_type, direction in rows:
+            links.setdefault(issue_key, []).append(
+                {'target_key': target_key, 'type': link_type, 'direction': direction}
+            )
+        return links
+
+    def purge_queue(self, queue_key: str, state_names: Iterable[str] = ()) -> int:
+        """Удаление всех записей очереди после отката ее проекта, одной транзакцией:
+        маппинги проекта, задач, комментариев и связей, прогресс, связи, отпечатки
+        и служебные параметры state_names. Возвращает число удаленных маппингов задач"""
+        prefix = f"{queue_key}-"
+        match = 'substr({}, 1, ?) = ?'
+        params = (len(prefix), prefix)
+
+        with self.lock:
+            # Связи задаются ключом "<тип>:<задача>-><задача>" или "<тип>:<задача>~<задача>"
+            link_keys = [
+                (key,) for key, _ in self.items('links')
+                if any(issue_key.startswith(prefix)
+                       for issue_key in key.rsplit(':', 1)[-1].replace('->', '~').split('~'))
+            ]
+            self.conn.execute('BEGIN')
+            try:
+                issues = self.conn.execute(
+                    f"SELECT COUNT(*) FROM mappings WHERE kind = 'issues' AND {match.format('source_key')}",
+                    params).fetchone()[0]
+                self.conn.execute(
+                    f"DELETE FROM mappings WHERE kind IN ('issues', 'issues_readable', 'comments') "
+                    f"AND {match.format('source_key')}", params)
+                self.conn.execute("DELETE FROM mappings WHERE kind = 'projects' AND source_key = ?", (queue_key,))
+                self.conn.executemany("DELETE FROM mappings WHERE kind = 'links' AND source_key = ?", link_keys)
+                # Задачи других очередей, связанные с удаленными, снова должен обработать этап 4
+                self.conn.execute(
+                    f"UPDATE issue_progress SET links_done = 0 WHERE issue_key IN "
+                    f"(SELECT issue_key FROM issue_links WHERE {match.format('target_key')})", params)
+                for table, column in (('issue_progress', 'issue_key'), ('issue_links', 'issue_key'),
+                                      ('links_fetched', 'issue_key'), ('fingerprints', 'source_key')):
+                    self.conn.execute(f"DELETE FROM {table} WHERE {match.format(column)}", params)
+                self.conn.executemany('DELETE FROM sync_state WHERE name = ?', ((name,) for name in state_names))
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        return issues
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def open_mapping_store(path: str = MAPPING_DB) -> MappingStore:
+    """Открытие хранилища; пустые разделы заполняются из существующих JSON-файлов"""
+    store = MappingStore(path)
+    for kind, (json_path, _) in JSON_MAPPINGS.items():
+        if store.count(kind) == 0 and os.path.exists(json_path):
+            try:
+                store.import_json(kind, json_path)
+            except (json.JSONDecodeError, OSError) as e:
+                logger.warning(f"Не удалось импортировать {json_path}: {e}")
+    return store
+
+def main():
+    """Импорт/экспорт маппингов между SQLite и *_mapping.json"""
+    parser = argparse.ArgumentParser(description='Хранилище маппингов миграции')
+    parser.add_argument('action', choices=['import', 'export', 'stats'],
+                        help='import - загрузить *_mapping.json в базу, export - выгрузить базу в *_mapping.json, '
+                             'stats - количество записей')
+    parser.add_argument('--db', default=MAPPING_DB, help='Файл базы')
+    parser.add_argument('--kind', choices=list(JSON_MAPPINGS), help='Только один раздел')
+    parser.add_argument('--combined', help='Дополнительно выгрузить все разделы в один файл (например, migration_mappings.json)')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    store = MappingStore(args.db)
+    kinds = [args.kind] if args.kind else list(JSON_MAPPINGS)
+
+    if args.action == 'import':
+        for kind in kinds:
+            json_path = JSON_MAPPINGS[kind][0]
+            if os.path.exists(json_path):
+                store.import_json(kind, json_path)
+            else:
+                logger.warning(f"Файл {json_path} не найден, пропускаем")
+    elif args.action == 'export':
+        for kind in kinds:
+            store.export_json(kind)
+        if args.combined:
+            store.export_combined(args.combined)
+    else:
+        for kind in MAPPING_KINDS:
+            logger.info(f"{kind}: {store.count(kind)}")
+        logger.info(f"задач с незавершенным переносом комментариев: {store.count_unfinished_issues()}")
+        logger.info(f"задач с полученными связями: {len(store.links_fetched_keys())}, "
+                    f"из них со связями: {len(store.load_issue_links())}")
+
+    store.close()
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,15 @@
 
 import requests
 import json
-import time
 import logging
 from typing import Dict, List, Optional
 from datetime import datetime
 
+from mapping_store import MappingStore, open_mapping_store
+from migration_http import configure_http, create_session, log_http_stats
+from state_bundles import SharedStateBundles, bundle_states, is_shared_bundle, shared_bundle_name, status_set_digest
+from youtrack_metadata import METADATA_TTL, YouTrackMetadata, metadata_ttl
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
@@ -25,7 +29,7 @@ class YandexTrackerClient:
         self.token = token
         self.org_id = org_id
         self.base_url = "https://api.tracker.yandex.net/v2"
-        self.session = requests.Session()
+        self.session = create_session()
 
         org_header = 'X-Cloud-Org-Id' if is_cloud_org else 'X-Org-ID'
         self.session.headers.update({
@@ -53,18 +57,20 @@ class YandexTrackerClient:
             ]
 
 class YouTrackClient:
-    def __init__(self, base_url: str, token: str):
+    def __init__(self, base_url: str, token: str, store: MappingStore, metadata_ttl: float = METADATA_TTL):
         self.base_url = base_url.rstrip('/')
         self.token = token
-        self.session = requests.Session()
+        self.session = create_session()
         self.session.headers.update({
             'Authorization': f'Bearer {token}',
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         })
+        self.metadata = YouTrackMetadata(self.session, self.base_url, store, ttl=metadata_ttl)
 
-    def project_has_custom_state_bundle(self, project_id: str, queue_key: str) -> bool:
-        """Проверка, есть ли у проекта кастомный state bundle для данной очереди"""
+    def project_has_custom_state_bundle(self, project_id: str, queue_key: str, statuses: List[Dict]) -> bool:
+        """Проверка, есть ли у проекта state bundle для набора статусов очереди
+        (общий bundle этого набора или bundle, созданный ранее отдельно для очереди)"""
         try:
             response = self.session.get(
                 f"{self.base_url}/api/admin/projects/{project_id}/customFields",
@@ -77,8 +83,8 @@ class YouTrackClient:
                     if field.get('field', {}).get('name') == 'State':
                         bundle_name = field.get('bundle', {}).get('name', '')
                         # Проверяем, что это НАШ bundle для данной очереди
-                        expected_bundle_name = f"{queue_key} States"
-                        if bundle_name == expected_bundle_name:
+                        expected_bundle_names = {shared_bundle_name(status_set_digest(statuses)), f"{queue_key} States"}
+                        if bundle_name in expected_bundle_names:
                             logger.debug(f"    ✓ Проект уже имеет наш state bundle: {bundle_name}")
                             return True
                         elif bundle_name and not bundle_name.startswith('Default'):
@@ -136,14 +142,16 @@ class YouTrackClient:
                 else:
                     logger.warning(f"    ⚠ Не удалось удалить поле State: {delete_response.status_code}")
 
-            # Если bundle был создан нами (содержит имя очереди), удаляем его полностью
-            if bundle_id and (queue_key in bundle_name or 'States' in bundle_name):
+            # Если bundle был создан нами для этой очереди, удаляем его полностью
+            # (общие bundles используются другими проектами и не удаляются)
+            if bundle_id and not is_shared_bundle(bundle_name) and (queue_key in bundle_name or 'States' in bundle_name):
                 try:
                     bundle_delete_response = self.session.delete(
                         f"{self.base_url}/api/admin/customFieldSettings/bundles/state/{bundle_id}"
                     )
 
                     if bundle_delete_response.status_code in [200, 204]:
+                        self.metadata.invalidate('state_bundles')
                         logger.info(f"    ✓ State bundle '{bundle_name}' удален")
                     else:
                         logger.debug(f"    ℹ Не удалось удалить bundle (возможно используется в других проектах)")
@@ -165,19 +173,9 @@ class YouTrackClient:
             else:
                 bundle_name = f"{base_name} v{attempt}"
 
-            # Подготавливаем состояния для bundle
-            bundle_states = []
-            for status in statuses:
-                state_data = {
-                    'name': status.get('name', status.get('key')),
-                    'description': status.get('description', ''),
-                    'color': {'id': status.get('color', '#6B73FF').replace('#', '')}
-                }
-                bundle_states.append(state_data)
-
             bundle_data = {
                 'name': bundle_name,
-                'states': bundle_states
+                'states': bundle_states(statuses)
             }
 
             response = self.session.post(
@@ -188,6 +186,7 @@ class YouTrackClient:
 
             if response.status_code in [200, 201]:
                 created_bundle = response.json()
+                self.metadata.add_state_bundle(created_bundle)
                 logger.info(f"    ✓ Создан state bundle: {bundle_name}")
                 return created_bundle.get('id')
             elif response.status_code == 400 and 'не является уникальным' in response.text and attempt < 10:
@@ -204,20 +203,8 @@ class YouTrackClient:
     def assign_state_bundle_to_project(self, project_id: str, bundle_id: str) -> bool:
         """Назначение state bundle проекту"""
         try:
-            # Находим State field
-            response = self.session.get(
-                f"{self.base_url}/api/admin/customFieldSettings/customFields",
-                params={'fields': 'id,name,fieldType', '$top': 100}
-            )
-
-            state_field_id = None
-            if response.status_code == 200:
-                fields = response.json()
-                for field in fields:
-                    if field.get('name') == 'State' and 'state' in field.get('fieldType', '').lower():
-                        state_field_id = field.get('id')
-                        break
-
+            # Находим State field (из кэша метаданных)
+            state_field_id = self.metadata.state_field_id()
             if not state_field_id:
                 logger.warning(f"    ⚠ Не найдено поле State")
                 return False
@@ -271,6 +258,7 @@ def main():
     logger.info("=" * 60)
 
     config = load_config()
+    configure_http(config)
     project_mapping = load_project_mapping()
 
     if not project_mapping:
@@ -288,11 +276,18 @@ def main():
         is_cloud_org
     )
 
+    store = open_mapping_store()
     youtrack_client = YouTrackClient(
         config['youtrack']['url'],
-        config['youtrack']['token']
+        config['youtrack']['token'],
+        store,
+        metadata_ttl=metadata_ttl(config)
     )
 
+    # Очереди с одинаковым набором статусов получают один общий bundle
+    bundles = SharedStateBundles(store, youtrack_client.metadata,
+                                 youtrack_client.create_unique_state_bundle)
+
     # Обрабатываем каждый проект
     success_count = 0
     skip_count = 0
@@ -301,8 +296,16 @@ def main():
     for i, (queue_key, project_id) in enumerate(project_mapping.items(), 1):
         logger.info(f"[{i}/{len(project_mapping)}] 📁 Обрабатываем проект: {queue_key}")
 
+        # Получаем статусы из Yandex Tracker
+        statuses = yandex_client.get_queue_statuses(queue_key)
+
+        if not statuses:
+            logger.warning(f"  ⚠ Нет статусов для проекта {queue_key}")
+            error_count += 1
+            continue
+
         # Проверяем, есть ли уже наш кастомный state bundle
-        if youtrack_client.project_has_custom_state_bundle(project_id, queue_key):
+        if youtrack_client.project_has_custom_state_bundle(project_id, queue_key, statuses):
             logger.info(f"  ⏭ Проект {queue_key} уже имеет настроенные состояния из Yandex Tracker")
             skip_count += 1
             continue
@@ -314,19 +317,8 @@ def main():
             error_count += 1
             continue
 
-        # Получаем статусы из Yandex Tracker
-        statuses = yandex_client.get_queue_statuses(queue_key)
-
-        if not statuses:
-            logger.warning(f"  ⚠ Нет статусов для проекта {queue_key}")
-            error_count += 1
-            continue
-
-        # Создаем уникальное имя для bundle
-        bundle_base_name = f"{queue_key} States"
-
-        # Создаем state bundle с уникальным именем
-        bundle_id = youtrack_client.create_unique_state_bundle(bundle_base_name, statuses)
+        # Общий bundle набора статусов (создается для первой очереди с этим набором)
+        bundle_id = bundles.bundle_for(statuses)
         if not bundle_id:
             error_count += 1
             continue
@@ -338,15 +330,14 @@ def main():
         else:
             error_count += 1
 
-        # Пауза между проектами
-        time.sleep(2)
-
     # Финальная статистика
     logger.info("=" * 60)
     logger.info("РЕЗУЛЬТАТЫ МИГРАЦИИ СТАТУСОВ:")
     logger.info(f"✓ Успешно настроено: {success_count}")
     logger.info(f"⏭ Пропущено (уже настроены): {skip_count}")
     logger.info(f"✗ Ошибок: {error_count}")
+    logger.info(f"🎨 State bundles: создано {bundles.stats['created']}, переиспользовано {bundles.stats['reused']}")
+    log_http_stats(logger)
     logger.info("=" * 60)
 
     if error_count == 0:
@@ -3,14 +3,38 @@
    Yandex Tracker  YouTrack  state bundles
 """
 
-import requests
 import json
-import time
 import logging
 
+from mapping_store import open_mapping_store
+from migration_http import configure_http, create_session
+from state_bundles import SharedStateBundles, bundle_states
+from youtrack_metadata import YouTrackMetadata, metadata_ttl
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Общая сессия с лимитом запросов по хостам
+session = create_session()
+
+# Хранилище migration_state.db и кэш метаданных YouTrack (поле State), создаются при первом обращении
+store = None
+metadata = None
+
+def get_store():
+    global store
+    if store is None:
+        store = open_mapping_store()
+    return store
+
+def get_metadata(config):
+    global metadata
+    if metadata is None:
+        headers = {'Authorization': f"Bearer {config['youtrack']['token']}"}
+        metadata = YouTrackMetadata(session, config['youtrack']['url'], get_store(), headers=headers,
+                                    ttl=metadata_ttl(config))
+    return metadata
+
 def load_config():
     with open('migration_config.json', 'r') as f:
         return json.load(f)
@@ -28,7 +52,7 @@ def get_yandex_queue_statuses(config, queue_key):
     }
     
     try:
-        response = requests.get(
+        response = session.get(
             f'https://api.tracker.yandex.net/v2/queues/{queue_key}/statuses',
             headers=headers
         )
@@ -54,25 +78,13 @@ def create_state_bundle(config, bundle_name, statuses):
     
     base_url = config['youtrack']['url'].rstrip('/')
     
-    #    bundle
-    bundle_states = []
-    for status in statuses:
-        state_data = {
-            'name': status.get('name', status.get('key')),
-            'description': status.get('description', ''),
-            'color': {
-                'id': status.get('color', '#6B73FF').replace('#', '')
-            }
-        }
-        bundle_states.append(state_data)
-    
     bundle_data = {
         'name': bundle_name,
-        'states': bundle_states
+        'states': bundle_states(statuses)
     }
     
     try:
-        response = requests.post(
+        response = session.post(
             f"{base_url}/api/admin/customFieldSettings/bundles/state",
             headers=headers,
             json=bundle_data,
@@ -81,6 +93,7 @@ def create_state_bundle(config, bundle_name, statuses):
         
         if response.status_code in [200, 201]:
             created_bundle = response.json()
+            get_metadata(config).add_state_bundle(created_bundle)
             logger.info(f"  state bundle: {bundle_name} (ID: {created_bundle.get('id')})")
             return created_bundle.get('id')
         else:
@@ -102,20 +115,8 @@ def assign_bundle_to_project(config, project_id, bundle_id):
     
     #   State field
     try:
-        #   
-        response = requests.get(
-            f"{base_url}/api/admin/customFieldSettings/customFields",
-            headers=headers,
-            params={'fields': 'id,name,fieldType', '$top': 100}
-        )
-        
-        state_field_id = None
-        if response.status_code == 200:
-            fields = response.json()
-            for field in fields:
-                if field.get('name') == 'State' and 'state' in field.get('fieldType', '').lower():
-                    state_field_id = field.get('id')
-                    break
+        # Поле State берется из кэша метаданных
+        state_field_id = get_metadata(config).state_field_id()
         
         if not state_field_id:
             logger.error(f"   State")
@@ -127,7 +128,7 @@ def assign_bundle_to_project(config, project_id, bundle_id):
             'bundle': {'id': bundle_id}
         }
         
-        response = requests.post(
+        response = session.post(
             f"{base_url}/api/admin/projects/{project_id}/customFields",
             headers=headers,
             json=custom_field_data,
@@ -151,6 +152,7 @@ def assign_bundle_to_project(config, project_id, bundle_id):
 def migrate_project_statuses():
     """   """
     config = load_config()
+    configure_http(config)
     project_mapping = load_project_mapping()
     
     if not project_mapping:
@@ -159,6 +161,10 @@ def migrate_project_statuses():
     
     logger.info(f"     {len(project_mapping)} ")
     
+    # Очереди с одинаковым набором статусов получают один общий bundle
+    bundles = SharedStateBundles(get_store(), get_metadata(config),
+                                 lambda bundle_name, statuses: create_state_bundle(config, bundle_name, statuses))
+    
     success_count = 0
     skip_count = 0
     error_count = 0
@@ -181,11 +187,8 @@ def migrate_project_statuses():
         
         logger.info(f"     {len(yandex_statuses)}   Yandex")
         
-        #     bundle
-        bundle_name = f"{queue_key} States"
-        
-        #  state bundle
-        bundle_id = create_state_bundle(config, bundle_name, yandex_statuses)
+        # Общий state bundle набора статусов
+        bundle_id = bundles.bundle_for(yandex_statuses)
         
         if bundle_id:
             #  bundle 
@@ -199,9 +202,6 @@ def migrate_project_statuses():
             error_count += 1
             logger.error(f"       bundle  {queue_key}")
         
-        #   
-        time.sleep(2)
-        
         #    5 
         if i % 5 == 0:
             logger.info(f"     : {success_count} {skip_count} {error_count}")
@@ -211,6 +211,7 @@ def migrate_project_statuses():
     logger.info(f" : {success_count}")
     logger.info(f" : {skip_count}")
     logger.info(f" : {error_count}")
+    logger.info(f" State bundles: создано {bundles.stats['created']}, переиспользовано {bundles.stats['reused']}")
     
     if success_count > 0:
         logger.info(f"\n :")
@@ -7,56 +7,118 @@
 import requests
 import json
 import logging
-from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
 from datetime import datetime
 import argparse
+from requests.adapters import HTTPAdapter
+
+from mapping_store import JSON_MAPPINGS, MappingStore, open_mapping_store
+from migration_http import configure_http, create_session
+from youtrack_metadata import YouTrackMetadata
 
 logger = logging.getLogger(__name__)
 
+# Размер страницы при чтении задач проекта для удаления
+DELETE_PAGE_SIZE = 500
+
+# Контрольные точки отката в migration_state.db (раздел sync_state):
+# rollback:<ID проекта> - все задачи удалены, rollback:<ID проекта>:deleted - удалено задач.
+# После удаления проекта они стираются вместе с остальными записями его очереди
+ROLLBACK_ISSUES_DONE = 'issues_deleted'
+
+def rollback_state_key(project_id: str) -> str:
+    return f"rollback:{project_id}"
+
+def rollback_state_names(project_id: str) -> List[str]:
+    return [rollback_state_key(project_id), f"{rollback_state_key(project_id)}:deleted"]
+
 class MigrationCleanup:
     """Класс для очистки данных миграции"""
 
-    def __init__(self, youtrack_url: str, youtrack_token: str):
+    def __init__(self, youtrack_url: str, youtrack_token: str, max_workers: int = 8,
+                 store: Optional[MappingStore] = None):
         self.youtrack_url = youtrack_url.rstrip('/')
         self.youtrack_token = youtrack_token
-        self.session = requests.Session()
+        self.max_workers = max(1, max_workers)
+        # Контрольные точки отката (без хранилища откат начинается каждый раз заново)
+        self.store = store
+        self.session = create_session()
+        # Пул соединений должен вмещать все рабочие потоки
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         self.session.headers.update({
             'Authorization': f'Bearer {youtrack_token}',
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         })
-
-    def delete_issues_by_project(self, project_id: str) -> int:
-        """Удаление всех задач проекта"""
-        try:
-            # Получаем все задачи проекта
+        # Кэш метаданных этапов: удаленный проект сбрасывает список проектов
+        self.metadata = YouTrackMetadata(self.session, self.youtrack_url, store) if store else None
+
+    def iter_project_issue_pages(self, project_id: str, failed: set) -> Iterator[List[Dict]]:
+        """Постраничное чтение задач проекта, которые еще не удалялись.
+        Удаленные задачи исчезают из выдачи, поэтому каждая страница читается с начала.
+        Задачи, удалить которые не удалось, могут оказаться в любом месте выдачи: страница
+        увеличивается на их число, чтобы в ней оставалось до DELETE_PAGE_SIZE новых задач"""
+        while True:
             response = self.session.get(
                 f"{self.youtrack_url}/api/admin/projects/{project_id}/issues",
-                params={'fields': 'id,idReadable', '$top': -1}
+                params={'fields': 'id,idReadable', '$top': DELETE_PAGE_SIZE + len(failed), '$skip': 0}
             )
             response.raise_for_status()
-            issues = response.json()
-
-            deleted_count = 0
-            for issue in issues:
-                try:
-                    delete_response = self.session.delete(
-                        f"{self.youtrack_url}/api/issues/{issue['id']}"
-                    )
-                    if delete_response.status_code == 200:
-                        deleted_count += 1
-                        logger.debug(f"Удалена задача {issue['idReadable']}")
-                    else:
-                        logger.warning(f"Не удалось удалить задачу {issue['idReadable']}")
-                except Exception as e:
-                    logger.error(f"Ошибка удаления задачи {issue['id']}: {e}")
-
-            logger.info(f"Удалено {deleted_count} задач из проекта {project_id}")
-            return deleted_count
+            page = [issue for issue in response.json() if issue['id'] not in failed]
+            if not page:
+                return
+            yield page
+
+    def delete_issue(self, issue: Dict) -> bool:
+        """Удаление одной задачи (уже удаленная задача считается удаленной)"""
+        try:
+            delete_response = self.session.delete(f"{self.youtrack_url}/api/issues/{issue['id']}")
+            if delete_response.status_code in (200, 404):
+                logger.debug(f"Удалена задача {issue.get('idReadable')}")
+                return True
+            logger.warning(f"Не удалось удалить задачу {issue.get('idReadable')}: {delete_response.status_code}")
+        except requests.RequestException as e:
+            logger.error(f"Ошибка удаления задачи {issue['id']}: {e}")
+        return False
+
+    def delete_issues_by_project(self, project_id: str) -> int:
+        """Удаление всех задач проекта: задачи читаются страницами и удаляются в max_workers потоках.
+        После каждой страницы число удаленных задач сохраняется в контрольной точке,
+        а после прохода по всем задачам проект отмечается этапом issues_deleted"""
+        state_key = rollback_state_names(project_id)[1]
+        previously_deleted = int(self.store.get_state(state_key) or 0) if self.store else 0
+        deleted_count = 0
+        failed: set = set()
+        complete = True
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='delete') as executor:
+                for page in self.iter_project_issue_pages(project_id, failed):
+                    for issue, deleted in zip(page, executor.map(self.delete_issue, page)):
+                        if deleted:
+                            deleted_count += 1
+                        else:
+                            failed.add(issue['id'])
+
+                    if self.store:
+                        self.store.set_state(state_key, str(previously_deleted + deleted_count))
+                    logger.info(f"  Проект {project_id}: удалено {previously_deleted + deleted_count} задач")
 
         except requests.RequestException as e:
             logger.error(f"Ошибка получения задач проекта {project_id}: {e}")
-            return 0
+            complete = False
+
+        if failed:
+            # Проект с неудаленными задачами не удаляется: повторный запуск попробует их снова
+            logger.warning(f"Не удалось удалить {len(failed)} задач из проекта {project_id}")
+            complete = False
+        if complete and self.store:
+            self.store.set_state(rollback_state_key(project_id), ROLLBACK_ISSUES_DONE)
+        logger.info(f"Удалено {deleted_count} задач из проекта {project_id}")
+        return deleted_count
 
     def delete_project(self, project_id: str) -> bool:
         """Удаление проекта"""
@@ -67,6 +129,9 @@ class MigrationCleanup:
 
             if response.status_code == 200:
                 logger.info(f"Удален проект {project_id}")
+                # Иначе этап 2 до истечения срока кэша считал бы проект существующим
+                if self.metadata:
+                    self.metadata.invalidate('projects')
                 return True
             else:
                 logger.error(f"Не удалось удалить проект {project_id}: {response.status_code}")
@@ -106,19 +171,43 @@ class MigrationCleanup:
         }
 
         # Удаляем задачи (сначала задачи, потом проекты)
-        issue_mapping = mappings.get('issues', {})
         project_mapping = mappings.get('projects', {})
 
+        # Проекты, которых уже нет в хранилище, откачены полностью (или созданы заново с новым ID)
+        if self.store:
+            rolled_back = [queue_key for queue_key, project_id in project_mapping.items()
+                           if self.store.get('projects', queue_key) != project_id]
+            if rolled_back:
+                logger.info(f"Проекты уже откачены, пропускаем: {', '.join(rolled_back)}")
+            project_mapping = {queue_key: project_id for queue_key, project_id in project_mapping.items()
+                               if queue_key not in rolled_back}
+
+        # Контрольные точки прерванного отката: задачи этих проектов уже удалены
+        stages = {project_id: self.store.get_state(rollback_state_key(project_id)) if self.store else None
+                  for project_id in project_mapping.values()}
+        skipped = sum(1 for stage in stages.values() if stage)
+        if skipped:
+            logger.info(f"Продолжение прерванного отката: задачи уже удалены в {skipped} проектах")
+
         logger.info("Удаление задач...")
-        for project_id in project_mapping.values():
-            deleted_count = self.delete_issues_by_project(project_id)
-            stats['deleted_issues'] += deleted_count
+        for project_id, stage in stages.items():
+            if not stage:
+                deleted_count = self.delete_issues_by_project(project_id)
+                stats['deleted_issues'] += deleted_count
 
         # Удаляем проекты
         logger.info("Удаление проектов...")
-        for project_id in project_mapping.values():
+        for queue_key, project_id in project_mapping.items():
+            # Проект, список задач которого прочитан не до конца, удаляется при повторном запуске
+            if self.store and self.store.get_state(rollback_state_key(project_id)) != ROLLBACK_ISSUES_DONE:
+                logger.warning(f"Задачи проекта {project_id} удалены не полностью, проект пропущен")
+                continue
             if self.delete_project(project_id):
                 stats['deleted_projects'] += 1
+                if self.store:
+                    # Без этого повторная миграция сочла бы задачи очереди уже перенесенными
+                    purged = self.store.purge_queue(queue_key, rollback_state_names(project_id))
+                    logger.info(f"Из хранилища удалены записи очереди {queue_key} (задач: {purged})")
 
         # Удаляем пользователей (осторожно!)
         user_mapping = mappings.get('users', {})
@@ -130,9 +219,11 @@ class MigrationCleanup:
         confirmation = input().lower()
 
         if confirmation == 'yes':
-            for user_id in user_mapping.values():
+            for user_login, user_id in user_mapping.items():
                 if self.delete_user(user_id):
                     stats['deleted_users'] += 1
+                    if self.store:
+                        self.store.delete('users', user_login)
         else:
             logger.info("Удаление пользователей пропущено")
 
@@ -203,7 +294,7 @@ class BackupManager:
     def __init__(self, youtrack_url: str, youtrack_token: str):
         self.youtrack_url = youtrack_url.rstrip('/')
         self.youtrack_token = youtrack_token
-        self.session = requests.Session()
+        self.session = create_session()
         self.session.headers.update({
             'Authorization': f'Bearer {youtrack_token}',
             'Content-Type': 'application/json',
@@ -300,8 +391,11 @@ def main():
         logger.error(f"Файл конфигурации {args.config} не найден")
         return
 
+    configure_http(config)
+
     youtrack_url = config['youtrack']['url']
     youtrack_token = config['youtrack']['token']
+    max_workers = config.get('migration_options', {}).get('max_workers', 8)
 
     if args.action == 'backup':
         # Создание резервных копий
@@ -319,14 +413,19 @@ def main():
             logger.error(f"Файл маппингов {args.mappings} не найден")
             return
 
-        cleanup = MigrationCleanup(youtrack_url, youtrack_token)
-
         print("ВНИМАНИЕ: Это действие удалит ВСЕ данные, созданные во время миграции!")
         print("Вы уверены, что хотите продолжить? (yes/no): ")
         confirmation = input().lower()
 
         if confirmation == 'yes':
+            # Контрольные точки позволяют продолжить прерванный откат повторным запуском
+            store = open_mapping_store()
+            cleanup = MigrationCleanup(youtrack_url, youtrack_token, max_workers, store)
             stats = cleanup.rollback_migration(mappings)
+            # JSON-копии маппингов тоже очищаются, иначе open_mapping_store вернул бы удаленные записи
+            for kind in JSON_MAPPINGS:
+                store.export_json(kind)
+            store.close()
             logger.info(f"Откат завершен: {stats}")
         else:
             logger.info("Откат отменен")
@@ -344,7 +443,7 @@ def main():
             logger.error(f"Файл конфигурации очистки {args.cleanup_config} не найден")
             return
 
-        cleanup = MigrationCleanup(youtrack_url, youtrack_token)
+        cleanup = MigrationCleanup(youtrack_url, youtrack_token, max_workers)
         stats = cleanup.selective_cleanup(cleanup_config)
         logger.info(f"Селективная очистка завершена: {stats}")
 
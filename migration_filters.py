@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Фильтры миграции из раздела filtering конфигурации
+Ограничивают очереди (specific_queues, exclude_queues) и задачи по дате создания (date_range).
+Ограничения передаются в сами запросы к Yandex Tracker (список очередей и фильтр _search),
+поэтому тестовая или частичная миграция не выгружает данные всей организации
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+def queue_of(issue_key: str) -> str:
+    """Ключ очереди по ключу задачи (DEV-123 -> DEV)"""
+    return (issue_key or '').rsplit('-', 1)[0]
+
+@dataclass(frozen=True)
+class MigrationFilters:
+    """Ограничения миграции; пустые фильтры пропускают все очереди и задачи"""
+    specific_queues: Tuple[str, ...] = ()
+    exclude_queues: Tuple[str, ...] = ()
+    created_from: Optional[str] = None
+    created_to: Optional[str] = None
+
+    @classmethod
+    def from_config(cls, config: Dict) -> 'MigrationFilters':
+        return cls.from_dict(config.get('filtering') or {})
+
+    @classmethod
+    def from_dict(cls, filtering: Dict) -> 'MigrationFilters':
+        date_range = filtering.get('date_range') or {}
+        return cls(
+            specific_queues=tuple(filtering.get('specific_queues') or ()),
+            exclude_queues=tuple(filtering.get('exclude_queues') or ()),
+            created_from=date_range.get('from') or None,
+            created_to=date_range.get('to') or None
+        )
+
+    def to_dict(self) -> Dict:
+        """Представление в формате раздела filtering конфигурации"""
+        return {
+            'specific_queues': list(self.specific_queues),
+            'exclude_queues': list(self.exclude_queues),
+            'date_range': {'from': self.created_from, 'to': self.created_to}
+        }
+
+    @property
+    def active(self) -> bool:
+        return bool(self.specific_queues or self.exclude_queues or self.created_from or self.created_to)
+
+    def queue_allowed(self, queue_key: str) -> bool:
+        if self.specific_queues and queue_key not in self.specific_queues:
+            return False
+        return queue_key not in self.exclude_queues
+
+    def filter_queues(self, queues: List[Dict]) -> List[Dict]:
+        """Очереди Yandex Tracker, попадающие в миграцию"""
+        return [queue for queue in queues if self.queue_allowed(queue.get('key'))]
+
+    def filter_mapping(self, mapping: Dict[str, str], key_to_queue=lambda key: key) -> Dict[str, str]:
+        """Записи маппинга, относящиеся к разрешенным очередям"""
+        return {key: value for key, value in mapping.items() if self.queue_allowed(key_to_queue(key))}
+
+    def issue_filter(self, queue_key: Optional[str] = None) -> Dict:
+        """Фильтр для POST /v2/issues/_search"""
+        issue_filter: Dict = {}
+        if queue_key:
+            issue_filter['queue'] = queue_key
+        created = {name: value for name, value in (('from', self.created_from), ('to', self.created_to)) if value}
+        if created:
+            issue_filter['created'] = created
+        return issue_filter
+
+    def matches_issue(self, issue: Dict) -> bool:
+        """Проверка уже выгруженной задачи (например, из снимка) без запроса к API.
+        Границы дат сравниваются с той же точностью, с какой заданы: дата 'to' включает весь день"""
+        if not self.queue_allowed(queue_of(issue.get('key'))):
+            return False
+        created_at = issue.get('createdAt') or ''
+        if self.created_from and created_at[:len(self.created_from)] < self.created_from:
+            return False
+        if self.created_to and created_at[:len(self.created_to)] > self.created_to:
+            return False
+        return True
+
+    def covers(self, other: 'MigrationFilters') -> bool:
+        """Все очереди и задачи, разрешенные фильтром other, разрешены и этим фильтром"""
+        if self.specific_queues:
+            other_queues = set(other.specific_queues) - set(other.exclude_queues)
+            if not other.specific_queues or not other_queues <= set(self.specific_queues):
+                return False
+        if any(other.queue_allowed(queue_key) for queue_key in self.exclude_queues):
+            return False
+        if self.created_from and (not other.created_from or other.created_from < self.created_from):
+            return False
+        if self.created_to and (not other.created_to or other.created_to > self.created_to):
+            return False
+        return True
+
+    def describe(self) -> str:
+        parts = []
+        if self.specific_queues:
+            parts.append(f"очереди: {', '.join(self.specific_queues)}")
+        if self.exclude_queues:
+            parts.append(f"кроме очередей: {', '.join(self.exclude_queues)}")
+        if self.created_from or self.created_to:
+            parts.append(f"созданы: {self.created_from or '...'} - {self.created_to or '...'}")
+        return '; '.join(parts) or 'нет'
+
+def load_filters(config: Dict) -> MigrationFilters:
+    """Фильтры из конфигурации с записью в лог, если они заданы"""
+    filters = MigrationFilters.from_config(config)
+    if filters.active:
+        logger.info(f"🔎 Фильтры миграции: {filters.describe()}")
+    return filters
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Общий HTTP-слой для всех этапов миграции
+Адаптивное ограничение скорости запросов: отдельный token bucket на каждый хост
+(Yandex Tracker, YouTrack, Hub), который ускоряется до реального лимита сервера
+и замедляется по 429/503, Retry-After и заголовкам X-RateLimit-*.
+Повтор запросов с экспоненциальной задержкой и jitter по классам ошибок
+"""
+
+import time
+import random
+import logging
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+logger = logging.getLogger(__name__)
+
+# Время жизни scroll-курсора Yandex Tracker: общее для этапа 3 и выгрузки снимка,
+# курсор должен пережить обработку самой долгой страницы
+SCROLL_TTL_MS = 10 * 60 * 1000
+
+# Статусы, которыми сервер сообщает о превышении лимита
+THROTTLE_STATUSES = (429, 503)
+
+# Методы, повтор которых не создает дублей.
+# 502/504 и прочие 5xx повторяются только для них: шлюз мог не дождаться ответа
+# от YouTrack, который уже выполнил запись, и повтор POST создал бы дубль задачи,
+# комментария или проекта. POST повторяется только при отказе в соединении
+# (запрос не отправлен), при 429 и при 503 с Retry-After (запрос отклонен лимитом).
+# Читающие POST (_search постранично, _count, issuesGetter) передают idempotent=True
+# и повторяются как GET; продолжение scroll-курсора (scrollId) так не помечается:
+# повтор мог бы пропустить страницу
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+class TokenBucket:
+    """Token bucket с адаптивной скоростью (увеличение при успехах, уменьшение вдвое при 429/503)"""
+
+    def __init__(self, name: str, rate: float, max_rate: float, min_rate: float = 0.2,
+                 burst: float = 5.0, increase_every: int = 10, increase_factor: float = 1.25):
+        self.name = name
+        self.rate = rate
+        self.max_rate = max(max_rate, rate)
+        self.min_rate = min(min_rate, rate)
+        self.burst = max(1.0, burst)
+        self.increase_every = increase_every
+        self.increase_factor = increase_factor
+
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.success_streak = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Ожидание свободного токена"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Приостановка всех запросов к хосту"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = min(self.tokens, 0.0)
+
+    def on_response(self, response: requests.Response):
+        """Подстройка скорости по ответу сервера"""
+        headers = response.headers
+        retry_after = parse_retry_after(headers.get('Retry-After'))
+
+        with self.lock:
+            now = time.monotonic()
+
+            if response.status_code in THROTTLE_STATUSES:
+                self.success_streak = 0
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.paused_until = max(self.paused_until, now + (retry_after or 1 / self.rate))
+                self.tokens = min(self.tokens, 0.0)
+                logger.warning(f"⏳ {self.name}: получен {response.status_code}, "
+                               f"скорость снижена до {self.rate:.2f} запр/с")
+                return
+
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+
+            # Заголовки лимита: при исчерпании ждем сброса окна, иначе делим остаток на время до сброса
+            remaining = _header_number(headers, ('X-RateLimit-Remaining', 'RateLimit-Remaining'))
+            reset = parse_rate_limit_reset(headers)
+            if remaining is not None and reset:
+                if remaining <= 0:
+                    self.paused_until = max(self.paused_until, now + reset)
+                    return
+                self.rate = max(self.min_rate, min(self.max_rate, remaining / reset))
+                return
+
+            self.success_streak += 1
+            if self.success_streak >= self.increase_every and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate * self.increase_factor)
+                self.success_streak = 0
+                logger.debug(f"{self.name}: скорость увеличена до {self.rate:.2f} запр/с")
+
+def _header_number(headers, names) -> Optional[float]:
+    for name in names:
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Разбор Retry-After: число секунд или HTTP-дата"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def parse_rate_limit_reset(headers) -> Optional[float]:
+    """Секунды до сброса окна лимита (заголовок может содержать как интервал, так и unix-время)"""
+    reset = _header_number(headers, ('X-RateLimit-Reset', 'RateLimit-Reset'))
+    if reset is None:
+        return None
+    if reset > 1_000_000_000:
+        reset -= time.time()
+    return max(0.0, reset) or None
+
+class RateLimiterRegistry:
+    """Набор token bucket'ов: один бюджет на хост"""
+
+    def __init__(self, rate: float = 2.0, max_rate: float = 50.0):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.lock = threading.Lock()
+
+    def configure(self, rate: float, max_rate: float):
+        with self.lock:
+            self.rate = rate
+            self.max_rate = max_rate
+            self.buckets.clear()
+
+    def bucket_for(self, url: str) -> TokenBucket:
+        name = budget_name(url)
+        with self.lock:
+            bucket = self.buckets.get(name)
+            if bucket is None:
+                bucket = TokenBucket(name, self.rate, self.max_rate)
+                self.buckets[name] = bucket
+            return bucket
+
+def budget_name(url: str) -> str:
+    """Имя бюджета: хост, а для Hub API на том же хосте - отдельный бюджет"""
+    parsed = urlparse(url)
+    if parsed.path.startswith('/hub/'):
+        return f"{parsed.netloc}/hub"
+    return parsed.netloc
+
+rate_limiters = RateLimiterRegistry()
+
+@dataclass
+class RetryPolicy:
+    """Политика повторов для одного класса ошибок"""
+    max_retries: int
+    base_delay: float
+    max_delay: float
+
+    def delay(self, attempt: int) -> float:
+        """Экспоненциальная задержка с полным jitter"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+# Классы ошибок: connect - сбой соединения, server - 5xx, throttle - 429
+retry_policies: Dict[str, RetryPolicy] = {
+    'connect': RetryPolicy(max_retries=3, base_delay=1.0, max_delay=30.0),
+    'server': RetryPolicy(max_retries=3, base_delay=2.0, max_delay=60.0),
+    'throttle': RetryPolicy(max_retries=6, base_delay=0.5, max_delay=10.0),
+}
+
+class HttpStats:
+    """Потокобезопасные счетчики запросов и повторов"""
+
+    def __init__(self):
+        self.counters = Counter()
+        self.lock = threading.Lock()
+
+    def add(self, name: str):
+        with self.lock:
+            self.counters[name] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counters)
+
+http_stats = HttpStats()
+
+def connection_refused(error: requests.RequestException) -> bool:
+    """Соединение не установлено: ни один байт запроса не отправлен"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    # requests оборачивает ошибку urllib3 в MaxRetryError с причиной в reason
+    reason = getattr(reason, 'reason', reason)
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+def classify_exception(error: requests.RequestException, idempotent: bool) -> Optional[str]:
+    """Класс ошибки соединения или None, если повтор небезопасен"""
+    if connection_refused(error):
+        return 'connect'
+    # Обрыв соединения или таймаут чтения: сервер мог успеть выполнить запрос - повторяем только идемпотентные
+    if isinstance(error, (requests.ReadTimeout, requests.ConnectionError)):
+        return 'connect' if idempotent else None
+    return None
+
+def classify_status(response: requests.Response, idempotent: bool) -> Optional[str]:
+    """Класс ошибки по HTTP-статусу или None, если ответ не требует повтора"""
+    status_code = response.status_code
+    if status_code == 429:
+        return 'throttle'
+    if status_code >= 500 and idempotent:
+        return 'server'
+    if status_code == 503 and response.headers.get('Retry-After'):
+        return 'throttle'
+    return None
+
+class RateLimitedSession(requests.Session):
+    """requests.Session с лимитером своего хоста и повтором временных ошибок"""
+
+    def request(self, method, url, *args, idempotent: Optional[bool] = None, **kwargs):
+        """idempotent - явная пометка безопасного повтора (по умолчанию определяется методом)"""
+        bucket = rate_limiters.bucket_for(url)
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            bucket.acquire()
+            http_stats.add('requests')
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except requests.RequestException as e:
+                error_class = classify_exception(e, idempotent)
+                if error_class is None or attempt >= retry_policies[error_class].max_retries:
+                    http_stats.add(f"failed_{error_class or 'other'}")
+                    raise
+                self._wait_before_retry(error_class, attempt, method, url, e)
+                attempt += 1
+                continue
+
+            bucket.on_response(response)
+
+            error_class = classify_status(response, idempotent)
+            if error_class is None:
+                return response
+            if attempt >= retry_policies[error_class].max_retries:
+                http_stats.add(f"failed_{error_class}")
+                return response
+            self._wait_before_retry(error_class, attempt, method, url, response.status_code)
+            attempt += 1
+
+    def _wait_before_retry(self, error_class: str, attempt: int, method: str, url: str, reason):
+        http_stats.add(f"retry_{error_class}")
+        delay = retry_policies[error_class].delay(attempt)
+        logger.debug(f"🔄 Повтор {attempt + 1} ({error_class}) {method} {url} через {delay:.1f}с: {reason}")
+        # Паузу по Retry-After для 429/503 выдерживает лимитер хоста, здесь только jitter сверху
+        time.sleep(delay)
+
+def configure_http(config: Dict):
+    """Настройка лимитов и повторов по migration_options из migration_config.json"""
+    migration_options = config.get('migration_options', {})
+    delay = migration_options.get('rate_limit_delay', 0.5)
+    max_rate = migration_options.get('max_requests_per_second', 50)
+    max_retries = migration_options.get('max_retries', 3)
+
+    # rate_limit_delay задает стартовый темп, дальше лимитер подстраивается под сервер
+    rate = 1 / delay if delay and delay > 0 else max_rate
+    rate_limiters.configure(min(rate, max_rate), max_rate)
+    logger.debug(f"Лимит запросов: старт {min(rate, max_rate):.2f} запр/с, максимум {max_rate} запр/с на хост")
+
+    # Отказы по лимиту повторяем дольше: они гарантированно не выполнялись сервером
+    retry_policies['connect'].max_retries = max_retries
+    retry_policies['server'].max_retries = max_retries
+    retry_policies['throttle'].max_retries = max(max_retries * 2, 1)
+
+def log_http_stats(target_logger: logging.Logger = logger):
+    """Вывод счетчиков запросов и повторов в конце этапа"""
+    stats = http_stats.snapshot()
+    retries = {k[len('retry_'):]: v for k, v in stats.items() if k.startswith('retry_')}
+    failures = {k[len('failed_'):]: v for k, v in stats.items() if k.startswith('failed_')}
+    retries_text = f"{sum(retries.values())} {retries}" if retries else "0"
+    failures_text = f"{sum(failures.values())} {failures}" if failures else "0"
+    target_logger.info(f"🌐 HTTP: запросов {stats.get('requests', 0)}, "
+                       f"повторов {retries_text}, неустранимых ошибок {failures_text}")
+
+def create_session() -> RateLimitedSession:
+    """Создание сессии с общим для всех клиентов лимитом по хостам"""
+    return RateLimitedSession()
@@ -4,15 +4,100 @@
 Проверяет корректность перенесенных данных и создает детальные отчеты
 """
 
+import math
+import random
 import requests
 import json
+import time
+import hashlib
 import logging
-from typing import Dict, List, Tuple, Any
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from datetime import datetime
 from dataclasses import dataclass
+from requests.adapters import HTTPAdapter
+
+from link_planner import LinkEdge, build_link_graph, parse_yandex_links
+from mapping_store import MappingStore, open_mapping_store
+from migration_filters import MigrationFilters, load_filters, queue_of
+from migration_http import configure_http, create_session
+from step3_issues_migration import comment_key, format_comment, format_issue_description
+from step4_links_migration import YouTrackClient as LinkClient
+from yandex_snapshot import YandexExportClient, open_snapshot
+from youtrack_metadata import metadata_ttl
 
 logger = logging.getLogger(__name__)
 
+# Сколько ключей перечислять в тексте ошибки
+MAX_LISTED_KEYS = 20
+
+# Повторы запроса количества задач YouTrack, пока оно вычисляется (count = -1)
+COUNT_ATTEMPTS = 10
+COUNT_RETRY_DELAY = 0.5
+
+def listed(keys) -> str:
+    """Первые MAX_LISTED_KEYS ключей через запятую"""
+    keys = sorted(keys)
+    text = ', '.join(keys[:MAX_LISTED_KEYS])
+    if len(keys) > MAX_LISTED_KEYS:
+        text += f" и еще {len(keys) - MAX_LISTED_KEYS}"
+    return text
+
+# Поля задач YouTrack для сверки графа связей
+LINK_FIELDS = 'id,links(direction,linkType(name),issues(id))'
+
+# Поля задач YouTrack для сверки содержимого
+CHECKSUM_FIELDS = 'id,idReadable,summary,description,comments(id,text,deleted)'
+
+# Сколько задач YouTrack запрашивать одним POST /api/issuesGetter
+GETTER_BATCH_SIZE = 100
+
+def normalize_text(text: Optional[str]) -> str:
+    """Текст без различий, которые вносит хранение в YouTrack: переводы строк и пробелы в концах строк"""
+    lines = (text or '').replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines).strip()
+
+def checksum(*parts: Optional[str]) -> str:
+    """Контрольная сумма нормализованного содержимого"""
+    normalized = [normalize_text(part) for part in parts]
+    return hashlib.sha256(json.dumps(normalized, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+# z-квантиль для 95% доверительного интервала
+CONFIDENCE_Z = 1.96
+
+# Допустимая доля ошибок для выборочной проверки (верхняя граница интервала)
+MAX_ERROR_RATE = 0.01
+
+def allocate_sample(sizes: Dict[str, int], budget: int) -> Dict[str, int]:
+    """Распределение выборки по проектам пропорционально их размеру (метод наибольших остатков)"""
+    total = sum(sizes.values())
+    if budget >= total:
+        return dict(sizes)
+    quotas = {name: budget * size / total for name, size in sizes.items()}
+    allocation = {name: min(sizes[name], int(quota)) for name, quota in quotas.items()}
+    remaining = budget - sum(allocation.values())
+    for name in sorted(quotas, key=lambda name: quotas[name] - int(quotas[name]), reverse=True):
+        if remaining <= 0:
+            break
+        if allocation[name] < sizes[name]:
+            allocation[name] += 1
+            remaining -= 1
+    return allocation
+
+def wilson_interval(rate: float, n: int, z: float = CONFIDENCE_Z) -> Tuple[float, float]:
+    """Доверительный интервал Уилсона для доли rate по выборке размера n"""
+    if n == 0:
+        return 0.0, 1.0
+    denominator = 1 + z * z / n
+    center = (rate + z * z / (2 * n)) / denominator
+    margin = z * math.sqrt(rate * (1 - rate) / n + z * z / (4 * n * n)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+def project_query(queue_key: str) -> str:
+    """Запрос YouTrack по проекту (shortName проекта совпадает с ключом очереди)"""
+    return f"project: {{{queue_key}}}"
+
 @dataclass
 class ValidationResult:
     """Результат валидации"""
@@ -24,10 +109,22 @@ class ValidationResult:
 class MigrationValidator:
     """Класс для валидации результатов миграции"""
 
-    def __init__(self, yandex_client, youtrack_client, mappings: Dict):
+    def __init__(self, yandex_client, youtrack_client, mappings: Dict, filters: Optional[MigrationFilters] = None,
+                 max_workers: int = 8, store: Optional[MappingStore] = None,
+                 link_types: Optional[Dict[str, str]] = None):
         self.yandex_client = yandex_client
         self.youtrack_client = youtrack_client
-        self.mappings = mappings
+        self.filters = filters or MigrationFilters()
+        self.max_workers = max(1, max_workers)
+        # Хранилище со связями, полученными этапом 4, и типы связей YouTrack (get_link_types этапа 4)
+        self.store = store
+        self.link_types = link_types or {'relates': 'relates'}
+        # Проверяются только очереди и задачи, попадающие под фильтры миграции
+        self.mappings = dict(mappings)
+        if 'projects' in mappings:
+            self.mappings['projects'] = self.filters.filter_mapping(mappings['projects'])
+        if 'issues' in mappings:
+            self.mappings['issues'] = self.filters.filter_mapping(mappings['issues'], queue_of)
         self.validation_results = []
 
     def validate_users(self) -> ValidationResult:
@@ -50,7 +147,7 @@ class MigrationValidator:
             missing_users = []
             for yandex_user in yandex_users:
                 yandex_id = yandex_user.get('id')
-                if yandex_id not in user_mapping:
+                if str(yandex_id) not in user_mapping:
                     missing_users.append(yandex_user.get('login', yandex_id))
 
             if missing_users:
@@ -90,7 +187,7 @@ class MigrationValidator:
         stats = {}
 
         try:
-            yandex_queues = self.yandex_client.get_queues()
+            yandex_queues = self.filters.filter_queues(self.yandex_client.get_queues())
             project_mapping = self.mappings.get('projects', {})
 
             stats['yandex_queues_total'] = len(yandex_queues)
@@ -131,8 +228,42 @@ class MigrationValidator:
         success = len(errors) == 0
         return ValidationResult(success, errors, warnings, stats)
 
+    @property
+    def date_filtered(self) -> bool:
+        """Фильтр по дате создания: дата создания задачи в YouTrack - время переноса, поэтому
+        ограничить счетчик проекта YouTrack теми же датами, что и _count в Yandex Tracker, нельзя"""
+        return bool(self.filters.created_from or self.filters.created_to)
+
+    def count_project(self, queue_key: str) -> Dict[str, Optional[int]]:
+        """Количество задач очереди в Yandex Tracker и проекта в YouTrack
+        (при фильтре по датам задачи YouTrack не считаются)"""
+        return {
+            'yandex': self.yandex_client.count_issues(queue_key),
+            'youtrack': None if self.date_filtered else self.youtrack_client.count_issues(project_query(queue_key))
+        }
+
+    def counts_match(self, count: Dict[str, Optional[int]], mapped: int) -> bool:
+        """Совпадение количеств очереди, маппинга и (без фильтра по датам) проекта YouTrack"""
+        if self.date_filtered:
+            return count['yandex'] == mapped
+        return count['youtrack'] is not None and count['yandex'] == count['youtrack'] == mapped
+
+    def drill_down_project(self, queue_key: str, mapped: Dict[str, str]) -> Dict[str, List[str]]:
+        """Поиск расхождений в проекте с несовпавшими количествами: задачи без маппинга,
+        маппинги на отсутствующие задачи YouTrack и задачи YouTrack вне маппинга"""
+        yandex_keys = {issue.get('key') for issue in self.yandex_client.get_issues(queue_key)}
+        youtrack_ids = {issue.get('id') for issue in self.youtrack_client.iter_issues(project_query(queue_key), 'id')}
+        mapped_ids = set(mapped.values())
+        return {
+            'missing': sorted(yandex_keys - set(mapped)),
+            'invalid': sorted(key for key, issue_id in mapped.items() if issue_id not in youtrack_ids),
+            'extra': sorted(youtrack_ids - mapped_ids)
+        }
+
     def validate_issues(self) -> ValidationResult:
-        """Валидация миграции задач"""
+        """Валидация миграции задач по количествам: _count в Yandex Tracker и счетчик задач проекта
+        в YouTrack сравниваются с маппингом для всех проектов; подробная сверка ключей выполняется
+        только для проектов с расхождением"""
         logger.info("Валидация задач...")
 
         errors = []
@@ -143,14 +274,21 @@ class MigrationValidator:
             issue_mapping = self.mappings.get('issues', {})
             project_mapping = self.mappings.get('projects', {})
 
-            # Подсчитываем общее количество задач в Yandex Tracker
-            total_yandex_issues = 0
-            for queue_key in project_mapping.keys():
-                yandex_issues = self.yandex_client.get_issues(queue_key)
-                total_yandex_issues += len(yandex_issues)
+            mapped_by_queue: Dict[str, Dict[str, str]] = {queue_key: {} for queue_key in project_mapping}
+            for issue_key, issue_id in issue_mapping.items():
+                mapped_by_queue.setdefault(queue_of(issue_key), {})[issue_key] = issue_id
+
+            # Один проход по количествам для всех проектов
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='count') as executor:
+                counts = dict(zip(project_mapping, executor.map(self.count_project, project_mapping)))
+
+            total_yandex_issues = sum(count['yandex'] for count in counts.values())
+            total_youtrack_issues = sum(count['youtrack'] or 0 for count in counts.values())
 
             stats['yandex_issues_total'] = total_yandex_issues
             stats['migrated_issues_total'] = len(issue_mapping)
+            if not self.date_filtered:
+                stats['youtrack_issues_total'] = total_youtrack_issues
 
             # Проверяем процент миграции
             migration_percentage = (len(issue_mapping) / total_yandex_issues * 100) if total_yandex_issues > 0 else 0
@@ -158,28 +296,44 @@ class MigrationValidator:
 
             if migration_percentage < 95:
                 warnings.append(f"Мигрировано только {migration_percentage:.1f}% задач")
-
-            # Выборочная проверка задач в YouTrack
-            sample_size = min(10, len(issue_mapping))
-            sample_issues = list(issue_mapping.items())[:sample_size]
-
-            invalid_issue_mappings = []
-            for yandex_key, youtrack_id in sample_issues:
-                try:
-                    response = self.youtrack_client.session.get(
-                        f"{self.youtrack_client.base_url}/api/issues/{youtrack_id}",
-                        params={'fields': 'id,idReadable,summary'}
-                    )
-                    if response.status_code != 200:
-                        invalid_issue_mappings.append(f"{yandex_key} -> {youtrack_id}")
-                except Exception as e:
-                    invalid_issue_mappings.append(f"{yandex_key} -> {youtrack_id} (error: {e})")
-
+            if self.date_filtered:
+                warnings.append("Фильтр по датам создания: количество задач в проектах YouTrack не сравнивается "
+                                "(дата создания в YouTrack - время переноса), Yandex Tracker сверяется с маппингом")
+
+            mismatched = [
+                queue_key for queue_key, count in counts.items()
+                if not self.counts_match(count, len(mapped_by_queue.get(queue_key, {})))
+            ]
+            for queue_key in mismatched:
+                count = counts[queue_key]
+                logger.info(f"  🔎 {queue_key}: Yandex {count['yandex']}, маппинг {len(mapped_by_queue[queue_key])}, "
+                            f"YouTrack {count['youtrack']} - сверяем ключи")
+
+            # Подробная сверка только для проектов с расхождением
+            missing_issues: List[str] = []
+            invalid_issue_mappings: List[str] = []
+            extra_issues = 0
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='drill') as executor:
+                details = executor.map(lambda queue_key: self.drill_down_project(queue_key, mapped_by_queue[queue_key]),
+                                       mismatched)
+                for queue_key, diff in zip(mismatched, details):
+                    missing_issues.extend(diff['missing'])
+                    invalid_issue_mappings.extend(diff['invalid'])
+                    extra_issues += len(diff['extra'])
+                    if diff['extra']:
+                        warnings.append(f"Проект {queue_key}: {len(diff['extra'])} задач YouTrack вне маппинга "
+                                        f"(возможны дубликаты)")
+
+            if missing_issues:
+                errors.append(f"Не мигрированы задачи: {listed(missing_issues)}")
             if invalid_issue_mappings:
-                errors.append(f"Некорректные маппинги задач (выборка): {', '.join(invalid_issue_mappings)}")
+                errors.append(f"Маппинги на отсутствующие задачи YouTrack: {listed(invalid_issue_mappings)}")
 
-            stats['checked_issues'] = sample_size
+            stats['projects_checked'] = len(counts)
+            stats['projects_mismatched'] = len(mismatched)
+            stats['missing_issues'] = len(missing_issues)
             stats['invalid_issue_mappings'] = len(invalid_issue_mappings)
+            stats['extra_youtrack_issues'] = extra_issues
 
         except Exception as e:
             errors.append(f"Ошибка валидации задач: {e}")
@@ -187,8 +341,58 @@ class MigrationValidator:
         success = len(errors) == 0
         return ValidationResult(success, errors, warnings, stats)
 
+    def load_yandex_link_graph(self, issue_keys: List[str]) -> Tuple[Dict[str, LinkEdge], List[str]]:
+        """Граф связей Yandex Tracker для перенесенных задач: связи, уже полученные этапом 4,
+        берутся из хранилища, остальные - из снимка или API в пуле потоков.
+        Возвращает (ребра по каноническому ключу, задачи, связи которых получить не удалось)"""
+        issue_links: Dict[str, List[Dict]] = {}
+        pending = list(issue_keys)
+        if self.store:
+            fetched = self.store.links_fetched_keys()
+            stored = self.store.load_issue_links()
+            issue_links = {key: stored.get(key, []) for key in issue_keys if key in fetched}
+            pending = [key for key in issue_keys if key not in fetched]
+
+        failed = []
+        if pending:
+            logger.info(f"  Получаем связи {len(pending)} задач из Yandex Tracker...")
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='links') as executor:
+                for issue_key, links in zip(pending, executor.map(self.yandex_client.get_issue_links, pending)):
+                    if links is None:
+                        failed.append(issue_key)
+                    else:
+                        issue_links[issue_key] = parse_yandex_links(links)
+
+        edges, _ = build_link_graph(issue_links, self.link_types)
+        return edges, failed
+
+    def load_youtrack_link_graph(self, id_to_key: Dict[str, str]) -> Dict[str, LinkEdge]:
+        """Граф связей YouTrack по задачам перенесенных проектов (постраничные запросы с полями связей).
+        Концы связей переводятся в ключи Yandex Tracker; задачи вне маппинга обозначаются как yt:<id>"""
+        def project_edges(queue_key: str) -> List[LinkEdge]:
+            edges = []
+            for issue in self.youtrack_client.iter_issues(project_query(queue_key), LINK_FIELDS):
+                issue_key = id_to_key.get(issue.get('id'), f"yt:{issue.get('id')}")
+                for link in issue.get('links') or []:
+                    link_type = (link.get('linkType') or {}).get('name')
+                    direction = (link.get('direction') or 'BOTH').upper()
+                    for target in link.get('issues') or []:
+                        target_key = id_to_key.get(target.get('id'), f"yt:{target.get('id')}")
+                        if direction == 'INWARD':
+                            edges.append(LinkEdge(target_key, issue_key, link_type, True))
+                        else:
+                            edges.append(LinkEdge(issue_key, target_key, link_type, direction == 'OUTWARD'))
+            return edges
+
+        graph: Dict[str, LinkEdge] = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='yt-links') as executor:
+            for edges in executor.map(project_edges, self.mappings.get('projects', {})):
+                graph.update((edge.key, edge) for edge in edges)
+        return graph
+
     def validate_links(self) -> ValidationResult:
-        """Валидация связей между задачами"""
+        """Валидация связей по всему графу: ребра Yandex Tracker и YouTrack переводятся через маппинг
+        в канонические ключи и сравниваются как множества (недостающие, лишние и с другим типом)"""
         logger.info("Валидация связей задач...")
 
         errors = []
@@ -197,53 +401,267 @@ class MigrationValidator:
 
         try:
             issue_mapping = self.mappings.get('issues', {})
+            id_to_key = {issue_id: issue_key for issue_key, issue_id in issue_mapping.items()}
+
+            yandex_graph, failed = self.load_yandex_link_graph(list(issue_mapping))
+            # Связи с неперенесенными задачами этап 4 не создает
+            expected = {key: edge for key, edge in yandex_graph.items()
+                        if edge.source_key in issue_mapping and edge.target_key in issue_mapping}
+            actual = self.load_youtrack_link_graph(id_to_key)
+
+            missing_keys = set(expected) - set(actual)
+            extra_keys = set(actual) - set(expected)
+
+            # Ребро с теми же концами, но другим типом или направлением - связь с неверным типом
+            def pair(edge: LinkEdge) -> Tuple[str, str]:
+                return tuple(sorted((edge.source_key, edge.target_key)))
+
+            extra_pairs = {pair(actual[key]) for key in extra_keys}
+            mistyped_pairs = {pair(expected[key]) for key in missing_keys} & extra_pairs
+            mistyped = sorted(key for key in missing_keys if pair(expected[key]) in mistyped_pairs)
+            missing = sorted(key for key in missing_keys if pair(expected[key]) not in mistyped_pairs)
+            extra = sorted(key for key in extra_keys if pair(actual[key]) not in mistyped_pairs)
+
+            if failed:
+                warnings.append(f"Не удалось получить связи задач: {listed(failed)}")
+            if missing:
+                errors.append(f"Отсутствуют связи: {listed(missing)}")
+            if mistyped:
+                errors.append(f"Связи с другим типом или направлением: {listed(mistyped)}")
+            if extra:
+                warnings.append(f"Связи YouTrack, которых нет в Yandex Tracker: {listed(extra)}")
+
+            stats['yandex_links_total'] = len(expected)
+            stats['youtrack_links_total'] = len(actual)
+            stats['unmapped_links'] = len(yandex_graph) - len(expected)
+            stats['missing_links'] = len(missing)
+            stats['mistyped_links'] = len(mistyped)
+            stats['extra_links'] = len(extra)
+
+            if expected:
+                link_migration_percentage = (len(expected) - len(missing_keys)) / len(expected) * 100
+                stats['link_migration_percentage'] = round(link_migration_percentage, 2)
 
-            # Выборочная проверка связей
-            sample_issues = list(issue_mapping.keys())[:5]  # Проверяем первые 5 задач
+            if missing or mistyped or extra:
+                filename = f"link_diff_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+                with open(filename, 'w', encoding='utf-8') as f:
+                    json.dump({'missing': missing, 'mistyped': mistyped, 'extra': extra},
+                              f, ensure_ascii=False, indent=2)
+                warnings.append(f"Список расхождений связей сохранен в {filename}")
 
-            total_yandex_links = 0
-            total_youtrack_links = 0
+        except Exception as e:
+            errors.append(f"Ошибка валидации связей: {e}")
 
-            for yandex_key in sample_issues:
-                youtrack_id = issue_mapping.get(yandex_key)
-                if not youtrack_id:
-                    continue
+        success = len(errors) == 0
+        return ValidationResult(success, errors, warnings, stats)
 
-                # Получаем связи из Yandex Tracker
-                yandex_links = self.yandex_client.get_issue_links(yandex_key)
-                total_yandex_links += len(yandex_links)
+    def checksum_issue(self, issue: Dict, youtrack_issue: Dict, comment_mapping: Dict[str, str],
+                       check_comments: bool) -> Dict[str, List[str]]:
+        """Сверка контрольных сумм задачи и ее комментариев (выполняется в рабочем потоке)"""
+        issue_key = issue.get('key')
+        diff = {'issues': [], 'comments': [], 'missing_comments': []}
+
+        if checksum(issue.get('summary'), format_issue_description(issue)) != \
+                checksum(youtrack_issue.get('summary'), youtrack_issue.get('description')):
+            diff['issues'].append(issue_key)
+
+        if not check_comments:
+            return diff
+
+        comments = self.yandex_client.get_issue_comments(issue_key)
+        if comments is None:
+            diff['missing_comments'].append(f"{issue_key} (комментарии не получены)")
+            return diff
+
+        youtrack_texts = {comment.get('id'): comment.get('text')
+                          for comment in youtrack_issue.get('comments') or [] if not comment.get('deleted')}
+        for comment in comments:
+            key = comment_key(issue_key, comment)
+            comment_id = comment_mapping.get(key)
+            if comment_id not in youtrack_texts:
+                diff['missing_comments'].append(key)
+            elif checksum(format_comment(comment)) != checksum(youtrack_texts[comment_id]):
+                diff['comments'].append(key)
+        return diff
+
+    def validate_checksums(self, check_comments: bool = True) -> ValidationResult:
+        """Сверка содержимого всех перенесенных задач и комментариев по контрольным суммам.
+        Задачи Yandex Tracker читаются потоком страниц; для каждой страницы из YouTrack пакетами
+        по ID маппинга запрашиваются только соответствующие задачи с комментариями. Обе стороны
+        сравниваются в пуле потоков и отбрасываются, поэтому в памяти не больше одной страницы"""
+        logger.info("Сверка контрольных сумм задач и комментариев...")
 
-                # Получаем связи из YouTrack
-                try:
-                    response = self.youtrack_client.session.get(
-                        f"{self.youtrack_client.base_url}/api/issues/{youtrack_id}/links",
-                        params={'fields': 'id,linkType,issues(id)'}
-                    )
-                    if response.status_code == 200:
-                        youtrack_links = response.json()
-                        total_youtrack_links += len(youtrack_links)
-                except Exception as e:
-                    warnings.append(f"Не удалось проверить связи для задачи {yandex_key}: {e}")
+        errors = []
+        warnings = []
+        stats = {}
+        diff: Dict[str, List[str]] = {'issues': [], 'comments': [], 'missing_issues': [], 'missing_comments': []}
 
-            stats['checked_issues'] = len(sample_issues)
-            stats['yandex_links_total'] = total_yandex_links
-            stats['youtrack_links_total'] = total_youtrack_links
+        try:
+            issue_mapping = self.mappings.get('issues', {})
+            comment_mapping = self.mappings.get('comments', {})
+            checked_issues = 0
+
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='checksum') as executor:
+                for queue_key in self.mappings.get('projects', {}):
+                    project_checked = 0
+
+                    for issues in self.yandex_client.iter_issue_pages(queue_key):
+                        issue_ids = [issue_mapping[issue.get('key')] for issue in issues
+                                     if issue.get('key') in issue_mapping]
+                        batches = [issue_ids[start:start + GETTER_BATCH_SIZE]
+                                   for start in range(0, len(issue_ids), GETTER_BATCH_SIZE)]
+                        youtrack_issues = {
+                            youtrack_issue.get('id'): youtrack_issue
+                            for batch in executor.map(
+                                lambda batch: self.youtrack_client.get_issues(batch, CHECKSUM_FIELDS), batches)
+                            for youtrack_issue in batch
+                        }
+
+                        pending = []
+                        for issue in issues:
+                            youtrack_issue = youtrack_issues.get(issue_mapping.get(issue.get('key')))
+                            if youtrack_issue is None:
+                                diff['missing_issues'].append(issue.get('key'))
+                            else:
+                                pending.append((issue, youtrack_issue))
+
+                        for issue_diff in executor.map(
+                                lambda pair: self.checksum_issue(pair[0], pair[1], comment_mapping, check_comments),
+                                pending):
+                            for name, keys in issue_diff.items():
+                                diff[name].extend(keys)
+                        project_checked += len(pending)
+
+                    checked_issues += project_checked
+                    logger.info(f"  ✓ {queue_key}: проверено задач {project_checked}")
+
+            if diff['missing_issues']:
+                errors.append(f"Задачи отсутствуют в YouTrack: {listed(diff['missing_issues'])}")
+            if diff['issues']:
+                errors.append(f"Расходится заголовок или описание: {listed(diff['issues'])}")
+            if diff['missing_comments']:
+                errors.append(f"Комментарии отсутствуют в YouTrack: {listed(diff['missing_comments'])}")
+            if diff['comments']:
+                errors.append(f"Расходится текст комментариев: {listed(diff['comments'])}")
+
+            stats['checked_issues'] = checked_issues
+            stats['mismatched_issues'] = len(diff['issues'])
+            stats['mismatched_comments'] = len(diff['comments'])
+            stats['missing_issues'] = len(diff['missing_issues'])
+            stats['missing_comments'] = len(diff['missing_comments'])
+
+            if any(diff.values()):
+                filename = f"checksum_diff_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+                with open(filename, 'w', encoding='utf-8') as f:
+                    json.dump(diff, f, ensure_ascii=False, indent=2)
+                warnings.append(f"Список расхождений сохранен в {filename}")
 
-            if total_yandex_links > 0:
-                link_migration_percentage = (total_youtrack_links / total_yandex_links * 100)
-                stats['link_migration_percentage'] = round(link_migration_percentage, 2)
+        except Exception as e:
+            errors.append(f"Ошибка сверки контрольных сумм: {e}")
+
+        success = len(errors) == 0
+        return ValidationResult(success, errors, warnings, stats)
+
+    def check_sampled_issue(self, issue_key: str, issue_id: str, comment_mapping: Dict[str, str],
+                            check_comments: bool) -> Optional[str]:
+        """Проверка одной задачи выборки: причина ошибки, '' если задача верна,
+        None если проверить не удалось (задача не учитывается в оценке)"""
+        try:
+            youtrack_issue = self.youtrack_client.get_issue(issue_id, CHECKSUM_FIELDS)
+            if youtrack_issue is None:
+                return 'задача отсутствует в YouTrack'
+            issue = self.yandex_client.get_issue(issue_key)
+            if issue is None:
+                return None
+            diff = self.checksum_issue(issue, youtrack_issue, comment_mapping, check_comments)
+        except requests.RequestException as e:
+            logger.warning(f"  ⚠ {issue_key}: проверка не выполнена - {e}")
+            return None
+
+        if diff['issues']:
+            return 'расходится заголовок или описание'
+        if diff['missing_comments']:
+            return f"отсутствуют комментарии: {', '.join(diff['missing_comments'])}"
+        if diff['comments']:
+            return f"расходится текст комментариев: {', '.join(diff['comments'])}"
+        return ''
+
+    def validate_sample(self, sample_size: int, check_comments: bool = True, seed: Optional[int] = None,
+                        max_error_rate: float = MAX_ERROR_RATE) -> ValidationResult:
+        """Выборочная проверка задач: стратифицированная случайная выборка по проектам
+        (пропорционально размеру проекта), параллельная проверка и оценка доли ошибок
+        с 95% доверительным интервалом Уилсона. Проверка успешна, если верхняя граница
+        интервала не превышает max_error_rate"""
+        logger.info(f"Выборочная проверка задач (выборка {sample_size})...")
+
+        errors = []
+        warnings = []
+        stats = {}
 
-                if link_migration_percentage < 80:
-                    warnings.append(f"Мигрировано только {link_migration_percentage:.1f}% связей")
+        try:
+            issue_mapping = self.mappings.get('issues', {})
+            comment_mapping = self.mappings.get('comments', {})
+
+            strata: Dict[str, List[str]] = {}
+            for issue_key in issue_mapping:
+                strata.setdefault(queue_of(issue_key), []).append(issue_key)
+
+            rng = random.Random(seed)
+            allocation = allocate_sample({name: len(keys) for name, keys in strata.items()}, sample_size)
+            sample = [(name, issue_key) for name, count in allocation.items()
+                      for issue_key in rng.sample(sorted(strata[name]), count)]
+
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='sample') as executor:
+                outcomes = list(executor.map(
+                    lambda item: self.check_sampled_issue(item[1], issue_mapping[item[1]],
+                                                          comment_mapping, check_comments),
+                    sample))
+
+            checked: Dict[str, int] = {}
+            failed: Dict[str, int] = {}
+            failures = []
+            for (name, issue_key), outcome in zip(sample, outcomes):
+                if outcome is None:
+                    continue
+                checked[name] = checked.get(name, 0) + 1
+                if outcome:
+                    failed[name] = failed.get(name, 0) + 1
+                    failures.append(f"{issue_key} ({outcome})")
+
+            # Стратифицированная оценка: доли ошибок проектов взвешиваются по размеру проектов
+            n = sum(checked.values())
+            population = sum(len(strata[name]) for name in checked)
+            error_rate = sum(len(strata[name]) / population * failed.get(name, 0) / count
+                             for name, count in checked.items()) if n else 0.0
+            lower, upper = wilson_interval(error_rate, n)
+
+            stats['population'] = len(issue_mapping)
+            stats['projects_sampled'] = len(checked)
+            stats['checked_issues'] = n
+            stats['unchecked_issues'] = len(sample) - n
+            stats['failed_issues'] = len(failures)
+            stats['error_rate'] = round(error_rate, 4)
+            stats['error_rate_95ci'] = f"{lower:.4f} - {upper:.4f}"
+            stats['max_error_rate'] = max_error_rate
+
+            if failures:
+                (errors if upper > max_error_rate else warnings).append(f"Ошибки в выборке: {listed(failures)}")
+            if upper > max_error_rate:
+                errors.append(f"Верхняя граница доли ошибок {upper:.2%} превышает допустимую {max_error_rate:.2%}")
+            if len(sample) > n:
+                warnings.append(f"Не удалось проверить задач: {len(sample) - n}")
 
         except Exception as e:
-            errors.append(f"Ошибка валидации связей: {e}")
+            errors.append(f"Ошибка выборочной проверки: {e}")
 
         success = len(errors) == 0
         return ValidationResult(success, errors, warnings, stats)
 
-    def run_full_validation(self) -> Dict[str, ValidationResult]:
-        """Запуск полной валидации"""
+    def run_full_validation(self, checksums: bool = False, check_comments: bool = True,
+                            sample_size: Optional[int] = None, seed: Optional[int] = None,
+                            max_error_rate: float = MAX_ERROR_RATE) -> Dict[str, ValidationResult]:
+        """Запуск полной валидации (checksums - дополнительно сверить содержимое всех задач,
+        sample_size - выборочно проверить содержимое заданного числа задач)"""
         logger.info("=== Начало валидации миграции ===")
 
         results = {
@@ -253,6 +671,11 @@ class MigrationValidator:
             'links': self.validate_links()
         }
 
+        if checksums:
+            results['checksums'] = self.validate_checksums(check_comments)
+        if sample_size:
+            results['sample'] = self.validate_sample(sample_size, check_comments, seed, max_error_rate)
+
         return results
 
     def generate_validation_report(self, results: Dict[str, ValidationResult]) -> str:
@@ -311,10 +734,85 @@ class MigrationValidator:
         logger.info(f"Отчет валидации сохранен в {filename}")
         return report_text
 
+class YouTrackClient:
+    """Клиент YouTrack API для проверок валидатора"""
+
+    def __init__(self, base_url: str, token: str, pool_size: int = 10):
+        self.base_url = base_url.rstrip('/')
+        self.session = create_session()
+        # Пул соединений должен вмещать все рабочие потоки
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Authorization': f'Bearer {token}',
+            'Content-Type': 'application/json',
+            'Accept': 'application/json'
+        })
+
+    def count_issues(self, query: str) -> Optional[int]:
+        """Количество задач по запросу (None, если YouTrack не успел его вычислить)"""
+        for _ in range(COUNT_ATTEMPTS):
+            response = self.session.post(f"{self.base_url}/api/issuesGetter/count",
+                                         params={'fields': 'count'}, json={'query': query},
+                                         idempotent=True)
+            response.raise_for_status()
+            count = response.json().get('count', -1)
+            if count >= 0:
+                return count
+            time.sleep(COUNT_RETRY_DELAY)
+        return None
+
+    def get_issues(self, issue_ids: List[str], fields: str) -> List[Dict]:
+        """Задачи по списку ID одним запросом (отсутствующих задач в ответе нет)"""
+        response = self.session.post(f"{self.base_url}/api/issuesGetter", params={'fields': fields},
+                                     json=[{'id': issue_id} for issue_id in issue_ids], idempotent=True)
+        response.raise_for_status()
+        return response.json()
+
+    def get_issue(self, issue_id: str, fields: str) -> Optional[Dict]:
+        """Задача по ID (None, если задачи нет)"""
+        response = self.session.get(f"{self.base_url}/api/issues/{issue_id}", params={'fields': fields})
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def iter_issues(self, query: str, fields: str, page_size: int = 500) -> Iterator[Dict]:
+        """Задачи по запросу постранично ($top/$skip)"""
+        skip = 0
+        while True:
+            response = self.session.get(f"{self.base_url}/api/issues",
+                                        params={'query': query, 'fields': fields, '$top': page_size, '$skip': skip})
+            response.raise_for_status()
+            issues = response.json()
+            yield from issues
+            if len(issues) < page_size:
+                return
+            skip += page_size
+
 def main():
     """Запуск валидации как отдельного скрипта"""
-    from tracker_migration import YandexTrackerClient, YouTrackClient
-    import json
+    parser = argparse.ArgumentParser(description='Валидация результатов миграции')
+    parser.add_argument('--checksums', action='store_true',
+                        help='Сверить контрольные суммы заголовков, описаний и комментариев всех задач')
+    parser.add_argument('--sample', type=int, metavar='N',
+                        help='Выборочно проверить содержимое N задач с оценкой доли ошибок')
+    parser.add_argument('--seed', type=int, help='Начальное значение генератора выборки (для повторяемости)')
+    parser.add_argument('--max-error-rate', type=float, default=MAX_ERROR_RATE,
+                        help='Допустимая доля ошибок для выборочной проверки (по умолчанию 0.01)')
+    args = parser.parse_args()
+
+    # force: импортированные этапы 3 и 4 уже настроили свои файлы логов
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('validation.log'),
+            logging.StreamHandler()
+        ],
+        force=True
+    )
 
     # Загружаем конфигурацию
     try:
@@ -324,28 +822,49 @@ def main():
         logger.error("Файл конфигурации не найден")
         return
 
-    # Загружаем маппинги
-    try:
-        with open('migration_mappings.json', 'r', encoding='utf-8') as f:
-            mappings = json.load(f)
-    except FileNotFoundError:
-        logger.error("Файл маппингов не найден")
+    configure_http(config)
+
+    # Загружаем маппинги из хранилища
+    store = open_mapping_store()
+    mappings = {kind: store.load(kind) for kind in ('users', 'projects', 'issues')}
+    if args.checksums or args.sample:
+        mappings['comments'] = store.load('comments')
+    if not any(mappings.values()):
+        logger.error("Маппинги не найдены, сначала выполните миграцию")
         return
 
-    # Создаем клиентов
-    yandex_client = YandexTrackerClient(
+    max_workers = max(1, config.get('migration_options', {}).get('max_workers', 8))
+
+    # Создаем клиентов: данные Yandex Tracker берутся из снимка, если он выгружен
+    filters = load_filters(config)
+    yandex_client = open_snapshot(config) or YandexExportClient(
         config['yandex_tracker']['token'],
-        config['yandex_tracker']['org_id']
+        config['yandex_tracker']['org_id'],
+        config['yandex_tracker'].get('is_cloud_org', False),
+        pool_size=max_workers,
+        filters=filters
     )
 
     youtrack_client = YouTrackClient(
         config['youtrack']['url'],
-        config['youtrack']['token']
+        config['youtrack']['token'],
+        pool_size=max_workers
     )
 
+    # Типы связей YouTrack в том же виде, в каком их сопоставляет этап 4
+    link_types = LinkClient(config['youtrack']['url'], config['youtrack']['token'], store,
+                            metadata_ttl=metadata_ttl(config)).get_link_types()
+
     # Запускаем валидацию
-    validator = MigrationValidator(yandex_client, youtrack_client, mappings)
-    results = validator.run_full_validation()
+    validator = MigrationValidator(yandex_client, youtrack_client, mappings, filters, max_workers,
+                                   store=store, link_types=link_types)
+    results = validator.run_full_validation(
+        checksums=args.checksums,
+        check_comments=config.get('migration_options', {}).get('migrate_comments', True),
+        sample_size=args.sample,
+        seed=args.seed,
+        max_error_rate=args.max_error_rate
+    )
 
     # Генерируем отчет
     report = validator.generate_validation_report(results)
@@ -3,15 +3,18 @@
   1  
 """
 
-import requests
 import json
-import time
 import logging
 from datetime import datetime
 
+from migration_http import configure_http, create_session
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Общая сессия с лимитом запросов по хостам
+session = create_session()
+
 def load_config():
     with open('migration_config.json', 'r') as f:
         return json.load(f)
@@ -36,6 +39,7 @@ def save_project_mapping(project_mapping):
 
 def retry_failed_queues():
     config = load_config()
+    configure_http(config)
     project_mapping = load_project_mapping()
     
     headers = {
@@ -47,7 +51,7 @@ def retry_failed_queues():
     
     #     
     try:
-        response = requests.get(f"{base_url}/api/users/me", headers=headers)
+        response = session.get(f"{base_url}/api/users/me", headers=headers)
         current_user = response.json()
         leader_id = current_user.get('id')
         logger.info(f" : {current_user.get('login')} (ID: {leader_id})")
@@ -81,7 +85,7 @@ def retry_failed_queues():
         }
         
         try:
-            response = requests.post(
+            response = session.post(
                 f"{base_url}/api/admin/projects",
                 headers=headers,
                 json=yt_project,
@@ -99,7 +103,7 @@ def retry_failed_queues():
                 logger.warning(f" {queue_key}  ")
                 #   
                 try:
-                    search_response = requests.get(
+                    search_response = session.get(
                         f"{base_url}/api/admin/projects",
                         headers=headers,
                         params={'query': queue_key, 'fields': 'id,shortName'}
@@ -123,8 +127,6 @@ def retry_failed_queues():
             logger.error(f"  {queue_key}: {e}")
             error_count += 1
         
-        time.sleep(1)
-        
         #   5 
         if i % 5 == 0:
             save_project_mapping(project_mapping)
@@ -11,6 +11,8 @@ import logging
 from datetime import datetime
 from pathlib import Path
 
+from mapping_store import DELTA_WATERMARK, MAPPING_DB, MAPPING_KINDS, MappingStore
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -49,6 +51,14 @@ MIGRATION_STEPS = [
     }
 ]
 
+# Дельта-синхронизация для окна переключения (запускается отдельно, после полной миграции)
+DELTA_STEP = {
+    'name': 'Дельта-синхронизация',
+    'script': 'delta_sync.py',
+    'description': 'Перенос изменений после прошлой синхронизации',
+    'output_file': 'delta_report.json'
+}
+
 def check_prerequisites():
     """Проверка предварительных условий"""
     logger.info("🔍 Проверка предварительных условий...")
@@ -237,6 +247,15 @@ def show_status():
 
         logger.info(f"{i}. {step['name']}: {status}")
 
+    # Хранилище маппингов обновляется по каждой записи, в том числе во время прерванного этапа
+    if Path(MAPPING_DB).exists():
+        store = MappingStore(MAPPING_DB)
+        counts = ', '.join(f"{kind}: {store.count(kind)}" for kind in MAPPING_KINDS)
+        watermark = store.get_state(DELTA_WATERMARK)
+        store.close()
+        logger.info(f"💾 {MAPPING_DB}: {counts}")
+        logger.info(f"🕒 Метка дельта-синхронизации: {watermark or 'нет'}")
+
 def create_example_config():
     """Создание примера конфигурации"""
     config = {
@@ -270,6 +289,7 @@ def main():
     parser.add_argument('--resume', action='store_true', help='Возобновить миграцию (пропустить выполненные этапы)')
     parser.add_argument('--status', action='store_true', help='Показать статус миграции')
     parser.add_argument('--create-config', action='store_true', help='Создать пример конфигурации')
+    parser.add_argument('--delta', action='store_true', help='Перенести изменения после прошлой синхронизации')
 
     args = parser.parse_args()
 
@@ -296,7 +316,11 @@ def main():
         sys.exit(1)
 
     try:
-        if args.step:
+        if args.delta:
+            # Дельта-синхронизация во время переключения
+            success = run_step(DELTA_STEP)
+            sys.exit(0 if success else 1)
+        elif args.step:
             # Запуск конкретного этапа
             success = run_specific_step(args.step)
             sys.exit(0 if success else 1)
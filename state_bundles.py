@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Общие state bundles для очередей с одинаковым набором статусов
+Упорядоченный набор статусов очереди (имя, описание, цвет) хэшируется, и для каждого
+различного набора в YouTrack создается один bundle, который назначается всем очередям
+с этим набором. Соответствие хэш -> ID bundle хранится в migration_state.db (раздел state_bundles)
+"""
+
+import json
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+from mapping_store import MappingStore
+from youtrack_metadata import YouTrackMetadata
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_KIND = 'state_bundles'
+
+# Префикс имен общих bundles (отличает их от bundles отдельных очередей "<KEY> States")
+SHARED_BUNDLE_PREFIX = 'Tracker States'
+
+def bundle_states(statuses: List[Dict]) -> List[Dict]:
+    """Состояния bundle в формате YouTrack, в порядке статусов очереди"""
+    return [
+        {
+            'name': status.get('name', status.get('key')),
+            'description': status.get('description', ''),
+            'color': {'id': (status.get('color') or '#6B73FF').replace('#', '')}
+        }
+        for status in statuses
+    ]
+
+def status_set_digest(statuses: List[Dict]) -> str:
+    """Хэш упорядоченного набора статусов: одинаковые рабочие процессы дают одинаковый хэш"""
+    payload = json.dumps(bundle_states(statuses), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def shared_bundle_name(digest: str) -> str:
+    return f"{SHARED_BUNDLE_PREFIX} {digest[:10]}"
+
+def is_shared_bundle(bundle_name: str) -> bool:
+    return (bundle_name or '').startswith(SHARED_BUNDLE_PREFIX)
+
+class SharedStateBundles:
+    """Выдача общего bundle по набору статусов (потокобезопасно: параллельные очереди
+    с одинаковым набором не создают дубликаты)"""
+
+    def __init__(self, store: MappingStore, metadata: YouTrackMetadata,
+                 create_bundle: Callable[[str, List[Dict]], Optional[str]]):
+        self.store = store
+        self.metadata = metadata
+        self.create_bundle = create_bundle
+        self.lock = threading.Lock()
+        self.digest_locks: Dict[str, threading.Lock] = {}
+        self.stats = {'created': 0, 'reused': 0}
+
+    def _digest_lock(self, digest: str) -> threading.Lock:
+        with self.lock:
+            return self.digest_locks.setdefault(digest, threading.Lock())
+
+    def _count(self, name: str):
+        with self.lock:
+            self.stats[name] += 1
+
+    def bundle_for(self, statuses: List[Dict]) -> Optional[str]:
+        """ID bundle для набора статусов: из маппинга, по имени среди существующих bundles
+        YouTrack (маппинг потерян) или новый"""
+        digest = status_set_digest(statuses)
+        with self._digest_lock(digest):
+            bundle_id = self.store.get(BUNDLE_KIND, digest)
+            if bundle_id:
+                self._count('reused')
+                return bundle_id
+
+            bundle_name = shared_bundle_name(digest)
+            existing = next((bundle for bundle in self.metadata.state_bundles()
+                             if bundle.get('name') == bundle_name), None)
+            if existing:
+                bundle_id = existing.get('id')
+                self._count('reused')
+            else:
+                bundle_id = self.create_bundle(bundle_name, statuses)
+                if not bundle_id:
+                    return None
+                self._count('created')
+
+            self.store.set(BUNDLE_KIND, digest, bundle_id)
+            return bundle_id
+
+    def is_current(self, bundle_name: str, statuses: List[Dict]) -> bool:
+        """Назначенный проекту bundle соответствует набору статусов очереди"""
+        return bundle_name == shared_bundle_name(status_set_digest(statuses))
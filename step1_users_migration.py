@@ -6,10 +6,16 @@
 
 import requests
 import json
-import time
 import logging
 from typing import Dict, List, Optional
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+
+from mapping_store import MappingStore, open_mapping_store
+from migration_http import configure_http, create_session, log_http_stats
+from user_directory import UserDirectory
+from user_provisioning import DEFAULT_WORKERS, provision
+from yandex_snapshot import open_snapshot
 
 # Настройка логирования
 logging.basicConfig(
@@ -30,7 +36,7 @@ class YandexTrackerClient:
         self.org_id = org_id
         self.is_cloud_org = is_cloud_org
         self.base_url = "https://api.tracker.yandex.net/v2"
-        self.session = requests.Session()
+        self.session = create_session()
 
         # Выбираем правильный заголовок для организации
         org_header = 'X-Cloud-Org-Id' if is_cloud_org else 'X-Org-ID'
@@ -74,9 +80,6 @@ class YandexTrackerClient:
 
                 page += 1
 
-                # Пауза между запросами
-                time.sleep(0.3)
-
             except requests.RequestException as e:
                 logger.error(f"Ошибка получения пользователей, страница {page}: {e}")
                 break
@@ -88,15 +91,33 @@ class YandexTrackerClient:
 class YouTrackClient:
     """Клиент для работы с YouTrack Hub API"""
 
-    def __init__(self, base_url: str, token: str):
+    def __init__(self, base_url: str, token: str, pool_size: int = 10):
         self.base_url = base_url.rstrip('/')
         self.token = token
-        self.session = requests.Session()
+        self.session = create_session()
+        # Пул соединений должен вмещать все рабочие потоки
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         self.session.headers.update({
             'Authorization': f'Bearer {token}',
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         })
+        # Справочник существующих пользователей, загружается один раз (load_directory)
+        self.directory = UserDirectory()
+
+    def load_directory(self) -> bool:
+        """Загрузка всех пользователей YouTrack/Hub в индекс по логину и email"""
+        directory = UserDirectory.load(self.session, self.base_url)
+        if directory is None:
+            return False
+        self.directory = directory
+        return True
+
+    def find_in_directory(self, user_data: Dict) -> Optional[str]:
+        """ID уже существующего пользователя по справочнику (без запросов к API)"""
+        return self.directory.find(user_data.get('login', user_data.get('id')), user_data.get('email'))
 
     def test_connection(self) -> bool:
         """Тестирование подключения к YouTrack"""
@@ -144,11 +165,12 @@ class YouTrackClient:
 
             if response.status_code in [200, 201]:
                 created_user = response.json()
+                self.directory.add(created_user.get('id'), login, email)
                 logger.info(f"✓ Создан пользователь: {login}")
                 return created_user.get('id')
 
             elif response.status_code == 409:
-                # Пользователь уже существует, пытаемся найти его ID
+                # Пользователь появился после загрузки справочника, ищем его ID
                 logger.debug(f"    Пользователь {login} уже существует, ищем ID...")
                 existing_id = self.find_existing_user_id(login)
                 if existing_id:
@@ -167,7 +189,7 @@ class YouTrackClient:
             return None
 
     def find_existing_user_id(self, login: str) -> Optional[str]:
-        """Поиск ID существующего пользователя"""
+        """Поиск ID существующего пользователя по API (запасной путь, если его нет в справочнике)"""
         try:
             # Сначала пробуем через обычный API
             response = self.session.get(
@@ -220,27 +242,9 @@ def load_config() -> Dict:
         logger.info("Создайте конфигурацию согласно документации")
         exit(1)
 
-def save_user_mapping(user_mapping: Dict):
-    """Сохранение маппинга пользователей"""
-    mapping_data = {
-        'users': user_mapping,
-        'timestamp': datetime.now().isoformat(),
-        'step': 'users_completed'
-    }
-
-    with open('user_mapping.json', 'w', encoding='utf-8') as f:
-        json.dump(mapping_data, f, ensure_ascii=False, indent=2)
-
-    logger.info(f"Маппинг пользователей сохранен в user_mapping.json")
-
-def load_existing_mapping() -> Dict:
-    """Загрузка существующего маппинга"""
-    try:
-        with open('user_mapping.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return data.get('users', {})
-    except FileNotFoundError:
-        return {}
+def save_user_mapping(store: MappingStore):
+    """Выгрузка маппинга пользователей в user_mapping.json"""
+    store.export_json('users')
 
 def main():
     """Главная функция этапа 1"""
@@ -250,19 +254,24 @@ def main():
 
     # Загружаем конфигурацию
     config = load_config()
+    configure_http(config)
 
     # Создаем клиентов
     is_cloud_org = config['yandex_tracker'].get('is_cloud_org', False)
 
-    yandex_client = YandexTrackerClient(
+    # Если выгружен снимок, данные Yandex Tracker читаются из него
+    yandex_client = open_snapshot(config) or YandexTrackerClient(
         config['yandex_tracker']['token'],
         config['yandex_tracker']['org_id'],
         is_cloud_org
     )
 
+    max_workers = max(1, config.get('migration_options', {}).get('max_workers', DEFAULT_WORKERS))
+
     youtrack_client = YouTrackClient(
         config['youtrack']['url'],
-        config['youtrack']['token']
+        config['youtrack']['token'],
+        pool_size=max_workers
     )
 
     # Тестируем подключение к YouTrack
@@ -271,7 +280,8 @@ def main():
         exit(1)
 
     # Загружаем существующий маппинг (если есть)
-    user_mapping = load_existing_mapping()
+    store = open_mapping_store()
+    user_mapping = store.load('users')
     logger.info(f"Загружен существующий маппинг: {len(user_mapping)} пользователей")
 
     # Получаем пользователей из Yandex Tracker
@@ -280,51 +290,70 @@ def main():
         logger.error("Не удалось получить пользователей из Yandex Tracker")
         exit(1)
 
+    # Существующие пользователи YouTrack определяются по справочнику, создаются только новые
+    if not youtrack_client.load_directory():
+        logger.warning("⚠ Не удалось загрузить справочник пользователей, существующие будут найдены после 409")
+
     logger.info(f"Начинаем миграцию {len(yandex_users)} пользователей...")
 
     # Мигрируем пользователей
     success_count = 0
     skip_count = 0
+    existing_count = 0
     error_count = 0
 
-    for i, user in enumerate(yandex_users, 1):
+    # Сначала локально: уже мигрированные и уже существующие в YouTrack пользователи
+    existing_mapping = {}
+    new_users = []
+    for user in yandex_users:
         yandex_id = user.get('id')
         login = user.get('login', yandex_id)
 
-        logger.info(f"[{i}/{len(yandex_users)}] Обрабатываем пользователя: {login}")
-
         # Пропускаем если уже мигрирован
-        if yandex_id in user_mapping:
-            logger.info(f"⏭ Пользователь {login} уже мигрирован, пропускаем")
+        if str(yandex_id) in user_mapping:
+            logger.debug(f"⏭ Пользователь {login} уже мигрирован, пропускаем")
             skip_count += 1
             continue
 
-        # Создаем пользователя
-        youtrack_id = youtrack_client.create_user(user)
+        # Пользователь уже есть в YouTrack
+        existing_id = youtrack_client.find_in_directory(user)
+        if existing_id:
+            logger.debug(f"⏭ Пользователь {login} уже существует (ID: {existing_id})")
+            existing_mapping[str(yandex_id)] = existing_id
+            continue
+
+        new_users.append(user)
+
+    if existing_mapping:
+        store.set_many('users', existing_mapping)
+        user_mapping.update(existing_mapping)
+        existing_count = len(existing_mapping)
+        logger.info(f"⏭ Уже существуют в YouTrack: {existing_count}")
+    if skip_count:
+        logger.info(f"⏭ Уже мигрировано: {skip_count}")
+
+    # Создаем новых пользователей параллельно
+    for user, youtrack_id in provision(new_users, youtrack_client.create_user, max_workers):
         if youtrack_id:
-            user_mapping[yandex_id] = youtrack_id
+            # Запись в хранилище фиксируется сразу, промежуточные сохранения не нужны
+            user_mapping[str(user.get('id'))] = youtrack_id
+            store.set('users', user.get('id'), youtrack_id)
             success_count += 1
         else:
             error_count += 1
 
-        # Пауза между запросами
-        time.sleep(0.5)
-
-        # Сохраняем промежуточный результат каждые 10 пользователей
-        if i % 10 == 0:
-            save_user_mapping(user_mapping)
-            logger.info(f"Промежуточное сохранение: {i} пользователей обработано")
-
-    # Сохраняем финальный результат
-    save_user_mapping(user_mapping)
+    # Выгружаем финальный результат в JSON
+    save_user_mapping(store)
 
     # Выводим статистику
     logger.info("=" * 50)
     logger.info("РЕЗУЛЬТАТЫ ЭТАПА 1:")
     logger.info(f"✓ Успешно создано: {success_count}")
-    logger.info(f"⏭ Пропущено (уже существуют): {skip_count}")
+    logger.info(f"⏭ Пропущено (уже мигрированы): {skip_count}")
+    logger.info(f"👥 Найдено в YouTrack: {existing_count}")
     logger.info(f"✗ Ошибок: {error_count}")
     logger.info(f"📊 Всего в маппинге: {len(user_mapping)}")
+    log_http_stats(logger)
     logger.info("=" * 50)
 
     if error_count == 0:
@@ -6,10 +6,18 @@
 
 import requests
 import json
-import time
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, List, Optional
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+
+from mapping_store import MappingStore, open_mapping_store
+from migration_filters import MigrationFilters, load_filters
+from migration_http import configure_http, create_session, log_http_stats
+from state_bundles import SharedStateBundles, bundle_states
+from yandex_snapshot import open_snapshot
+from youtrack_metadata import METADATA_TTL, YouTrackMetadata, metadata_ttl
 
 # Настройка логирования
 logging.basicConfig(
@@ -25,11 +33,13 @@ logger = logging.getLogger(__name__)
 class YandexTrackerClient:
     """Клиент для работы с Yandex Tracker API"""
 
-    def __init__(self, token: str, org_id: str, is_cloud_org: bool = False):
+    def __init__(self, token: str, org_id: str, is_cloud_org: bool = False,
+                 filters: Optional[MigrationFilters] = None):
         self.token = token
         self.org_id = org_id
         self.base_url = "https://api.tracker.yandex.net/v2"
-        self.session = requests.Session()
+        self.filters = filters or MigrationFilters()
+        self.session = create_session()
         # Выбираем правильный заголовок для организации
         org_header = 'X-Cloud-Org-Id' if is_cloud_org else 'X-Org-ID'
         self.session.headers.update({
@@ -39,11 +49,20 @@ class YandexTrackerClient:
         })
 
     def get_queues(self) -> List[Dict]:
-        """Получение всех очередей"""
+        """Получение очередей, попадающих в миграцию"""
         try:
-            response = self.session.get(f"{self.base_url}/queues")
-            response.raise_for_status()
-            queues = response.json()
+            if self.filters.specific_queues:
+                # Явно перечисленные очереди запрашиваем по ключу, без списка всей организации
+                queues = []
+                for queue_key in self.filters.specific_queues:
+                    response = self.session.get(f"{self.base_url}/queues/{queue_key}")
+                    response.raise_for_status()
+                    queues.append(response.json())
+            else:
+                response = self.session.get(f"{self.base_url}/queues")
+                response.raise_for_status()
+                queues = response.json()
+            queues = self.filters.filter_queues(queues)
             logger.info(f"Получено {len(queues)} очередей из Yandex Tracker")
             return queues
         except requests.RequestException as e:
@@ -71,15 +90,22 @@ class YandexTrackerClient:
 class YouTrackClient:
     """Клиент для работы с YouTrack API"""
 
-    def __init__(self, base_url: str, token: str):
+    def __init__(self, base_url: str, token: str, store: MappingStore, pool_size: int = 10,
+                 metadata_ttl: float = METADATA_TTL):
         self.base_url = base_url.rstrip('/')
         self.token = token
-        self.session = requests.Session()
+        self.session = create_session()
+        # Пул соединений должен вмещать все рабочие потоки
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         self.session.headers.update({
             'Authorization': f'Bearer {token}',
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         })
+        # Поле State и список проектов общие для всех очередей - запрашиваем их один раз
+        self.metadata = YouTrackMetadata(self.session, self.base_url, store, ttl=metadata_ttl)
 
     def get_current_user_youtrack_id(self) -> Optional[str]:
         """Получение YouTrack ID текущего пользователя"""
@@ -123,6 +149,7 @@ class YouTrackClient:
 
             if response.status_code in [200, 201]:
                 created_project = response.json()
+                self.metadata.add_project(created_project.get('shortName'), created_project.get('id'))
                 logger.info(f"✓ Создан проект: {created_project.get('shortName')} - {created_project.get('name')}")
                 return created_project.get('id')
             elif response.status_code == 409:
@@ -138,38 +165,14 @@ class YouTrackClient:
 
     def get_project_by_shortname(self, shortname: str) -> Optional[str]:
         """Получение ID проекта по короткому имени"""
-        try:
-            response = self.session.get(
-                f"{self.base_url}/api/admin/projects",
-                params={'query': shortname, 'fields': 'id,shortName'}
-            )
-            response.raise_for_status()
-            projects = response.json()
-
-            for project in projects:
-                if project.get('shortName') == shortname:
-                    return project.get('id')
-            return None
-        except requests.RequestException as e:
-            logger.error(f"Ошибка поиска проекта {shortname}: {e}")
-            return None
+        return self.metadata.project_id(shortname)
 
     def create_state_bundle(self, bundle_name: str, statuses: List[Dict]) -> Optional[str]:
         """Создание state bundle в YouTrack"""
         try:
-            # Подготавливаем состояния для bundle
-            bundle_states = []
-            for status in statuses:
-                state_data = {
-                    'name': status.get('name', status.get('key')),
-                    'description': status.get('description', ''),
-                    'color': {'id': status.get('color', '#6B73FF').replace('#', '')}
-                }
-                bundle_states.append(state_data)
-
             bundle_data = {
                 'name': bundle_name,
-                'states': bundle_states
+                'states': bundle_states(statuses)
             }
 
             response = self.session.post(
@@ -180,6 +183,7 @@ class YouTrackClient:
 
             if response.status_code in [200, 201]:
                 created_bundle = response.json()
+                self.metadata.add_state_bundle(created_bundle)
                 logger.debug(f"  ✓ Создан state bundle: {bundle_name}")
                 return created_bundle.get('id')
             else:
@@ -193,20 +197,8 @@ class YouTrackClient:
     def assign_state_bundle_to_project(self, project_id: str, bundle_id: str) -> bool:
         """Назначение state bundle проекту"""
         try:
-            # Находим State field
-            response = self.session.get(
-                f"{self.base_url}/api/admin/customFieldSettings/customFields",
-                params={'fields': 'id,name,fieldType', '$top': 100}
-            )
-
-            state_field_id = None
-            if response.status_code == 200:
-                fields = response.json()
-                for field in fields:
-                    if field.get('name') == 'State' and 'state' in field.get('fieldType', '').lower():
-                        state_field_id = field.get('id')
-                        break
-
+            # Находим State field (из кэша метаданных)
+            state_field_id = self.metadata.state_field_id()
             if not state_field_id:
                 logger.warning(f"  ⚠ Не найдено поле State")
                 return False
@@ -237,17 +229,15 @@ class YouTrackClient:
             logger.error(f"  ✗ Ошибка назначения state bundle: {e}")
             return False
 
-    def create_project_statuses(self, project_id: str, queue_key: str, statuses: List[Dict]) -> bool:
-        """Создание статусов для проекта через state bundle"""
+    def create_project_statuses(self, project_id: str, queue_key: str, statuses: List[Dict],
+                                bundles: SharedStateBundles) -> bool:
+        """Создание статусов для проекта через общий state bundle его набора статусов"""
         if not statuses:
             logger.warning(f"  ⚠ Нет статусов для создания")
             return False
 
-        # Создаем уникальное имя для bundle
-        bundle_name = f"{queue_key} States"
-
-        # Создаем state bundle
-        bundle_id = self.create_state_bundle(bundle_name, statuses)
+        # Очереди с одинаковым набором статусов получают один bundle
+        bundle_id = bundles.bundle_for(statuses)
         if not bundle_id:
             return False
 
@@ -263,38 +253,41 @@ def load_config() -> Dict:
         logger.error("Файл migration_config.json не найден")
         exit(1)
 
-def load_user_mapping() -> Dict:
+def load_user_mapping(store: MappingStore) -> Dict:
     """Загрузка маппинга пользователей"""
-    try:
-        with open('user_mapping.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return data.get('users', {})
-    except FileNotFoundError:
-        logger.error("Файл user_mapping.json не найден")
+    user_mapping = store.load('users')
+    if not user_mapping:
+        logger.error("Маппинг пользователей не найден")
         logger.error("Сначала запустите step1_users_migration.py")
         exit(1)
+    return user_mapping
 
-def save_project_mapping(project_mapping: Dict):
-    """Сохранение маппинга проектов"""
-    mapping_data = {
-        'projects': project_mapping,
-        'timestamp': datetime.now().isoformat(),
-        'step': 'projects_completed'
-    }
+def save_project_mapping(store: MappingStore):
+    """Выгрузка маппинга проектов в project_mapping.json"""
+    store.export_json('projects')
 
-    with open('project_mapping.json', 'w', encoding='utf-8') as f:
-        json.dump(mapping_data, f, ensure_ascii=False, indent=2)
+def migrate_queue(yandex_client: YandexTrackerClient, youtrack_client: YouTrackClient, store: MappingStore,
+                  bundles: SharedStateBundles, queue: Dict, leader_id: str) -> Dict[str, bool]:
+    """Создание проекта очереди и его статусов (выполняется в рабочем потоке)"""
+    queue_key = queue.get('key')
 
-    logger.debug(f"Маппинг проектов сохранен в project_mapping.json")
+    project_id = youtrack_client.create_project(queue, leader_id)
+    if not project_id:
+        return {'project': False, 'statuses': False}
 
-def load_existing_project_mapping() -> Dict:
-    """Загрузка существующего маппинга проектов"""
-    try:
-        with open('project_mapping.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return data.get('projects', {})
-    except FileNotFoundError:
-        return {}
+    # Маппинг фиксируется сразу: повторный запуск не создаст проект заново
+    store.set('projects', queue_key, project_id)
+
+    # Создаем статусы для проекта через state bundle
+    logger.info(f"  🔧 Настраиваем статусы для проекта {queue_key}")
+    statuses = yandex_client.get_queue_statuses(queue_key)
+
+    if youtrack_client.create_project_statuses(project_id, queue_key, statuses, bundles):
+        logger.info(f"  ✓ Статусы настроены для проекта {queue_key}")
+        return {'project': True, 'statuses': True}
+
+    logger.warning(f"  ⚠ Не удалось настроить статусы для проекта {queue_key}")
+    return {'project': True, 'statuses': False}
 
 def main():
     """Главная функция этапа 2"""
@@ -304,9 +297,11 @@ def main():
 
     # Загружаем конфигурацию
     config = load_config()
+    configure_http(config)
 
     # Загружаем маппинг пользователей
-    user_mapping = load_user_mapping()
+    store = open_mapping_store()
+    user_mapping = load_user_mapping(store)
     if not user_mapping:
         logger.error("Маппинг пользователей пуст")
         logger.error("Сначала успешно завершите step1_users_migration.py")
@@ -314,22 +309,30 @@ def main():
 
     logger.info(f"Загружен маппинг пользователей: {len(user_mapping)} пользователей")
 
+    migration_options = config.get('migration_options', {})
+    max_workers = max(1, migration_options.get('max_workers', 8))
+
     # Создаем клиентов
     is_cloud_org = config['yandex_tracker'].get('is_cloud_org', False)
 
-    yandex_client = YandexTrackerClient(
+    # Если выгружен снимок, данные Yandex Tracker читаются из него
+    yandex_client = open_snapshot(config) or YandexTrackerClient(
         config['yandex_tracker']['token'],
         config['yandex_tracker']['org_id'],
-        is_cloud_org
+        is_cloud_org,
+        filters=load_filters(config)
     )
 
     youtrack_client = YouTrackClient(
         config['youtrack']['url'],
-        config['youtrack']['token']
+        config['youtrack']['token'],
+        store,
+        pool_size=max_workers,
+        metadata_ttl=metadata_ttl(config)
     )
 
     # Загружаем существующий маппинг проектов
-    project_mapping = load_existing_project_mapping()
+    project_mapping = store.load('projects')
     logger.info(f"Загружен существующий маппинг проектов: {len(project_mapping)} проектов")
 
     # Получаем очереди из Yandex Tracker
@@ -338,56 +341,58 @@ def main():
         logger.error("Не удалось получить очереди из Yandex Tracker")
         exit(1)
 
-    logger.info(f"Начинаем миграцию {len(yandex_queues)} проектов...")
+    # Лидер всех создаваемых проектов - текущий пользователь, определяем его один раз
+    leader_id = youtrack_client.get_current_user_youtrack_id()
+    if not leader_id:
+        logger.error("Не удалось определить ID лидера проектов")
+        exit(1)
+
+    bundles = SharedStateBundles(store, youtrack_client.metadata, youtrack_client.create_state_bundle)
+
+    # Пропускаем уже мигрированные проекты
+    pending_queues = [queue for queue in yandex_queues if queue.get('key') not in project_mapping]
+    skip_count = len(yandex_queues) - len(pending_queues)
+    if skip_count:
+        logger.info(f"⏭ Уже мигрировано проектов: {skip_count}, пропускаем")
+
+    logger.info(f"Начинаем миграцию {len(pending_queues)} проектов в {max_workers} потоков...")
 
-    # Мигрируем проекты
+    # Мигрируем проекты: очереди обрабатываются параллельно, общий лимит запросов
+    # к YouTrack соблюдает migration_http
     success_count = 0
-    skip_count = 0
     error_count = 0
     status_success_count = 0
     status_error_count = 0
 
-    for i, queue in enumerate(yandex_queues, 1):
-        queue_key = queue.get('key')
-        queue_name = queue.get('name', queue_key)
-
-        logger.info(f"[{i}/{len(yandex_queues)}] Обрабатываем проект: {queue_key} - {queue_name}")
-
-        # Пропускаем если уже мигрирован
-        if queue_key in project_mapping:
-            logger.info(f"⏭ Проект {queue_key} уже мигрирован, пропускаем")
-            skip_count += 1
-            continue
-
-        # Создаем проект
-        project_id = youtrack_client.create_project(queue)
-        if project_id:
-            project_mapping[queue_key] = project_id
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='project') as executor:
+        futures = {
+            executor.submit(migrate_queue, yandex_client, youtrack_client, store, bundles, queue, leader_id): queue
+            for queue in pending_queues
+        }
+        for i, future in enumerate(as_completed(futures), 1):
+            queue = futures[future]
+            queue_key = queue.get('key')
+            try:
+                outcome = future.result()
+            except Exception as e:
+                logger.error(f"✗ Ошибка миграции проекта {queue_key}: {e}")
+                outcome = {'project': False, 'statuses': False}
+
+            logger.info(f"[{i}/{len(pending_queues)}] Обработан проект: {queue_key} - {queue.get('name', queue_key)}")
+
+            if not outcome['project']:
+                error_count += 1
+                continue
             success_count += 1
-
-            # Создаем статусы для проекта через state bundle
-            logger.info(f"  🔧 Настраиваем статусы для проекта {queue_key}")
-            statuses = yandex_client.get_queue_statuses(queue_key)
-
-            if youtrack_client.create_project_statuses(project_id, queue_key, statuses):
+            if outcome['statuses']:
                 status_success_count += 1
-                logger.info(f"  ✓ Статусы настроены для проекта {queue_key}")
             else:
                 status_error_count += 1
-                logger.warning(f"  ⚠ Не удалось настроить статусы для проекта {queue_key}")
-        else:
-            error_count += 1
-
-        # Пауза между запросами
-        time.sleep(1.0)
 
-        # Сохраняем промежуточный результат каждые 5 проектов
-        if i % 5 == 0:
-            save_project_mapping(project_mapping)
-            logger.info(f"Промежуточное сохранение: {i} проектов обработано")
+    project_mapping = store.load('projects')
 
-    # Сохраняем финальный результат
-    save_project_mapping(project_mapping)
+    # Выгружаем финальный результат в JSON
+    save_project_mapping(store)
 
     # Выводим статистику
     logger.info("=" * 50)
@@ -397,7 +402,10 @@ def main():
     logger.info(f"✗ Ошибок создания проектов: {error_count}")
     logger.info(f"✓ Статусы настроены: {status_success_count}")
     logger.info(f"⚠ Ошибок настройки статусов: {status_error_count}")
+    logger.info(f"🎨 State bundles: создано {bundles.stats['created']}, "
+                f"переиспользовано {bundles.stats['reused']}")
     logger.info(f"📊 Всего в маппинге: {len(project_mapping)}")
+    log_http_stats(logger)
     logger.info("=" * 50)
 
     if error_count == 0:
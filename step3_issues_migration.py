@@ -4,12 +4,23 @@
 Создает задачи с комментариями и сохраняет маппинг
 """
 
+import os
+import queue
+import hashlib
 import requests
 import json
-import time
 import logging
-from typing import Dict, List, Optional
-from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
+
+from link_planner import parse_yandex_links
+from mapping_store import DELTA_WATERMARK, STAGE_CREATED, STAGE_DONE, MappingStore, open_mapping_store
+from migration_filters import MigrationFilters, load_filters
+from migration_http import SCROLL_TTL_MS, configure_http, create_session, log_http_stats
+from yandex_snapshot import SnapshotYandexClient, open_snapshot
 
 # Настройка логирования
 logging.basicConfig(
@@ -22,14 +33,137 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Каталог с курсорами и уже выгруженными страницами scroll-выгрузки
+EXPORT_STATE_DIR = 'issue_export'
+
+# Сколько выгруженных страниц может ждать обработки в очереди производитель-потребитель
+PREFETCH_PAGES = 2
+
+class ScrollExportState:
+    """Сохраненный на диске курсор scroll-выгрузки очереди и выгруженные задачи"""
+
+    def __init__(self, queue_key: str, directory: str = EXPORT_STATE_DIR):
+        self.queue_key = queue_key
+        self.issues_path = os.path.join(directory, f"{queue_key}.ndjson")
+        self.cursor_path = os.path.join(directory, f"{queue_key}.cursor.json")
+        os.makedirs(directory, exist_ok=True)
+
+    def load_cursor(self) -> Dict:
+        try:
+            with open(self.cursor_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def iter_saved_pages(self, exported: int, page_size: int) -> Iterator[List[Dict]]:
+        """Постраничное чтение выгруженных задач без загрузки файла целиком"""
+        page = []
+        count = 0
+        try:
+            with open(self.issues_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if count >= exported:
+                        break
+                    page.append(json.loads(line))
+                    count += 1
+                    if len(page) >= page_size:
+                        yield page
+                        page = []
+        except FileNotFoundError:
+            pass
+        if page:
+            yield page
+
+    def truncate(self, exported: int):
+        """Отбрасывание хвоста от прерванной дозаписи (строк после последнего сохраненного курсора)"""
+        if not os.path.exists(self.issues_path):
+            return
+        tmp_path = f"{self.issues_path}.tmp"
+        with open(self.issues_path, 'r', encoding='utf-8') as src, open(tmp_path, 'w', encoding='utf-8') as dst:
+            for i, line in enumerate(src):
+                if i >= exported:
+                    break
+                dst.write(line)
+        os.replace(tmp_path, self.issues_path)
+
+    def save_page(self, issues: List[Dict], exported: int, scroll_id: str, scroll_token: Optional[str],
+                  issue_filter: Dict):
+        """Дозапись страницы и затем курсора (курсор пишется атомарно через временный файл)"""
+        with open(self.issues_path, 'a', encoding='utf-8') as f:
+            for issue in issues:
+                f.write(json.dumps(issue, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._save_cursor({
+            'scroll_id': scroll_id,
+            'scroll_token': scroll_token,
+            'filter': issue_filter,
+            'exported': exported,
+            'done': False,
+            'timestamp': datetime.now().isoformat()
+        })
+
+    def mark_done(self, exported: int, issue_filter: Dict):
+        self._save_cursor({'exported': exported, 'filter': issue_filter, 'done': True,
+                           'timestamp': datetime.now().isoformat()})
+
+    def _save_cursor(self, cursor: Dict):
+        tmp_path = f"{self.cursor_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cursor, f)
+        os.replace(tmp_path, self.cursor_path)
+
+    def clear(self):
+        """Удаление состояния после обработки очереди"""
+        for path in (self.issues_path, self.cursor_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+def format_issue_description(issue_data: Dict) -> str:
+    """Описание задачи YouTrack: исходное описание и сведения об исходной задаче"""
+    original_info = f"\n\n---\n**Исходная задача:** {issue_data.get('key')}\n"
+    original_info += f"**Автор:** {issue_data.get('createdBy', {}).get('display', 'Unknown')}\n"
+    original_info += f"**Дата создания:** {issue_data.get('createdAt', '')}\n"
+
+    if issue_data.get('assignee'):
+        original_info += f"**Исполнитель:** {issue_data['assignee'].get('display', 'Unknown')}\n"
+
+    return (issue_data.get('description') or '') + original_info
+
+def format_comment(comment_data: Dict) -> str:
+    """Текст комментария YouTrack с информацией об авторе"""
+    author = comment_data.get('createdBy', {})
+    formatted_comment = f"**Автор:** {author.get('display', 'Unknown')}\n"
+    formatted_comment += f"**Дата:** {comment_data.get('createdAt', '')}\n\n"
+    formatted_comment += comment_data.get('text', '')
+    return formatted_comment
+
+def content_fingerprint(*parts: Optional[str]) -> str:
+    """Отпечаток содержимого, отправляемого в YouTrack"""
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def issue_fingerprint(issue_data: Dict) -> str:
+    return content_fingerprint(issue_data.get('summary'), format_issue_description(issue_data))
+
+def comment_fingerprint(comment_data: Dict) -> str:
+    return content_fingerprint(format_comment(comment_data))
+
+def links_fingerprint(yandex_links: List[Dict]) -> str:
+    return content_fingerprint(*sorted(f"{link['target_key']} {link['type']} {link['direction']}"
+                                       for link in parse_yandex_links(yandex_links)))
+
 class YandexTrackerClient:
     """Клиент для работы с Yandex Tracker API"""
 
-    def __init__(self, token: str, org_id: str, is_cloud_org: bool = False):
+    def __init__(self, token: str, org_id: str, is_cloud_org: bool = False, pool_size: int = 10,
+                 filters: Optional[MigrationFilters] = None):
         self.token = token
         self.org_id = org_id
         self.base_url = "https://api.tracker.yandex.net/v2"
-        self.session = requests.Session()
+        self.filters = filters or MigrationFilters()
+        self.session = create_session()
+        # Пул соединений должен вмещать все рабочие потоки
+        self.session.mount('https://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
         # Выбираем правильный заголовок для организации
         org_header = 'X-Cloud-Org-Id' if is_cloud_org else 'X-Org-ID'
         self.session.headers.update({
@@ -38,41 +172,159 @@ class YandexTrackerClient:
             'Content-Type': 'application/json'
         })
 
-    def get_issues(self, queue_key: str, per_page: int = 50) -> List[Dict]:
-        """Получение всех задач из очереди с пагинацией"""
-        all_issues = []
+    def iter_issue_pages(self, queue_key: str, per_page: int = 50) -> Iterator[List[Dict]]:
+        """Постраничное получение задач очереди (генератор)"""
         page = 1
+        total = 0
+        issue_filter = self.filters.issue_filter(queue_key)
 
         while True:
             try:
                 params = {
-                    'queue': queue_key,
                     'perPage': per_page,
                     'page': page
                 }
-                response = self.session.get(f"{self.base_url}/issues", params=params)
+                if len(issue_filter) > 1:
+                    # Ограничения по дате поддерживает только _search
+                    response = self.session.post(f"{self.base_url}/issues/_search", params=params,
+                                                 json={'filter': issue_filter}, idempotent=True)
+                else:
+                    params['queue'] = queue_key
+                    response = self.session.get(f"{self.base_url}/issues", params=params)
                 response.raise_for_status()
                 issues = response.json()
+            except requests.RequestException as e:
+                # Повторы уже исчерпаны: не обрываем выгрузку молча, а сообщаем вызывающему
+                logger.error(f"Ошибка получения задач для очереди {queue_key}, страница {page}: {e}")
+                raise
 
-                if not issues:
-                    break
+            if not issues:
+                break
+
+            total += len(issues)
+            logger.debug(f"  Получено {len(issues)} задач со страницы {page}")
+            yield issues
+            page += 1
+
+        logger.info(f"  📝 Всего получено {total} задач для очереди {queue_key}")
+
+    def get_issues(self, queue_key: str, per_page: int = 50) -> List[Dict]:
+        """Получение всех задач из очереди с пагинацией"""
+        all_issues = []
+        for issues in self.iter_issue_pages(queue_key, per_page):
+            all_issues.extend(issues)
+        return all_issues
 
-                all_issues.extend(issues)
-                logger.debug(f"  Получено {len(issues)} задач со страницы {page}")
-                page += 1
+    def iter_issue_pages_scroll(self, queue_key: str, per_scroll: int = 1000) -> Iterator[List[Dict]]:
+        """Получение задач очереди через scroll-курсор _search с возобновлением после сбоя (генератор)"""
+        state = ScrollExportState(queue_key)
+        issue_filter = self.filters.issue_filter(queue_key)
+        cursor = state.load_cursor()
+
+        # Выгрузка с другими фильтрами не подходит для продолжения
+        if cursor and cursor.get('filter', {'queue': queue_key}) != issue_filter:
+            logger.info(f"  ⚠ Фильтры очереди {queue_key} изменились, выгрузка начнется заново")
+            state.clear()
+            cursor = {}
+        exported = cursor.get('exported', 0)
+
+        # Сначала отдаем то, что уже выгружено в прошлых запусках
+        if exported:
+            state.truncate(exported)
+            yield from state.iter_saved_pages(exported, per_scroll)
+
+        if cursor.get('done'):
+            logger.info(f"  📝 Очередь {queue_key} уже выгружена ранее: {exported} задач")
+            return
+
+        scroll_id = cursor.get('scroll_id')
+        scroll_token = cursor.get('scroll_token')
+        if scroll_id:
+            logger.info(f"  ⏯ Продолжаем выгрузку очереди {queue_key} с {exported} задачи")
+        else:
+            state.truncate(0)
+            exported = 0
 
-                # Пауза между запросами
-                time.sleep(0.5)
+        while True:
+            params = {'scrollTTLMillis': SCROLL_TTL_MS}
+            headers = {}
+            if scroll_id:
+                params['scrollId'] = scroll_id
+                if scroll_token:
+                    headers['X-Scroll-Token'] = scroll_token
+            else:
+                params.update({'scrollType': 'unsorted', 'perScroll': per_scroll})
+
+            try:
+                response = self.session.post(
+                    f"{self.base_url}/issues/_search",
+                    params=params,
+                    json={'filter': issue_filter},
+                    headers=headers,
+                    # Первый запрос только открывает курсор, его повтор безопасен
+                    idempotent=not scroll_id
+                )
+
+                # Курсор истек (например, между запусками прошло больше TTL) - начинаем очередь заново.
+                # Уже отданные задачи повторно будут пропущены по маппингу
+                if scroll_id and 400 <= response.status_code < 500 and response.status_code != 429:
+                    logger.warning(f"  ⚠ Scroll-курсор очереди {queue_key} недействителен, выгрузка начнется заново")
+                    state.clear()
+                    exported = 0
+                    scroll_id = scroll_token = None
+                    continue
 
+                response.raise_for_status()
+                issues = response.json()
             except requests.RequestException as e:
-                logger.error(f"Ошибка получения задач для очереди {queue_key}, страница {page}: {e}")
+                # Курсор сохранен: следующий запуск продолжит с этого места
+                logger.error(f"Ошибка scroll-выгрузки задач очереди {queue_key} после {exported} задач: {e}")
+                raise
+
+            if not issues:
+                state.mark_done(exported, issue_filter)
                 break
 
-        logger.info(f"  📝 Всего получено {len(all_issues)} задач для очереди {queue_key}")
-        return all_issues
+            scroll_id = response.headers.get('X-Scroll-Id', scroll_id)
+            scroll_token = response.headers.get('X-Scroll-Token', scroll_token)
+            exported += len(issues)
+            state.save_page(issues, exported, scroll_id, scroll_token, issue_filter)
+            logger.debug(f"  Получено {len(issues)} задач через scroll, всего {exported}")
+            yield issues
 
-    def get_issue_comments(self, issue_key: str) -> List[Dict]:
-        """Получение комментариев к задаче"""
+        logger.info(f"  📝 Всего получено {exported} задач для очереди {queue_key}")
+
+    def iter_search_pages(self, issue_filter: Dict, per_scroll: int = 1000) -> Iterator[List[Dict]]:
+        """Задачи по произвольному фильтру _search через scroll-курсор (без сохранения курсора)"""
+        scroll_id = scroll_token = None
+        while True:
+            params = {'scrollTTLMillis': SCROLL_TTL_MS}
+            headers = {}
+            if scroll_id:
+                params['scrollId'] = scroll_id
+                if scroll_token:
+                    headers['X-Scroll-Token'] = scroll_token
+            else:
+                params.update({'scrollType': 'unsorted', 'perScroll': per_scroll})
+
+            try:
+                response = self.session.post(f"{self.base_url}/issues/_search", params=params,
+                                             json={'filter': issue_filter}, headers=headers,
+                                             idempotent=not scroll_id)
+                response.raise_for_status()
+                issues = response.json()
+            except requests.RequestException as e:
+                logger.error(f"Ошибка поиска задач по фильтру {issue_filter}: {e}")
+                raise
+
+            if not issues:
+                return
+            scroll_id = response.headers.get('X-Scroll-Id', scroll_id)
+            scroll_token = response.headers.get('X-Scroll-Token', scroll_token)
+            yield issues
+
+    def get_issue_comments(self, issue_key: str) -> Optional[List[Dict]]:
+        """Получение комментариев к задаче (None при ошибке)"""
         try:
             response = self.session.get(f"{self.base_url}/issues/{issue_key}/comments")
             response.raise_for_status()
@@ -81,41 +333,51 @@ class YandexTrackerClient:
             return comments
         except requests.RequestException as e:
             logger.error(f"Ошибка получения комментариев для задачи {issue_key}: {e}")
-            return []
+            return None
+
+    def get_issue_links(self, issue_key: str) -> Optional[List[Dict]]:
+        """Получение связей задачи (None при ошибке).
+        Поиск задач Yandex Tracker не отдает связи вместе с задачей, поэтому без снимка это
+        по-прежнему один GET на задачу: запрос перенесен из этапа 4 в рабочие потоки этапа 3
+        и идет параллельно с созданием задач. Повторно связи запрашиваются только для задач,
+        изменившихся после прошлого получения (см. IssueMigrator.fetch_issue_links).
+        При работе через снимок связи читаются из yandex_snapshot.db без обращения к API"""
+        try:
+            response = self.session.get(f"{self.base_url}/issues/{issue_key}/links")
+            response.raise_for_status()
+            links = response.json()
+            logger.debug(f"    🔗 Получено {len(links)} связей для задачи {issue_key}")
+            return links
+        except requests.RequestException as e:
+            logger.error(f"Ошибка получения связей для задачи {issue_key}: {e}")
+            return None
 
 class YouTrackClient:
     """Клиент для работы с YouTrack API"""
 
-    def __init__(self, base_url: str, token: str):
+    def __init__(self, base_url: str, token: str, pool_size: int = 10):
         self.base_url = base_url.rstrip('/')
         self.token = token
-        self.session = requests.Session()
+        self.session = create_session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         self.session.headers.update({
             'Authorization': f'Bearer {token}',
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         })
 
-    def create_issue(self, issue_data: Dict, project_id: str) -> Optional[str]:
-        """Создание задачи в YouTrack"""
+    def create_issue(self, issue_data: Dict, project_id: str) -> Optional[Dict]:
+        """Создание задачи в YouTrack, возвращает {'id', 'idReadable'}"""
         try:
             # Подготавливаем данные задачи
             yt_issue = {
                 'project': {'id': project_id},
                 'summary': issue_data.get('summary'),
-                'description': issue_data.get('description', ''),
+                'description': format_issue_description(issue_data),
             }
 
-            # Добавляем дополнительную информацию в описание
-            original_info = f"\n\n---\n**Исходная задача:** {issue_data.get('key')}\n"
-            original_info += f"**Автор:** {issue_data.get('createdBy', {}).get('display', 'Unknown')}\n"
-            original_info += f"**Дата создания:** {issue_data.get('createdAt', '')}\n"
-
-            if issue_data.get('assignee'):
-                original_info += f"**Исполнитель:** {issue_data['assignee'].get('display', 'Unknown')}\n"
-
-            yt_issue['description'] += original_info
-
             response = self.session.post(
                 f"{self.base_url}/api/issues",
                 json=yt_issue,
@@ -125,7 +387,7 @@ class YouTrackClient:
             if response.status_code in [200, 201]:
                 created_issue = response.json()
                 logger.debug(f"    ✓ Создана задача: {created_issue.get('idReadable')}")
-                return created_issue.get('id')
+                return created_issue
             else:
                 logger.error(f"    ✗ Ошибка создания задачи: {response.status_code} - {response.text}")
                 return None
@@ -134,35 +396,79 @@ class YouTrackClient:
             logger.error(f"    ✗ Ошибка создания задачи: {e}")
             return None
 
-    def add_comment_to_issue(self, issue_id: str, comment_data: Dict) -> bool:
-        """Добавление комментария к задаче"""
+    def add_comment_to_issue(self, issue_id: str, comment_data: Dict) -> Optional[str]:
+        """Добавление комментария к задаче, возвращает ID комментария"""
         try:
-            comment_text = comment_data.get('text', '')
-            author = comment_data.get('createdBy', {})
-            created_date = comment_data.get('createdAt', '')
-
-            # Формируем текст комментария с информацией об авторе
-            formatted_comment = f"**Автор:** {author.get('display', 'Unknown')}\n"
-            formatted_comment += f"**Дата:** {created_date}\n\n"
-            formatted_comment += comment_text
-
             response = self.session.post(
                 f"{self.base_url}/api/issues/{issue_id}/comments",
-                json={'text': formatted_comment},
+                json={'text': format_comment(comment_data)},
                 params={'fields': 'id'}
             )
 
             if response.status_code in [200, 201]:
                 logger.debug(f"      💬 Добавлен комментарий к задаче")
-                return True
+                return response.json().get('id')
             else:
                 logger.warning(f"      ⚠ Не удалось добавить комментарий: {response.status_code}")
-                return False
+                return None
 
         except requests.RequestException as e:
             logger.error(f"      ✗ Ошибка добавления комментария: {e}")
+            return None
+
+    def update_issue(self, issue_id: str, issue_data: Dict) -> bool:
+        """Обновление заголовка и описания перенесенной задачи"""
+        try:
+            response = self.session.post(
+                f"{self.base_url}/api/issues/{issue_id}",
+                json={'summary': issue_data.get('summary'), 'description': format_issue_description(issue_data)},
+                params={'fields': 'id'}
+            )
+
+            if response.status_code == 200:
+                logger.debug(f"    ✓ Обновлена задача {issue_id}")
+                return True
+            else:
+                logger.error(f"    ✗ Ошибка обновления задачи {issue_id}: {response.status_code} - {response.text}")
+                return False
+
+        except requests.RequestException as e:
+            logger.error(f"    ✗ Ошибка обновления задачи {issue_id}: {e}")
             return False
 
+    def update_comment(self, issue_id: str, comment_id: str, comment_data: Dict) -> bool:
+        """Обновление текста перенесенного комментария"""
+        try:
+            response = self.session.post(
+                f"{self.base_url}/api/issues/{issue_id}/comments/{comment_id}",
+                json={'text': format_comment(comment_data)},
+                params={'fields': 'id'}
+            )
+
+            if response.status_code == 200:
+                logger.debug(f"      💬 Обновлен комментарий {comment_id}")
+                return True
+            else:
+                logger.warning(f"      ⚠ Не удалось обновить комментарий {comment_id}: {response.status_code}")
+                return False
+
+        except requests.RequestException as e:
+            logger.error(f"      ✗ Ошибка обновления комментария: {e}")
+            return False
+
+    def get_issue_comment_ids(self, issue_id: str) -> Optional[List[str]]:
+        """ID комментариев задачи в порядке создания (None при ошибке)"""
+        try:
+            response = self.session.get(
+                f"{self.base_url}/api/issues/{issue_id}/comments",
+                params={'fields': 'id', '$top': -1}
+            )
+            response.raise_for_status()
+            return [comment.get('id') for comment in response.json()]
+        except requests.RequestException as e:
+            logger.error(f"      ✗ Ошибка получения комментариев задачи {issue_id}: {e}")
+            return None
+
 def load_config() -> Dict:
     """Загрузка конфигурации"""
     try:
@@ -172,38 +478,345 @@ def load_config() -> Dict:
         logger.error("Файл migration_config.json не найден")
         exit(1)
 
-def load_project_mapping() -> Dict:
+def load_project_mapping(store: MappingStore) -> Dict:
     """Загрузка маппинга проектов"""
-    try:
-        with open('project_mapping.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return data.get('projects', {})
-    except FileNotFoundError:
-        logger.error("Файл project_mapping.json не найден")
+    project_mapping = store.load('projects')
+    if not project_mapping:
+        logger.error("Маппинг проектов не найден")
         logger.error("Сначала запустите step2_projects_migration.py")
         exit(1)
+    return project_mapping
+
+def comment_key(issue_key: str, comment: Dict) -> str:
+    """Ключ комментария в хранилище маппингов"""
+    return f"{issue_key}/{comment.get('id')}"
+
+def save_issue_mapping(store: MappingStore):
+    """Выгрузка маппинга задач в issue_mapping.json"""
+    store.export_json('issues')
+
+class IssueMigrator:
+    """Потоковое параллельное создание задач с ограничением числа потоков глобально и на проект"""
+
+    def __init__(self, yandex_client: YandexTrackerClient, youtrack_client: YouTrackClient,
+                 store: MappingStore, migrate_comments: bool = True, batch_size: int = 50,
+                 max_workers: int = 8, max_workers_per_project: int = 4,
+                 export_mode: str = 'scroll', scroll_batch_size: int = 1000):
+        self.yandex_client = yandex_client
+        self.youtrack_client = youtrack_client
+        self.store = store
+        self.migrate_comments = migrate_comments
+        self.batch_size = batch_size
+        self.export_mode = export_mode
+        self.scroll_batch_size = scroll_batch_size
+        self.max_workers = max(1, max_workers)
+        self.max_workers_per_project = max(1, min(max_workers_per_project, self.max_workers))
+
+        # Общий пул потоков для создания задач всех проектов
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='issue')
+        # Блокировка защищает счетчики
+        self.lock = threading.Lock()
+        self.total_issues_processed = 0
+
+    def migrate_issue(self, issue: Dict, project_id: str, issue_id: Optional[str] = None) -> Optional[str]:
+        """Создание одной задачи и ее комментариев (выполняется в рабочем потоке).
+        Если issue_id передан, задача уже создана и перенос продолжается с сохраненного места"""
+        issue_key = issue.get('key')
+        resumed = issue_id is not None
+
+        if not resumed:
+            created_issue = self.youtrack_client.create_issue(issue, project_id)
+            if not created_issue or not created_issue.get('id'):
+                return None
+            issue_id = created_issue['id']
+
+            # Маппинг и этап записываем сразу после создания: повторный запуск не создаст дубль
+            self.store.record_issue_created(issue_key, issue_id,
+                                            STAGE_CREATED if self.migrate_comments else STAGE_DONE,
+                                            readable_id=created_issue.get('idReadable'))
+            self.store.set_fingerprint('issues', issue_key, issue_fingerprint(issue), issue.get('updatedAt'))
 
-def save_issue_mapping(issue_mapping: Dict):
-    """Сохранение маппинга задач"""
-    mapping_data = {
-        'issues': issue_mapping,
-        'timestamp': datetime.now().isoformat(),
-        'step': 'issues_completed'
-    }
+        # Ошибка получения связей не критична - этап 4 сам запросит связи недостающих задач
+        self.fetch_issue_links(issue)
 
-    with open('issue_mapping.json', 'w', encoding='utf-8') as f:
-        json.dump(mapping_data, f, ensure_ascii=False, indent=2)
+        if self.migrate_comments and not self.migrate_issue_comments(issue_key, issue_id, resumed):
+            return None
 
-    logger.info(f"Маппинг задач сохранен в issue_mapping.json")
+        return issue_id
 
-def load_existing_issue_mapping() -> Dict:
-    """Загрузка существующего маппинга задач"""
-    try:
-        with open('issue_mapping.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return data.get('issues', {})
-    except FileNotFoundError:
-        return {}
+    def fetch_issue_links(self, issue: Dict) -> bool:
+        """Сохранение связей задачи локально: этап 4 обращается только к задачам, у которых они есть.
+        Без снимка это отдельный GET на задачу (см. YandexTrackerClient.get_issue_links), поэтому
+        связи, уже полученные для этой версии задачи (тот же updatedAt), повторно не запрашиваются.
+        Неизменившиеся связи не перезаписываются, и этап 4 не обрабатывает их заново"""
+        issue_key = issue.get('key')
+        saved = self.store.get_fingerprint('links', issue_key)
+        if saved and saved[1] and saved[1] == issue.get('updatedAt'):
+            return True
+
+        links = self.yandex_client.get_issue_links(issue_key)
+        if links is None:
+            return False
+        digest = links_fingerprint(links)
+        if not saved or saved[0] != digest:
+            self.store.save_issue_links(issue_key, links)
+        self.store.set_fingerprint('links', issue_key, digest, issue.get('updatedAt'))
+        return True
+
+    def migrate_issue_comments(self, issue_key: str, issue_id: str, resumed: bool) -> bool:
+        """Перенос комментариев задачи с места остановки; каждый комментарий фиксируется в хранилище"""
+        comments = self.yandex_client.get_issue_comments(issue_key)
+        if comments is None:
+            return False
+
+        total = len(comments)
+        progress = self.store.get_progress(issue_key)
+        done = progress['comments_done'] if progress else 0
+
+        if resumed:
+            done = self.reconcile_comments(issue_key, issue_id, comments, done)
+            if done is None:
+                return False
+            if done < total:
+                logger.info(f"    ↻ {issue_key}: продолжаем перенос комментариев с {done}/{total}")
+
+        if done >= total:
+            self.store.set_progress(issue_key, STAGE_DONE, done, total)
+            return True
+
+        # Комментарии одной задачи добавляем последовательно, чтобы сохранить их порядок
+        for position in range(done, total):
+            comment = comments[position]
+            comment_id = self.youtrack_client.add_comment_to_issue(issue_id, comment)
+            if not comment_id:
+                logger.warning(f"    ⚠ {issue_key}: перенесено {position}/{total} комментариев, "
+                               f"остальные будут добавлены при повторном запуске")
+                return False
+            self.record_comment(issue_key, comment, comment_id, position + 1, total)
+
+        return True
+
+    def record_comment(self, issue_key: str, comment: Dict, comment_id: str, done: int, total: int):
+        """Маппинг, счетчик и отпечаток перенесенного комментария"""
+        key = comment_key(issue_key, comment)
+        self.store.record_comment(issue_key, key, comment_id, done, total)
+        self.store.set_fingerprint('comments', key, comment_fingerprint(comment))
+
+    def reconcile_comments(self, issue_key: str, issue_id: str, comments: List[Dict], done: int) -> Optional[int]:
+        """Учет комментариев, добавленных в YouTrack, но не успевших попасть в хранилище до сбоя"""
+        existing_ids = self.youtrack_client.get_issue_comment_ids(issue_id)
+        if existing_ids is None:
+            return None
+
+        # Комментарии добавляются строго по порядку, поэтому лишние в YouTrack - это следующие по списку
+        while done < min(len(existing_ids), len(comments)):
+            comment = comments[done]
+            done += 1
+            self.record_comment(issue_key, comment, existing_ids[done - 1], done, len(comments))
+            logger.info(f"    ⏭ {issue_key}: комментарий {done}/{len(comments)} уже был добавлен")
+
+        return done
+
+    def is_unchanged(self, issue: Dict) -> bool:
+        """Задача не менялась в Yandex Tracker после переноса (проверка без запросов к API)"""
+        saved = self.store.get_fingerprint('issues', issue.get('key'))
+        return bool(saved and saved[1] and saved[1] == issue.get('updatedAt'))
+
+    def refresh_issue(self, issue: Dict, issue_id: str) -> Optional[bool]:
+        """Обновление перенесенной задачи, измененной после переноса: в YouTrack отправляются только
+        изменившиеся заголовок/описание и комментарии. Возвращает True, если что-то обновлено,
+        False, если содержимое не изменилось, и None при ошибке"""
+        issue_key = issue.get('key')
+        digest = issue_fingerprint(issue)
+        saved = self.store.get_fingerprint('issues', issue_key)
+
+        # Задача перенесена до появления отпечатков: отпечаток снимается с уже полученных данных
+        # без записи в YouTrack, иначе первый запуск после обновления переписал бы все задачи
+        if saved is None:
+            self.store.set_fingerprint('issues', issue_key, digest, issue.get('updatedAt'))
+            return False
+
+        changed = saved[0] != digest
+        if changed and not self.youtrack_client.update_issue(issue_id, issue):
+            return None
+
+        if self.migrate_comments:
+            comments_changed = self.refresh_comments(issue_key, issue_id)
+            if comments_changed is None:
+                return None
+            changed = changed or comments_changed
+
+        # Связи могли измениться вместе с задачей: этап 4 досоздаст новые
+        if not self.fetch_issue_links(issue):
+            return None
+
+        # Отпечаток фиксируем последним: после сбоя задача будет проверена повторно
+        self.store.set_fingerprint('issues', issue_key, digest, issue.get('updatedAt'))
+        return changed
+
+    def refresh_comments(self, issue_key: str, issue_id: str) -> Optional[bool]:
+        """Обновление отредактированных и добавление новых комментариев перенесенной задачи"""
+        comments = self.yandex_client.get_issue_comments(issue_key)
+        if comments is None:
+            return None
+
+        progress = self.store.get_progress(issue_key)
+        done = progress['comments_done'] if progress else 0
+        if progress is None:
+            # Комментарии задач из старых маппингов сопоставляем с уже добавленными по порядку
+            done = self.reconcile_comments(issue_key, issue_id, comments, 0)
+            if done is None:
+                return None
+
+        changed = False
+        for comment in comments:
+            key = comment_key(issue_key, comment)
+            comment_id = self.store.get('comments', key)
+
+            if comment_id:
+                saved = self.store.get_fingerprint('comments', key)
+                digest = comment_fingerprint(comment)
+                if saved is None:
+                    # Комментарий перенесен до появления отпечатков - только фиксируем отпечаток
+                    self.store.set_fingerprint('comments', key, digest)
+                    continue
+                if saved[0] == digest:
+                    continue
+                if not self.youtrack_client.update_comment(issue_id, comment_id, comment):
+                    return None
+                self.store.set_fingerprint('comments', key, digest)
+            else:
+                comment_id = self.youtrack_client.add_comment_to_issue(issue_id, comment)
+                if not comment_id:
+                    return None
+                done += 1
+                self.record_comment(issue_key, comment, comment_id, done, max(done, len(comments)))
+            changed = True
+
+        return changed
+
+    def sync_issue(self, issue: Dict, project_id: str, issue_id: Optional[str]) -> str:
+        """Обработка задачи в рабочем потоке; возвращает раздел статистики"""
+        if issue_id and not self.needs_resume(issue.get('key')):
+            changed = self.refresh_issue(issue, issue_id)
+            if changed is None:
+                return 'error'
+            return 'updated' if changed else 'skip'
+        return 'success' if self.migrate_issue(issue, project_id, issue_id) else 'error'
+
+    def needs_resume(self, issue_key: str) -> bool:
+        """Задача создана, но перенос комментариев не завершен"""
+        if not self.migrate_comments:
+            return False
+        progress = self.store.get_progress(issue_key)
+        # Задачи из маппингов до появления учета этапов считаются перенесенными полностью
+        return progress is not None and progress['stage'] != STAGE_DONE
+
+    def mark_processed(self):
+        """Учет обработанной задачи (маппинг уже зафиксирован в хранилище)"""
+        with self.lock:
+            self.total_issues_processed += 1
+            if self.total_issues_processed % 50 == 0:
+                logger.info(f"  💾 Обработано задач: {self.total_issues_processed}")
+
+    def iter_issue_pages(self, queue_key: str) -> Iterator[List[Dict]]:
+        """Выгрузка задач очереди выбранным способом (scroll или постраничный)"""
+        if self.export_mode == 'scroll':
+            return self.yandex_client.iter_issue_pages_scroll(queue_key, self.scroll_batch_size)
+        return self.yandex_client.iter_issue_pages(queue_key, self.batch_size)
+
+    def produce_pages(self, queue_key: str, pages: queue.Queue):
+        """Поток-производитель: складывает страницы задач в ограниченную очередь"""
+        try:
+            for issues in self.iter_issue_pages(queue_key):
+                pages.put(issues)
+            pages.put(None)
+        except Exception as e:
+            pages.put(e)
+
+    def on_issue_done(self, queue_key: str, stats: Dict[str, int], project_slots: threading.Semaphore, future):
+        """Учет результата задачи (вызывается в рабочем потоке по завершении)"""
+        try:
+            outcome = future.result()
+        except Exception as e:
+            logger.error(f"    ✗ Ошибка миграции задачи проекта {queue_key}: {e}")
+            outcome = 'error'
+
+        with self.lock:
+            stats[outcome] += 1
+            done = stats['success'] + stats['updated'] + stats['error']
+
+        if done % 10 == 0:
+            logger.info(f"    [{done}] Обработано задач в проекте {queue_key}")
+
+        self.mark_processed()
+        project_slots.release()
+
+    def migrate_project(self, queue_key: str, project_id: str) -> Dict[str, int]:
+        """Потоковая миграция задач одного проекта: страницы сразу уходят в рабочие потоки"""
+        stats = {'success': 0, 'updated': 0, 'skip': 0, 'error': 0}
+        fetched = 0
+        fetch_failed = False
+
+        # Ограниченная очередь страниц: выгрузка не убегает вперед создания задач,
+        # поэтому память не зависит от размера очереди
+        pages = queue.Queue(maxsize=PREFETCH_PAGES)
+        producer = threading.Thread(target=self.produce_pages, args=(queue_key, pages),
+                                    name=f"export-{queue_key}", daemon=True)
+        producer.start()
+
+        # Семафор ограничивает число одновременно создаваемых задач проекта
+        project_slots = threading.BoundedSemaphore(self.max_workers_per_project)
+
+        while True:
+            issues = pages.get()
+            if issues is None:
+                break
+            if isinstance(issues, Exception):
+                logger.error(f"  ✗ Не удалось получить все задачи проекта {queue_key}, "
+                             f"оставшиеся будут обработаны при повторном запуске")
+                fetch_failed = True
+                break
+
+            fetched += len(issues)
+            for issue in issues:
+                # Пропускаем перенесенные задачи, не менявшиеся с момента переноса;
+                # незавершенные дообрабатываем, измененные обновляем
+                issue_id = self.store.get('issues', issue.get('key'))
+                if issue_id and not self.needs_resume(issue.get('key')) and self.is_unchanged(issue):
+                    with self.lock:
+                        stats['skip'] += 1
+                    self.mark_processed()
+                    continue
+
+                project_slots.acquire()
+                future = self.executor.submit(self.sync_issue, issue, project_id, issue_id)
+                future.add_done_callback(
+                    lambda f: self.on_issue_done(queue_key, stats, project_slots, f)
+                )
+
+        # Дожидаемся завершения всех задач проекта, забирая все слоты
+        for _ in range(self.max_workers_per_project):
+            project_slots.acquire()
+        producer.join()
+
+        if fetch_failed:
+            stats['error'] += 1
+        elif fetched == 0:
+            logger.warning(f"  ⚠ Нет задач в проекте {queue_key}")
+
+        # Статистика по проекту
+        logger.info(f"  📊 Проект {queue_key}: ✓{stats['success']} ↻{stats['updated']} ⏭{stats['skip']} ✗{stats['error']}")
+
+        # Выгрузка очереди через API обработана, сохраненный курсор больше не нужен
+        # (при чтении из снимка курсора нет и каталог состояния не создается)
+        if self.export_mode == 'scroll' and not fetch_failed and isinstance(self.yandex_client, YandexTrackerClient):
+            ScrollExportState(queue_key).clear()
+
+        return stats
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
 
 def main():
     """Главная функция этапа 3"""
@@ -213,120 +826,116 @@ def main():
 
     # Загружаем конфигурацию
     config = load_config()
+    configure_http(config)
 
     # Загружаем маппинг проектов
-    project_mapping = load_project_mapping()
-    if not project_mapping:
-        logger.error("Маппинг проектов пуст")
-        logger.error("Сначала успешно завершите step2_projects_migration.py")
-        exit(1)
+    store = open_mapping_store()
+    project_mapping = load_project_mapping(store)
 
     logger.info(f"Загружен маппинг проектов: {len(project_mapping)} проектов")
 
+    # Очереди и даты из раздела filtering передаются в запросы выгрузки
+    filters = load_filters(config)
+    project_mapping = filters.filter_mapping(project_mapping)
+    if filters.active:
+        logger.info(f"Проектов после фильтрации: {len(project_mapping)}")
+
+    # Получаем настройки миграции
+    migration_options = config.get('migration_options', {})
+    migrate_comments = migration_options.get('migrate_comments', True)
+    batch_size = migration_options.get('batch_size', 50)
+    max_workers = migration_options.get('max_workers', 8)
+    max_workers_per_project = migration_options.get('max_workers_per_project', 4)
+    export_mode = migration_options.get('export_mode', 'scroll')
+    scroll_batch_size = migration_options.get('scroll_batch_size', 1000)
+
     # Создаем клиентов
     is_cloud_org = config['yandex_tracker'].get('is_cloud_org', False)
     
-    yandex_client = YandexTrackerClient(
+    # Если выгружен снимок, данные Yandex Tracker читаются из него
+    yandex_client = open_snapshot(config) or YandexTrackerClient(
         config['yandex_tracker']['token'],
         config['yandex_tracker']['org_id'],
-        is_cloud_org
+        is_cloud_org,
+        pool_size=max_workers,
+        filters=filters
     )
 
     youtrack_client = YouTrackClient(
         config['youtrack']['url'],
-        config['youtrack']['token']
+        config['youtrack']['token'],
+        pool_size=max_workers
     )
 
-    # Загружаем существующий маппинг задач
-    issue_mapping = load_existing_issue_mapping()
-    logger.info(f"Загружен существующий маппинг задач: {len(issue_mapping)} задач")
-
-    # Получаем настройки миграции
-    migration_options = config.get('migration_options', {})
-    migrate_comments = migration_options.get('migrate_comments', True)
-    batch_size = migration_options.get('batch_size', 50)
-
-    logger.info(f"Настройки: комментарии={'ВКЛ' if migrate_comments else 'ВЫКЛ'}, размер пакета={batch_size}")
+    # Изменения, сделанные после этого момента, перенесет дельта-синхронизация
+    if isinstance(yandex_client, SnapshotYandexClient):
+        run_started = yandex_client.started_at()
+    else:
+        run_started = datetime.now(timezone.utc).isoformat()
+
+    # Существующий маппинг задач хранится в базе, уже перенесенные задачи пропускаются
+    logger.info(f"Загружен существующий маппинг задач: {store.count('issues')} задач")
+
+    logger.info(f"Настройки: комментарии={'ВКЛ' if migrate_comments else 'ВЫКЛ'}, размер пакета={batch_size}, "
+                f"выгрузка={export_mode}, потоков={max_workers}, потоков на проект={max_workers_per_project}")
+
+    migrator = IssueMigrator(
+        yandex_client,
+        youtrack_client,
+        store,
+        migrate_comments=migrate_comments,
+        batch_size=batch_size,
+        max_workers=max_workers,
+        max_workers_per_project=max_workers_per_project,
+        export_mode=export_mode,
+        scroll_batch_size=scroll_batch_size
+    )
 
-    # Мигрируем задачи по проектам
+    # Мигрируем задачи по проектам: несколько проектов обрабатываются одновременно,
+    # но все они делят общий пул потоков
     total_success = 0
+    total_updated = 0
     total_skip = 0
     total_error = 0
-    total_issues_processed = 0
-
-    for i, (queue_key, project_id) in enumerate(project_mapping.items(), 1):
-        logger.info(f"[{i}/{len(project_mapping)}] 📁 Обрабатываем проект: {queue_key}")
-
-        # Получаем задачи проекта
-        yandex_issues = yandex_client.get_issues(queue_key, batch_size)
-        if not yandex_issues:
-            logger.warning(f"  ⚠ Нет задач в проекте {queue_key}")
-            continue
-
-        # Обрабатываем задачи
-        project_success = 0
-        project_skip = 0
-        project_error = 0
-
-        for j, issue in enumerate(yandex_issues, 1):
-            issue_key = issue.get('key')
-            total_issues_processed += 1
-
-            if j % 10 == 0:
-                logger.info(f"    [{j}/{len(yandex_issues)}] Обработано задач в проекте")
-
-            # Пропускаем если уже мигрирована
-            if issue_key in issue_mapping:
-                project_skip += 1
-                continue
-
-            # Создаем задачу
-            issue_id = youtrack_client.create_issue(issue, project_id)
-            if issue_id:
-                issue_mapping[issue_key] = issue_id
-                project_success += 1
-
-                # Мигрируем комментарии если включено
-                if migrate_comments:
-                    comments = yandex_client.get_issue_comments(issue_key)
-                    for comment in comments:
-                        youtrack_client.add_comment_to_issue(issue_id, comment)
-                        time.sleep(0.1)
-            else:
-                project_error += 1
 
-            # Пауза между задачами
-            time.sleep(0.3)
+    parallel_projects = max(1, migrator.max_workers // migrator.max_workers_per_project)
+    project_list = list(project_mapping.items())
 
-            # Сохраняем промежуточный результат каждые 50 задач
-            if total_issues_processed % 50 == 0:
-                save_issue_mapping(issue_mapping)
-                logger.info(f"  💾 Промежуточное сохранение: {total_issues_processed} задач обработано")
+    def process_project(args):
+        i, (queue_key, project_id) = args
+        logger.info(f"[{i}/{len(project_list)}] 📁 Обрабатываем проект: {queue_key}")
+        return migrator.migrate_project(queue_key, project_id)
 
-        # Статистика по проекту
-        logger.info(f"  📊 Проект {queue_key}: ✓{project_success} ⏭{project_skip} ✗{project_error}")
-
-        total_success += project_success
-        total_skip += project_skip
-        total_error += project_error
-
-        # Сохраняем результат после каждого проекта
-        save_issue_mapping(issue_mapping)
-
-    # Сохраняем финальный результат
-    save_issue_mapping(issue_mapping)
+    try:
+        with ThreadPoolExecutor(max_workers=parallel_projects, thread_name_prefix='project') as project_executor:
+            for project_stats in project_executor.map(process_project, enumerate(project_list, 1)):
+                total_success += project_stats['success']
+                total_updated += project_stats['updated']
+                total_skip += project_stats['skip']
+                total_error += project_stats['error']
+    finally:
+        migrator.shutdown()
+        # Выгружаем финальный результат в JSON
+        save_issue_mapping(store)
+
+    total_issues_processed = migrator.total_issues_processed
 
     # Выводим финальную статистику
     logger.info("=" * 50)
     logger.info("РЕЗУЛЬТАТЫ ЭТАПА 3:")
     logger.info(f"✓ Успешно создано: {total_success}")
-    logger.info(f"⏭ Пропущено (уже существуют): {total_skip}")
+    logger.info(f"↻ Обновлено (изменены после переноса): {total_updated}")
+    logger.info(f"⏭ Пропущено (без изменений): {total_skip}")
     logger.info(f"✗ Ошибок: {total_error}")
-    logger.info(f"📊 Всего в маппинге: {len(issue_mapping)}")
+    logger.info(f"📊 Всего в маппинге: {store.count('issues')}")
     logger.info(f"🔢 Всего обработано: {total_issues_processed}")
+    log_http_stats(logger)
     logger.info("=" * 50)
 
     if total_error == 0:
+        # Первая полная миграция задает начальную метку для delta_sync.py
+        if run_started and not store.get_state(DELTA_WATERMARK):
+            store.set_state(DELTA_WATERMARK, run_started)
         logger.info("🎉 ЭТАП 3 ЗАВЕРШЕН УСПЕШНО!")
         logger.info("Теперь можно запустить step4_links_migration.py")
     else:
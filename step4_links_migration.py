@@ -6,10 +6,18 @@
 
 import requests
 import json
-import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+
+from mapping_store import MappingStore, open_mapping_store
+from link_planner import LinkEdge, group_edges, plan_links
+from migration_filters import load_filters, queue_of
+from migration_http import configure_http, create_session, log_http_stats
+from yandex_snapshot import open_snapshot
+from youtrack_metadata import METADATA_TTL, YouTrackMetadata, metadata_ttl
 
 # Настройка логирования
 logging.basicConfig(
@@ -25,11 +33,14 @@ logger = logging.getLogger(__name__)
 class YandexTrackerClient:
     """Клиент для работы с Yandex Tracker API"""
 
-    def __init__(self, token: str, org_id: str, is_cloud_org: bool = False):
+    def __init__(self, token: str, org_id: str, is_cloud_org: bool = False, pool_size: int = 10):
         self.token = token
         self.org_id = org_id
         self.base_url = "https://api.tracker.yandex.net/v2"
-        self.session = requests.Session()
+        self.session = create_session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         # Выбираем правильный заголовок для организации
         org_header = 'X-Cloud-Org-Id' if is_cloud_org else 'X-Org-ID'
         self.session.headers.update({
@@ -38,8 +49,8 @@ class YandexTrackerClient:
             'Content-Type': 'application/json'
         })
 
-    def get_issue_links(self, issue_key: str) -> List[Dict]:
-        """Получение связей задачи"""
+    def get_issue_links(self, issue_key: str) -> Optional[List[Dict]]:
+        """Получение связей задачи (None при ошибке)"""
         try:
             response = self.session.get(f"{self.base_url}/issues/{issue_key}/links")
             response.raise_for_status()
@@ -48,58 +59,93 @@ class YandexTrackerClient:
             return links
         except requests.RequestException as e:
             logger.error(f"Ошибка получения связей для задачи {issue_key}: {e}")
-            return []
+            return None
 
 class YouTrackClient:
     """Клиент для работы с YouTrack API"""
 
-    def __init__(self, base_url: str, token: str):
+    def __init__(self, base_url: str, token: str, store: MappingStore, metadata_ttl: float = METADATA_TTL):
         self.base_url = base_url.rstrip('/')
         self.token = token
-        self.session = requests.Session()
+        self.session = create_session()
         self.session.headers.update({
             'Authorization': f'Bearer {token}',
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         })
+        self.metadata = YouTrackMetadata(self.session, self.base_url, store, ttl=metadata_ttl)
+        # Имя типа связи -> текст команды для направления source -> target
+        self.link_commands: Dict[str, str] = {}
 
     def get_link_types(self) -> Dict[str, str]:
-        """Получение доступных типов связей"""
+        """Получение доступных типов связей (из кэша метаданных)"""
+        link_types = self.metadata.link_types()
+
+        # Создаем маппинг типов связей
+        type_mapping = {}
+        for link_type in link_types:
+            name = link_type.get('name', '')
+            self.link_commands[name] = link_type.get('sourceToTarget') or name.lower()
+
+            # Стандартные типы связей
+            if 'depend' in name.lower() or 'блокир' in name.lower():
+                type_mapping['depends'] = name
+            elif 'duplicate' in name.lower() or 'дубликат' in name.lower():
+                type_mapping['duplicates'] = name
+            elif 'relate' in name.lower() or 'связ' in name.lower():
+                type_mapping['relates'] = name
+            elif 'parent' in name.lower() or 'subtask' in name.lower() or 'родител' in name.lower():
+                type_mapping['parent'] = name
+
+        # Добавляем дефолтный тип связи
+        if not type_mapping:
+            type_mapping['relates'] = 'relates'
+
+        logger.info(f"  🔗 Найдено типов связей: {len(type_mapping)}")
+        return type_mapping
+
+    def link_command(self, link_type: str) -> str:
+        """Текст команды YouTrack для создания связи типа link_type"""
+        return self.link_commands.get(link_type) or ('relates to' if link_type == 'relates' else link_type.lower())
+
+    def apply_command(self, issue_ids: List[str], query: str) -> bool:
+        """Применение команды к задачам через /api/commands (без уведомлений)"""
         try:
-            response = self.session.get(
-                f"{self.base_url}/api/admin/issueLinkTypes",
-                params={'fields': 'name,inward,outward'}
+            response = self.session.post(
+                f"{self.base_url}/api/commands",
+                json={'query': query, 'issues': [{'id': issue_id} for issue_id in issue_ids], 'silent': True}
             )
-            response.raise_for_status()
-            link_types = response.json()
-
-            # Создаем маппинг типов связей
-            type_mapping = {}
-            for link_type in link_types:
-                name = link_type.get('name', '')
-                inward = link_type.get('inward', '')
-                outward = link_type.get('outward', '')
-
-                # Стандартные типы связей
-                if 'depend' in name.lower() or 'блокир' in name.lower():
-                    type_mapping['depends'] = name
-                elif 'duplicate' in name.lower() or 'дубликат' in name.lower():
-                    type_mapping['duplicates'] = name
-                elif 'relate' in name.lower() or 'связ' in name.lower():
-                    type_mapping['relates'] = name
-                elif 'parent' in name.lower() or 'родител' in name.lower():
-                    type_mapping['parent'] = name
-
-            # Добавляем дефолтный тип связи
-            if not type_mapping:
-                type_mapping['relates'] = 'relates'
-
-            logger.info(f"  🔗 Найдено типов связей: {len(type_mapping)}")
-            return type_mapping
 
+            if response.status_code == 200:
+                logger.debug(f"      ✓ Применена команда: {query}")
+                return True
+            else:
+                logger.warning(f"      ⚠ Не удалось применить команду '{query}': {response.status_code}")
+                return False
+
+        except requests.RequestException as e:
+            logger.error(f"      ✗ Ошибка применения команды: {e}")
+            return False
+
+    def get_project_readable_ids(self, project_id: str, page_size: int = 500) -> Optional[Dict[str, str]]:
+        """Читаемые ID всех задач проекта постранично: ID задачи -> читаемый ID (None при ошибке)"""
+        readable_ids = {}
+        skip = 0
+        try:
+            while True:
+                response = self.session.get(
+                    f"{self.base_url}/api/admin/projects/{project_id}/issues",
+                    params={'fields': 'id,idReadable', '$top': page_size, '$skip': skip}
+                )
+                response.raise_for_status()
+                issues = response.json()
+                readable_ids.update((issue.get('id'), issue.get('idReadable')) for issue in issues)
+                if len(issues) < page_size:
+                    return readable_ids
+                skip += page_size
         except requests.RequestException as e:
-            logger.error(f"Ошибка получения типов связей: {e}")
-            return {'relates': 'relates'}
+            logger.error(f"Ошибка получения читаемых ID задач проекта {project_id}: {e}")
+            return None
 
     def create_issue_link(self, issue_id: str, target_issue_id: str, link_type: str = 'relates') -> bool:
         """Создание связи между задачами"""
@@ -135,16 +181,118 @@ def load_config() -> Dict:
         logger.error("Файл migration_config.json не найден")
         exit(1)
 
-def load_issue_mapping() -> Dict:
+def load_issue_mapping(store: MappingStore) -> Dict:
     """Загрузка маппинга задач"""
-    try:
-        with open('issue_mapping.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return data.get('issues', {})
-    except FileNotFoundError:
-        logger.error("Файл issue_mapping.json не найден")
+    issue_mapping = store.load('issues')
+    if not issue_mapping:
+        logger.error("Маппинг задач не найден")
         logger.error("Сначала запустите step3_issues_migration.py")
         exit(1)
+    return issue_mapping
+
+def fetch_missing_links(yandex_client: YandexTrackerClient, store: MappingStore,
+                        issue_keys: List[str], max_workers: int) -> int:
+    """Получение связей задач, для которых этап 3 их не сохранил (например, перенесенных ранее)"""
+    def fetch(issue_key: str) -> bool:
+        links = yandex_client.get_issue_links(issue_key)
+        if links is None:
+            return False
+        store.save_issue_links(issue_key, links)
+        return True
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='links') as executor:
+        for i, ok in enumerate(executor.map(fetch, issue_keys), 1):
+            if not ok:
+                failed += 1
+            if i % 100 == 0:
+                logger.info(f"  [{i}/{len(issue_keys)}] Получены связи задач")
+    return failed
+
+def resolve_readable_ids(youtrack_client: YouTrackClient, store: MappingStore,
+                         issue_mapping: Dict[str, str], issue_keys: set) -> Dict[str, str]:
+    """Читаемые ID задач для команд. Для задач, перенесенных без них, читаемые ID
+    запрашиваются у YouTrack одним постраничным списком на проект, а не по задаче"""
+    readable_ids = store.load('issues_readable')
+    missing: Dict[str, List[str]] = {}
+    for issue_key in issue_keys:
+        if issue_key not in readable_ids:
+            missing.setdefault(queue_of(issue_key), []).append(issue_key)
+    if missing:
+        logger.info(f"Получаем читаемые ID {sum(map(len, missing.values()))} задач "
+                    f"из {len(missing)} проектов...")
+
+    for queue_key, missing_keys in missing.items():
+        project_id = store.get('projects', queue_key)
+        project_ids = youtrack_client.get_project_readable_ids(project_id) if project_id else None
+        if not project_ids:
+            continue
+        found = {issue_key: project_ids[issue_mapping[issue_key]] for issue_key in missing_keys
+                 if project_ids.get(issue_mapping[issue_key])}
+        store.set_many('issues_readable', found)
+        readable_ids.update(found)
+    return readable_ids
+
+def create_planned_links(youtrack_client: YouTrackClient, store: MappingStore, issue_mapping: Dict[str, str],
+                         edges: List[LinkEdge], links_stats: Dict, link_mode: str = 'commands',
+                         link_batch_size: int = 50) -> set:
+    """Создание запланированных связей (пакетными командами или по одной).
+    Возвращает ключи задач, у которых не удалось создать хотя бы одну связь"""
+    # Ребра с ошибкой создания: их задачи не отмечаются как завершенные
+    failed_issues = set()
+
+    def record_created(created: List[LinkEdge]):
+        store.set_many('links', {edge.key: edge.link_type for edge in created})
+        links_stats['links_created'] += len(created)
+        for edge in created:
+            links_stats['link_types_used'][edge.link_type] = links_stats['link_types_used'].get(edge.link_type, 0) + 1
+
+    def create_single(edge: LinkEdge):
+        source_youtrack_id = issue_mapping[edge.source_key]
+        target_youtrack_id = issue_mapping[edge.target_key]
+        if youtrack_client.create_issue_link(source_youtrack_id, target_youtrack_id, edge.link_type):
+            record_created([edge])
+        else:
+            links_stats['links_failed'] += 1
+            failed_issues.update((edge.source_key, edge.target_key))
+
+    if link_mode == 'commands':
+        readable_ids = resolve_readable_ids(youtrack_client, store, issue_mapping,
+                                            {edge.target_key for edge in edges})
+        batches = group_edges(edges, link_batch_size)
+        logger.info(f"🧾 Связи создаются командами YouTrack: {len(batches)} команд вместо {len(edges)} запросов")
+
+        for i, batch in enumerate(batches, 1):
+            if i % 100 == 0:
+                logger.info(f"[{i}/{len(batches)}] Выполнено команд")
+
+            # Цели без читаемого ID создаются по одной
+            commandable = [edge for edge in batch if readable_ids.get(edge.target_key)]
+            for edge in batch:
+                if edge not in commandable:
+                    create_single(edge)
+            if not commandable:
+                continue
+
+            # В пакете либо один источник, либо одна цель - команда задает все пары
+            sources = list(dict.fromkeys(edge.source_key for edge in commandable))
+            targets = list(dict.fromkeys(edge.target_key for edge in commandable))
+            query = f"{youtrack_client.link_command(commandable[0].link_type)} " + \
+                    ' '.join(readable_ids[target_key] for target_key in targets)
+
+            if youtrack_client.apply_command([issue_mapping[key] for key in sources], query):
+                record_created(commandable)
+            else:
+                # Команда не применилась целиком - выясняем проблемную связь поштучно
+                for edge in commandable:
+                    create_single(edge)
+    else:
+        for i, edge in enumerate(edges, 1):
+            if i % 100 == 0:
+                logger.info(f"[{i}/{len(edges)}] Обработано связей")
+            create_single(edge)
+
+    return failed_issues
 
 def save_links_report(links_stats: Dict):
     """Сохранение отчета о связях"""
@@ -159,20 +307,6 @@ def save_links_report(links_stats: Dict):
 
     logger.info(f"Отчет о связях сохранен в links_report.json")
 
-def map_link_type(yandex_link_type: str, youtrack_link_types: Dict[str, str]) -> str:
-    """Маппинг типов связей из Yandex Tracker в YouTrack"""
-    yandex_type = yandex_link_type.lower()
-
-    # Стандартные маппинги
-    if 'depend' in yandex_type or 'блокир' in yandex_type:
-        return youtrack_link_types.get('depends', 'relates')
-    elif 'duplicate' in yandex_type or 'дубликат' in yandex_type:
-        return youtrack_link_types.get('duplicates', 'relates')
-    elif 'parent' in yandex_type or 'родител' in yandex_type:
-        return youtrack_link_types.get('parent', 'relates')
-    else:
-        return youtrack_link_types.get('relates', 'relates')
-
 def main():
     """Главная функция этапа 4"""
     logger.info("=" * 50)
@@ -181,28 +315,35 @@ def main():
 
     # Загружаем конфигурацию
     config = load_config()
+    configure_http(config)
 
     # Загружаем маппинг задач
-    issue_mapping = load_issue_mapping()
-    if not issue_mapping:
-        logger.error("Маппинг задач пуст")
-        logger.error("Сначала успешно завершите step3_issues_migration.py")
-        exit(1)
+    store = open_mapping_store()
+    issue_mapping = load_issue_mapping(store)
 
     logger.info(f"Загружен маппинг задач: {len(issue_mapping)} задач")
 
+    migration_options = config.get('migration_options', {})
+    max_workers = migration_options.get('max_workers', 8)
+    link_mode = migration_options.get('link_mode', 'commands')
+    link_batch_size = migration_options.get('link_batch_size', 50)
+
     # Создаем клиентов
     is_cloud_org = config['yandex_tracker'].get('is_cloud_org', False)
     
-    yandex_client = YandexTrackerClient(
+    # Если выгружен снимок, данные Yandex Tracker читаются из него
+    yandex_client = open_snapshot(config) or YandexTrackerClient(
         config['yandex_tracker']['token'],
         config['yandex_tracker']['org_id'],
-        is_cloud_org
+        is_cloud_org,
+        pool_size=max_workers
     )
 
     youtrack_client = YouTrackClient(
         config['youtrack']['url'],
-        config['youtrack']['token']
+        config['youtrack']['token'],
+        store,
+        metadata_ttl=metadata_ttl(config)
     )
 
     # Получаем типы связей YouTrack
@@ -219,80 +360,47 @@ def main():
         'link_types_used': {}
     }
 
-    # Создаем множество для отслеживания уже созданных связей
-    created_links = set()
-
     logger.info("Начинаем анализ и создание связей...")
 
-    # Обрабатываем задачи
-    issue_list = list(issue_mapping.items())
-
-    for i, (yandex_issue_key, youtrack_issue_id) in enumerate(issue_list, 1):
-        if i % 100 == 0:
-            logger.info(f"[{i}/{len(issue_list)}] Обработано задач")
-
-        links_stats['total_issues_checked'] += 1
-
-        # Получаем связи задачи из Yandex Tracker
-        yandex_links = yandex_client.get_issue_links(yandex_issue_key)
-        if not yandex_links:
-            continue
-
-        links_stats['total_links_found'] += len(yandex_links)
-        logger.debug(f"  🔍 Задача {yandex_issue_key}: найдено {len(yandex_links)} связей")
-
-        # Обрабатываем каждую связь
-        for link in yandex_links:
-            # Получаем ключ связанной задачи
-            target_issue_key = None
-            if link.get('object'):
-                target_issue_key = link['object'].get('key')
-            elif link.get('target'):
-                target_issue_key = link['target'].get('key')
-
-            if not target_issue_key:
-                logger.debug(f"    ⚠ Не удалось определить целевую задачу для связи")
-                links_stats['links_skipped'] += 1
-                continue
-
-            # Проверяем, что целевая задача тоже мигрирована
-            target_youtrack_id = issue_mapping.get(target_issue_key)
-            if not target_youtrack_id:
-                logger.debug(f"    ⚠ Целевая задача {target_issue_key} не найдена в маппинге")
-                links_stats['links_skipped'] += 1
-                continue
-
-            # Определяем тип связи
-            yandex_link_type = link.get('type', {}).get('key', 'relates')
-            youtrack_link_type = map_link_type(yandex_link_type, youtrack_link_types)
-
-            # Создаем уникальный идентификатор связи для избежания дублей
-            link_signature = f"{youtrack_issue_id}-{target_youtrack_id}-{youtrack_link_type}"
-            reverse_link_signature = f"{target_youtrack_id}-{youtrack_issue_id}-{youtrack_link_type}"
-
-            if link_signature in created_links or reverse_link_signature in created_links:
-                logger.debug(f"    ⏭ Связь уже создана")
-                links_stats['links_skipped'] += 1
-                continue
-
-            # Создаем связь
-            if youtrack_client.create_issue_link(youtrack_issue_id, target_youtrack_id, youtrack_link_type):
-                created_links.add(link_signature)
-                links_stats['links_created'] += 1
-
-                # Статистика по типам связей
-                if youtrack_link_type not in links_stats['link_types_used']:
-                    links_stats['link_types_used'][youtrack_link_type] = 0
-                links_stats['link_types_used'][youtrack_link_type] += 1
-
-            else:
-                links_stats['links_failed'] += 1
-
-            # Пауза между создением связей
-            time.sleep(0.2)
-
-        # Пауза между задачами
-        time.sleep(0.1)
+    # Связи переносим только для задач очередей, попадающих под фильтры миграции;
+    # ссылаться они могут на любые перенесенные задачи
+    filters = load_filters(config)
+    source_mapping = filters.filter_mapping(issue_mapping, queue_of)
+
+    # Задачи, связи которых перенесены в прошлых запусках, пропускаем
+    links_done = store.links_done_keys()
+    if links_done:
+        logger.info(f"Связи уже перенесены для {len(links_done)} задач, пропускаем их")
+
+    # Связи собираются на этапе 3; из Yandex Tracker запрашиваем только недостающие
+    links_fetched = store.links_fetched_keys()
+    missing = [key for key in source_mapping if key not in links_fetched and key not in links_done]
+    if missing:
+        logger.info(f"Получаем связи {len(missing)} задач, не сохраненные на этапе 3...")
+        fetch_failed = fetch_missing_links(yandex_client, store, missing, max_workers)
+        if fetch_failed:
+            logger.warning(f"⚠ Не удалось получить связи {fetch_failed} задач, они будут запрошены при повторном запуске")
+
+    # Строим граф связей: связь, полученная с обеих задач, становится одним ребром,
+    # ребра, созданные в прошлых запусках, берутся из хранилища
+    issue_links = {key: links for key, links in store.load_issue_links().items()
+                   if key in source_mapping and key not in links_done}
+    links_stats['total_issues_checked'] = len([key for key in source_mapping if key not in links_done])
+    plan = plan_links(issue_links, issue_mapping, youtrack_link_types, store.load('links'))
+    links_stats['total_links_found'] = plan.links_found
+    links_stats['links_skipped'] = plan.duplicates + plan.already_done + plan.unmapped
+
+    logger.info(f"📐 План: {len(plan.edges)} связей к созданию, {plan.duplicates} повторов с другой стороны, "
+                f"{plan.already_done} уже создано, {plan.unmapped} с неперенесенными задачами")
+
+    failed_issues = create_planned_links(youtrack_client, store, issue_mapping, plan.edges, links_stats,
+                                         link_mode, link_batch_size)
+
+    # Отмечаем задачи, все связи которых созданы или уже были созданы; задачи со связями
+    # на еще не перенесенные задачи остаются в работе до их переноса
+    for issue_key in issue_links:
+        if issue_key not in failed_issues and issue_key not in plan.pending_issues:
+            store.mark_links_done(issue_key)
 
     # Сохраняем отчет
     save_links_report(links_stats)
@@ -309,6 +417,7 @@ def main():
     logger.info("📊 Статистика по типам связей:")
     for link_type, count in links_stats['link_types_used'].items():
         logger.info(f"  {link_type}: {count}")
+    log_http_stats(logger)
     logger.info("=" * 50)
 
     if links_stats['links_failed'] == 0:
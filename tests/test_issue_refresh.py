@@ -0,0 +1,75 @@
+"""
+Задачи, перенесенные до появления отпечатков, не переписываются в YouTrack:
+первый запуск только сохраняет их отпечатки
+"""
+
+import pytest
+
+from mapping_store import MappingStore
+
+ISSUE = {'key': 'A-1', 'summary': 'Задача', 'description': 'текст', 'createdBy': {'display': 'Автор'},
+         'createdAt': '2024-01-01T00:00:00', 'updatedAt': '2024-01-02T00:00:00'}
+COMMENT = {'id': 7, 'text': 'комментарий', 'createdBy': {'display': 'Автор'}, 'createdAt': '2024-01-01T00:00:00'}
+
+class FakeYouTrack:
+    def __init__(self):
+        self.writes = []
+
+    def update_issue(self, issue_id, issue_data):
+        self.writes.append(('issue', issue_id))
+        return True
+
+    def update_comment(self, issue_id, comment_id, comment_data):
+        self.writes.append(('comment', comment_id))
+        return True
+
+    def get_issue_comment_ids(self, issue_id):
+        return ['c-1']
+
+    def add_comment_to_issue(self, issue_id, comment_data):
+        self.writes.append(('new_comment', issue_id))
+        return 'c-new'
+
+class FakeYandex:
+    def __init__(self, issue):
+        self.issue = issue
+
+    def iter_issue_pages(self, queue_key, per_page=50):
+        yield [self.issue]
+
+    def get_issue_links(self, issue_key):
+        return []
+
+    def get_issue_comments(self, issue_key):
+        return [COMMENT]
+
+@pytest.fixture
+def store(tmp_path):
+    store = MappingStore(str(tmp_path / 'migration_state.db'))
+    # Маппинги предыдущей версии: без прогресса и отпечатков
+    store.set('issues', 'A-1', '2-1')
+    store.set('comments', 'A-1/7', 'c-1')
+    yield store
+    store.close()
+
+def migrate(store, youtrack, issue):
+    from step3_issues_migration import IssueMigrator
+    migrator = IssueMigrator(FakeYandex(issue), youtrack, store, export_mode='pages')
+    try:
+        return migrator.migrate_project('A', '0-1')
+    finally:
+        migrator.shutdown()
+
+def test_legacy_issue_is_fingerprinted_without_writes(tmp_path, monkeypatch, store):
+    monkeypatch.chdir(tmp_path)
+    youtrack = FakeYouTrack()
+
+    assert migrate(store, youtrack, ISSUE)['updated'] == 0
+    assert youtrack.writes == []
+    assert store.get_fingerprint('issues', 'A-1')[1] == ISSUE['updatedAt']
+
+    # Следующий запуск пропускает задачу без запросов, измененная задача обновляется
+    assert migrate(store, youtrack, ISSUE)['skip'] == 1
+    changed = dict(ISSUE, summary='Новый заголовок', updatedAt='2024-02-01T00:00:00')
+    assert migrate(store, youtrack, changed)['updated'] == 1
+    assert youtrack.writes == [('issue', '2-1')]
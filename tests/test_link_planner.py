@@ -0,0 +1,62 @@
+"""
+Планировщик связей: направление связей, склейка связи, полученной с обеих задач,
+и группировка ребер в пакетные команды
+"""
+
+from link_planner import LinkEdge, group_edges, map_link_type, parse_yandex_links, plan_links
+
+LINK_TYPES = {'depends': 'Depend', 'duplicates': 'Duplicate', 'relates': 'Relates', 'parent': 'Subtask'}
+
+def link(target_key, link_type, direction):
+    return {'target_key': target_key, 'type': link_type, 'direction': direction}
+
+def test_map_link_type_flips_inward_directed_links():
+    assert map_link_type('depends', 'outward', LINK_TYPES) == ('Depend', True, False)
+    assert map_link_type('depends', 'inward', LINK_TYPES) == ('Depend', True, True)
+    # Ненаправленную связь переворачивать незачем
+    assert map_link_type('relates', 'inward', LINK_TYPES) == ('Relates', False, False)
+
+def test_map_link_type_falls_back_to_relates():
+    assert map_link_type('epic', 'outward', {'relates': 'Relates'}) == ('Relates', False, False)
+    assert map_link_type('неизвестный', 'outward', {}) == ('relates', False, False)
+
+def test_parse_yandex_links_skips_links_without_target():
+    yandex_links = [
+        {'type': {'id': 'depends'}, 'direction': 'outward', 'object': {'key': 'B-1'}},
+        {'type': {}, 'direction': 'inward', 'object': {'key': 'B-2'}},
+        {'type': {'id': 'relates'}, 'direction': 'outward', 'object': {}},
+    ]
+    assert parse_yandex_links(yandex_links) == [link('B-1', 'depends', 'outward'),
+                                                link('B-2', 'relates', 'inward')]
+
+def test_plan_links_merges_both_sides_of_a_link():
+    issue_links = {
+        'A-1': [link('A-2', 'depends', 'outward'), link('A-3', 'relates', 'outward')],
+        'A-2': [link('A-1', 'depends', 'inward')],
+        'A-3': [link('A-1', 'relates', 'outward')],
+    }
+    mapping = {'A-1': '2-1', 'A-2': '2-2', 'A-3': '2-3'}
+
+    plan = plan_links(issue_links, mapping, LINK_TYPES, [])
+    assert plan.links_found == 4 and plan.duplicates == 2
+    assert sorted(plan.edges, key=lambda edge: edge.key) == [
+        LinkEdge('A-1', 'A-2', 'Depend', True),
+        LinkEdge('A-1', 'A-3', 'Relates', False),
+    ]
+
+def test_plan_links_skips_done_and_keeps_unmapped_issues_pending():
+    issue_links = {'A-1': [link('A-2', 'relates', 'outward'), link('B-1', 'relates', 'outward')]}
+    done = [LinkEdge('A-1', 'A-2', 'Relates', False).key]
+
+    plan = plan_links(issue_links, {'A-1': '2-1', 'A-2': '2-2'}, LINK_TYPES, done)
+    assert plan.edges == [] and plan.already_done == 1 and plan.unmapped == 1
+    assert plan.pending_issues == {'A-1', 'B-1'}
+
+def test_group_edges_prefers_fewer_commands():
+    # Одна цель у многих источников: одна команда на все задачи
+    edges = [LinkEdge(f'A-{number}', 'B-1', 'Relates', False) for number in range(1, 4)]
+    assert group_edges(edges) == [edges]
+
+    # Один источник со многими целями, пакеты ограничены batch_size
+    edges = [LinkEdge('A-1', f'B-{number}', 'Depend', True) for number in range(1, 6)]
+    assert group_edges(edges, batch_size=2) == [edges[0:2], edges[2:4], edges[4:]]
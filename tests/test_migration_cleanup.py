@@ -0,0 +1,141 @@
+"""
+Откат миграции очищает migration_state.db: после отката повторный запуск этапа 3
+создает задачи заново, а не пропускает их как уже перенесенные
+"""
+
+import itertools
+from urllib.parse import urlparse
+
+import pytest
+
+from mapping_store import MappingStore
+
+ISSUES = [
+    {'key': f'A-{number}', 'summary': f'Задача {number}', 'description': 'текст',
+     'createdBy': {'display': 'Автор'}, 'createdAt': '2024-01-01T00:00:00', 'updatedAt': '2024-01-02T00:00:00'}
+    for number in range(1, 4)
+]
+
+class FakeResponse:
+    def __init__(self, status_code: int, data=None):
+        self.status_code = status_code
+        self.data = data
+
+    def raise_for_status(self):
+        assert self.status_code == 200, self.status_code
+
+    def json(self):
+        return self.data
+
+class FakeYouTrack:
+    """YouTrack в памяти: клиент этапа 3 и сессия MigrationCleanup"""
+
+    def __init__(self):
+        self.issues = {}
+        self.projects = set()
+        self.ids = itertools.count(1)
+
+    def create_issue(self, issue_data, project_id):
+        issue_id = f"2-{next(self.ids)}"
+        self.issues[issue_id] = project_id
+        return {'id': issue_id, 'idReadable': issue_id}
+
+    def add_comment_to_issue(self, issue_id, comment_data):
+        return None
+
+    def get(self, url, params=None):
+        project_id = urlparse(url).path.split('/')[4]
+        issue_ids = [issue_id for issue_id, project in self.issues.items() if project == project_id]
+        page = issue_ids[params['$skip']:params['$skip'] + params['$top']]
+        return FakeResponse(200, [{'id': issue_id, 'idReadable': issue_id} for issue_id in page])
+
+    def delete(self, url):
+        path = urlparse(url).path
+        if path.startswith('/api/issues/'):
+            return FakeResponse(200 if self.issues.pop(path.rsplit('/', 1)[1], None) else 404)
+        project_id = path.rsplit('/', 1)[1]
+        self.projects.discard(project_id)
+        return FakeResponse(200)
+
+class FakeYandex:
+    def iter_issue_pages(self, queue_key, per_page=50):
+        yield ISSUES
+
+    def get_issue_links(self, issue_key):
+        return [{'type': {'id': 'relates'}, 'direction': 'outward', 'object': {'key': 'B-1'}}]
+
+    def get_issue_comments(self, issue_key):
+        return []
+
+@pytest.fixture
+def store(tmp_path):
+    store = MappingStore(str(tmp_path / 'migration_state.db'))
+    yield store
+    store.close()
+
+def test_rollback_then_remigrate_creates_issues_again(tmp_path, monkeypatch, store):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr('builtins.input', lambda *args: 'no')
+    from migration_cleanup import MigrationCleanup
+    from step3_issues_migration import IssueMigrator
+
+    youtrack = FakeYouTrack()
+
+    def migrate(project_id):
+        youtrack.projects.add(project_id)
+        store.set('projects', 'A', project_id)
+        migrator = IssueMigrator(FakeYandex(), youtrack, store, migrate_comments=False, export_mode='pages')
+        try:
+            return migrator.migrate_project('A', project_id)
+        finally:
+            migrator.shutdown()
+
+    assert migrate('0-1')['success'] == 3
+    assert migrate('0-1')['skip'] == 3
+
+    cleanup = MigrationCleanup('http://youtrack.test', 'token', max_workers=2, store=store)
+    cleanup.session = youtrack
+    cleanup.metadata.put('projects', {'A': '0-1'})
+    stats = cleanup.rollback_migration({'projects': {'A': '0-1'}, 'users': {}})
+
+    assert stats['deleted_issues'] == 3 and stats['deleted_projects'] == 1
+    assert store.get_metadata('http://youtrack.test|projects') is None
+    assert not youtrack.issues and not youtrack.projects
+    assert store.count('issues') == store.count('issues_readable') == store.count('projects') == 0
+    assert store.get_progress('A-1') is None and store.get_fingerprint('issues', 'A-1') is None
+    assert not store.load_issue_links() and not store.links_fetched_keys()
+    assert store.get_state('rollback:0-1') is None and store.get_state('rollback:0-1:deleted') is None
+
+    stats = migrate('0-2')
+    assert stats['success'] == 3 and stats['skip'] == 0
+    assert sorted(youtrack.issues.values()) == ['0-2'] * 3
+
+    # Повторный откат удаляет новый проект, а устаревший маппинг старого проекта пропускается
+    stats = cleanup.rollback_migration({'projects': {'A': '0-2'}, 'users': {}})
+    assert stats['deleted_issues'] == 3 and stats['deleted_projects'] == 1
+    assert cleanup.rollback_migration({'projects': {'A': '0-1'}, 'users': {}})['deleted_projects'] == 0
+
+def test_project_with_undeleted_issues_is_kept_until_rerun(tmp_path, monkeypatch, store):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr('builtins.input', lambda *args: 'no')
+    from migration_cleanup import MigrationCleanup
+
+    youtrack = FakeYouTrack()
+    youtrack.projects.add('0-1')
+    store.set('projects', 'A', '0-1')
+    youtrack.issues = {f"2-{number}": '0-1' for number in range(1, 6)}
+    delete = youtrack.delete
+    locked = {'2-1', '2-4'}
+    # Первые задачи выдачи удалить не удается: остальные все равно должны быть прочитаны и удалены
+    youtrack.delete = lambda url: FakeResponse(500) if url.rsplit('/', 1)[1] in locked else delete(url)
+
+    cleanup = MigrationCleanup('http://youtrack.test', 'token', max_workers=2, store=store)
+    cleanup.session = youtrack
+    stats = cleanup.rollback_migration({'projects': {'A': '0-1'}, 'users': {}})
+    assert stats['deleted_issues'] == 3 and stats['deleted_projects'] == 0
+    assert sorted(youtrack.issues) == ['2-1', '2-4'] and youtrack.projects == {'0-1'}
+
+    locked.clear()
+    stats = cleanup.rollback_migration({'projects': {'A': '0-1'}, 'users': {}})
+    assert stats['deleted_issues'] == 2 and stats['deleted_projects'] == 1
+    assert not youtrack.issues and not youtrack.projects
@@ -0,0 +1,46 @@
+"""
+Фильтры миграции: проверка выгруженных задач и покрытие одного фильтра другим
+(по нему решается, можно ли читать данные из снимка)
+"""
+
+from migration_filters import MigrationFilters
+
+def issue(key, created_at):
+    return {'key': key, 'createdAt': created_at}
+
+def test_matches_issue_by_queue():
+    filters = MigrationFilters(specific_queues=('A', 'B'), exclude_queues=('B',))
+    assert filters.matches_issue(issue('A-1', '2024-01-01T00:00:00.000+0000'))
+    assert not filters.matches_issue(issue('B-1', '2024-01-01T00:00:00.000+0000'))
+    assert not filters.matches_issue(issue('C-1', '2024-01-01T00:00:00.000+0000'))
+
+def test_matches_issue_date_bounds_are_inclusive():
+    filters = MigrationFilters(created_from='2024-01-01', created_to='2024-06-30')
+    assert filters.matches_issue(issue('A-1', '2024-01-01T00:00:00.000+0000'))
+    # Дата 'to' включает весь день
+    assert filters.matches_issue(issue('A-2', '2024-06-30T23:59:59.000+0000'))
+    assert not filters.matches_issue(issue('A-3', '2023-12-31T23:59:59.000+0000'))
+    assert not filters.matches_issue(issue('A-4', '2024-07-01T00:00:00.000+0000'))
+    assert not filters.matches_issue(issue('A-5', None))
+    assert MigrationFilters().matches_issue(issue('A-6', None))
+
+def test_covers_queues():
+    everything = MigrationFilters()
+    assert everything.covers(MigrationFilters(specific_queues=('A',)))
+    assert not MigrationFilters(specific_queues=('A',)).covers(everything)
+    assert MigrationFilters(specific_queues=('A', 'B')).covers(MigrationFilters(specific_queues=('A',)))
+    # Исключенная из other очередь не мешает покрытию
+    assert MigrationFilters(specific_queues=('A',)).covers(
+        MigrationFilters(specific_queues=('A', 'B'), exclude_queues=('B',)))
+    assert MigrationFilters(exclude_queues=('B',)).covers(MigrationFilters(exclude_queues=('B', 'C')))
+    assert not MigrationFilters(exclude_queues=('B',)).covers(everything)
+    assert MigrationFilters(exclude_queues=('B',)).covers(MigrationFilters(specific_queues=('A',)))
+
+def test_covers_dates():
+    first_half = MigrationFilters(created_from='2024-01-01', created_to='2024-06-30')
+    assert MigrationFilters().covers(first_half)
+    assert not first_half.covers(MigrationFilters())
+    assert first_half.covers(MigrationFilters(created_from='2024-02-01', created_to='2024-03-01'))
+    assert not first_half.covers(MigrationFilters(created_from='2023-12-01', created_to='2024-03-01'))
+    assert not first_half.covers(MigrationFilters(created_from='2024-02-01'))
+    assert MigrationFilters.from_dict(first_half.to_dict()) == first_half
@@ -0,0 +1,61 @@
+"""
+HTTP-слой: адаптивный token bucket и классификация ответов для повторов
+"""
+
+import pytest
+import requests
+
+from migration_http import TokenBucket, budget_name, classify_status
+
+def response(status_code: int, **headers) -> requests.Response:
+    result = requests.Response()
+    result.status_code = status_code
+    result.headers.update({name.replace('_', '-'): value for name, value in headers.items()})
+    return result
+
+def test_classify_status():
+    assert classify_status(response(200), idempotent=True) is None
+    assert classify_status(response(404), idempotent=True) is None
+    assert classify_status(response(429), idempotent=False) == 'throttle'
+    assert classify_status(response(502), idempotent=True) == 'server'
+    # POST с 502/504 не повторяется: запись могла быть выполнена
+    assert classify_status(response(502), idempotent=False) is None
+    assert classify_status(response(503), idempotent=False) is None
+    assert classify_status(response(503, Retry_After='2'), idempotent=False) == 'throttle'
+
+def test_budget_name_separates_hub_api():
+    assert budget_name('https://yt.example.com/api/issues') == 'yt.example.com'
+    assert budget_name('https://yt.example.com/hub/api/rest/users') == 'yt.example.com/hub'
+
+def test_bucket_halves_rate_and_pauses_on_throttle():
+    bucket = TokenBucket('test', rate=4.0, max_rate=10.0)
+    bucket.on_response(response(429, Retry_After='3'))
+    assert bucket.rate == 2.0 and bucket.tokens <= 0
+    assert bucket.paused_until - bucket.updated == pytest.approx(3.0, abs=0.5)
+
+    # Скорость не опускается ниже min_rate
+    for _ in range(10):
+        bucket.on_response(response(503))
+    assert bucket.rate == bucket.min_rate
+
+def test_bucket_speeds_up_after_successes():
+    bucket = TokenBucket('test', rate=4.0, max_rate=6.0, increase_every=2)
+    for _ in range(2):
+        bucket.on_response(response(200))
+    assert bucket.rate == 5.0
+    for _ in range(4):
+        bucket.on_response(response(200))
+    assert bucket.rate == 6.0
+
+def test_bucket_follows_rate_limit_headers():
+    bucket = TokenBucket('test', rate=4.0, max_rate=50.0)
+    bucket.on_response(response(200, X_RateLimit_Remaining='30', X_RateLimit_Reset='10'))
+    assert bucket.rate == 3.0
+
+    bucket.on_response(response(200, X_RateLimit_Remaining='0', X_RateLimit_Reset='5'))
+    assert bucket.paused_until > bucket.updated + 4
+
+def test_bucket_spends_tokens():
+    bucket = TokenBucket('test', rate=1.0, max_rate=1.0, burst=2)
+    bucket.acquire()
+    assert bucket.tokens < 1
@@ -0,0 +1,40 @@
+"""
+Выборочная проверка валидатора: распределение выборки по проектам
+и доверительный интервал доли ошибок
+"""
+
+import pytest
+
+@pytest.fixture
+def validator(tmp_path, monkeypatch):
+    # Этапы миграции при импорте открывают лог-файлы в текущем каталоге
+    monkeypatch.chdir(tmp_path)
+    import migration_validator
+    return migration_validator
+
+def test_allocate_sample_is_proportional_and_exact(validator):
+    allocation = validator.allocate_sample({'A': 600, 'B': 300, 'C': 100}, 100)
+    assert allocation == {'A': 60, 'B': 30, 'C': 10}
+
+    # Остатки достаются проектам с наибольшей дробной частью квоты
+    allocation = validator.allocate_sample({'A': 1, 'B': 1, 'C': 1}, 2)
+    assert sum(allocation.values()) == 2 and all(size <= 1 for size in allocation.values())
+
+    allocation = validator.allocate_sample({'A': 5, 'B': 2, 'C': 3}, 7)
+    assert sum(allocation.values()) == 7
+    assert all(0 <= allocation[name] <= size for name, size in {'A': 5, 'B': 2, 'C': 3}.items())
+
+def test_allocate_sample_takes_everything_within_budget(validator):
+    assert validator.allocate_sample({'A': 3, 'B': 0}, 10) == {'A': 3, 'B': 0}
+
+def test_wilson_interval(validator):
+    assert validator.wilson_interval(0.0, 0) == (0.0, 1.0)
+
+    low, high = validator.wilson_interval(0.0, 400)
+    assert low == 0.0 and high == pytest.approx(0.0095, abs=1e-4)
+
+    low, high = validator.wilson_interval(0.5, 100)
+    assert low == pytest.approx(0.4038, abs=1e-4) and high == pytest.approx(0.5962, abs=1e-4)
+
+    # Интервал сужается с ростом выборки
+    assert validator.wilson_interval(0.01, 1000)[1] < validator.wilson_interval(0.01, 100)[1]
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Справочник существующих пользователей YouTrack и Hub
+Все пользователи загружаются один раз постранично ($top/$skip) в индекс по логину и email,
+после чего существующие пользователи определяются локально, без поиска по каждому логину.
+Здесь же постраничное потоковое чтение пользователей Yandex Tracker и YouTrack для
+вспомогательных скриптов (add_email_auth.py, check_current_state.py, check_new_users.py)
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from migration_http import create_session
+
+logger = logging.getLogger(__name__)
+
+# Размер страницы при загрузке пользователей
+PAGE_SIZE = 500
+
+YANDEX_API = 'https://api.tracker.yandex.net/v2'
+YANDEX_PAGE_SIZE = 50
+
+YOUTRACK_USER_FIELDS = 'id,login,email'
+HUB_USER_FIELDS = 'id,login,profile(email(email))'
+
+def iter_users(session, url: str, fields: str, headers: Optional[Dict] = None,
+               page_size: int = PAGE_SIZE) -> Iterator[Dict]:
+    """Потоковое постраничное чтение пользователей YouTrack или Hub (ошибки HTTP пробрасываются).
+    Hub отдает страницу объектом {'users': [...], 'total': N}, YouTrack - списком"""
+    skip = 0
+    while True:
+        response = session.get(url, headers=headers,
+                               params={'fields': fields, '$top': page_size, '$skip': skip})
+        response.raise_for_status()
+        data = response.json()
+        page = data.get('users', []) if isinstance(data, dict) else data
+        yield from page
+        if len(page) < page_size:
+            return
+        skip += page_size
+
+def fetch_users(session, url: str, fields: str, headers: Optional[Dict] = None,
+                page_size: int = PAGE_SIZE) -> Optional[List[Dict]]:
+    """Загрузка всех пользователей (None при ошибке)"""
+    try:
+        return list(iter_users(session, url, fields, headers, page_size))
+    except Exception as e:
+        logger.error(f"Ошибка загрузки пользователей {url}: {e}")
+        return None
+
+def iter_yandex_users(session, headers: Optional[Dict] = None, base_url: str = YANDEX_API,
+                      per_page: int = YANDEX_PAGE_SIZE) -> Iterator[Dict]:
+    """Потоковое постраничное чтение пользователей Yandex Tracker (page/perPage) без ограничения числа страниц"""
+    page = 1
+    while True:
+        response = session.get(f"{base_url}/users", headers=headers, params={'page': page, 'perPage': per_page})
+        response.raise_for_status()
+        users = response.json()
+        yield from users
+        if len(users) < per_page:
+            return
+        page += 1
+
+def load_user_logins(session, yandex_headers: Dict, youtrack_url: str,
+                     youtrack_headers: Dict) -> Tuple[Set[str], Set[str]]:
+    """Множества логинов Yandex Tracker и YouTrack. Обе системы читаются постранично
+    и одновременно через общую сессию; в памяти остаются только множества логинов"""
+    def logins(users: Iterator[Dict]) -> Set[str]:
+        return {user.get('login') for user in users if user.get('login')}
+
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix='users') as executor:
+        yandex = executor.submit(lambda: logins(iter_yandex_users(session, yandex_headers)))
+        youtrack = executor.submit(lambda: logins(iter_users(
+            session, f"{youtrack_url.rstrip('/')}/api/users", 'id,login', youtrack_headers)))
+        return yandex.result(), youtrack.result()
+
+def load_config_user_logins(config: Dict) -> Tuple[Set[str], Set[str]]:
+    """Множества логинов обеих систем по разделам yandex_tracker и youtrack конфигурации"""
+    yandex_headers = {
+        'Authorization': f"OAuth {config['yandex_tracker']['token']}",
+        'X-Cloud-Org-Id': config['yandex_tracker']['org_id'],
+        'Content-Type': 'application/json'
+    }
+    youtrack_headers = {
+        'Authorization': f"Bearer {config['youtrack']['token']}",
+        'Content-Type': 'application/json',
+        'Accept': 'application/json'
+    }
+    return load_user_logins(create_session(), yandex_headers, config['youtrack']['url'], youtrack_headers)
+
+def user_email(user: Dict) -> Optional[str]:
+    """Email пользователя YouTrack ('email') или Hub ('profile.email.email')"""
+    email = user.get('email')
+    if isinstance(email, dict):
+        email = email.get('email')
+    if not email:
+        email = ((user.get('profile') or {}).get('email') or {}).get('email')
+    return email or None
+
+class UserDirectory:
+    """Индекс пользователей: логин -> ID и email -> ID (потокобезопасный)"""
+
+    def __init__(self):
+        self.by_login: Dict[str, str] = {}
+        self.by_email: Dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.by_login)
+
+    def add(self, user_id: str, login: Optional[str], email: Optional[str] = None):
+        """Добавление пользователя; уже известный логин или email не перезаписывается"""
+        if not user_id:
+            return
+        with self.lock:
+            if login:
+                self.by_login.setdefault(login, user_id)
+            if email:
+                self.by_email.setdefault(email.lower(), user_id)
+
+    def add_users(self, users: List[Dict]):
+        for user in users:
+            self.add(user.get('id'), user.get('login'), user_email(user))
+
+    def find(self, login: Optional[str], email: Optional[str] = None) -> Optional[str]:
+        """ID существующего пользователя по логину, затем по email"""
+        with self.lock:
+            if login and login in self.by_login:
+                return self.by_login[login]
+            if email:
+                return self.by_email.get(email.lower())
+            return None
+
+    @classmethod
+    def load(cls, session, base_url: str, headers: Optional[Dict] = None,
+             include_hub: bool = True) -> Optional['UserDirectory']:
+        """Загрузка пользователей YouTrack и (дополнительно) Hub.
+        ID из YouTrack имеют приоритет: Hub дополняет индекс пользователями, которых YouTrack еще не видел"""
+        base_url = base_url.rstrip('/')
+        directory = cls()
+
+        users = fetch_users(session, f"{base_url}/api/users", YOUTRACK_USER_FIELDS, headers)
+        if users is None:
+            return None
+        directory.add_users(users)
+
+        if include_hub:
+            hub_users = fetch_users(session, f"{base_url}/hub/api/rest/users", HUB_USER_FIELDS, headers)
+            if hub_users is not None:
+                directory.add_users(hub_users)
+
+        logger.info(f"👥 Загружен справочник пользователей YouTrack: {len(directory)}")
+        return directory
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Параллельное выполнение запросов Hub по пользователям (создание аккаунтов, добавление credentials)
+Hub REST API не имеет пакетных операций для создания пользователей и их учетных данных,
+поэтому запросы выполняются ограниченным пулом потоков под общим лимитом migration_http.
+Результаты возвращаются в основной поток по мере готовности: маппинг и счетчики
+обновляются там же, без дополнительных блокировок
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterable, Iterator, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Число потоков по умолчанию (migration_options.max_workers)
+DEFAULT_WORKERS = 8
+
+# Как часто писать в лог прогресс, обработанных элементов
+PROGRESS_EVERY = 100
+
+def provision(items: Iterable[Dict], task: Callable[[Dict], Any], max_workers: int = DEFAULT_WORKERS,
+              label: str = 'пользователей') -> Iterator[Tuple[Dict, Any]]:
+    """Выполнение task для каждого элемента в max_workers потоках.
+    Выдает пары (элемент, результат) в порядке завершения; исключение в task дает результат None"""
+    items = list(items)
+    if not items:
+        return
+
+    max_workers = max(1, min(max_workers, len(items)))
+    logger.info(f"🚀 Обработка {len(items)} {label} в {max_workers} потоков...")
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='provision') as executor:
+        futures = {executor.submit(task, item): item for item in items}
+        for done, future in enumerate(as_completed(futures), 1):
+            item = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"✗ Ошибка обработки {item.get('login', item.get('id'))}: {e}")
+                result = None
+
+            if done % PROGRESS_EVERY == 0 or done == len(items):
+                logger.info(f"  Обработано {done}/{len(items)} {label}")
+            yield item, result
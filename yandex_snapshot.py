@@ -0,0 +1,580 @@
+#!/usr/bin/env python3
+"""
+Локальный снимок данных Yandex Tracker
+Фаза export один раз выгружает пользователей, очереди, статусы, задачи, комментарии,
+связи и метаданные вложений в индексированную базу SQLite (данные сжаты zlib).
+Этапы миграции и валидатор читают данные из снимка через SnapshotYandexClient,
+поэтому каждый объект запрашивается у Yandex Tracker один раз, а не на каждом этапе
+"""
+
+import os
+import json
+import zlib
+import sqlite3
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from migration_filters import MigrationFilters, load_filters, queue_of
+from migration_http import SCROLL_TTL_MS, configure_http, create_session, log_http_stats
+
+logger = logging.getLogger(__name__)
+
+# Файл снимка
+SNAPSHOT_DB = 'yandex_snapshot.db'
+
+# Данные задачи, которые выгружаются отдельными запросами: раздел -> путь API
+ISSUE_DETAILS = {
+    'comments': 'comments',
+    'links': 'links',
+    'attachments': 'attachments',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    login TEXT,
+    data BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS queues (
+    key TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS queue_statuses (
+    queue_key TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS statuses (
+    id TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS issues (
+    key TEXT PRIMARY KEY,
+    queue TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    updated_at TEXT,
+    data BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_issues_queue ON issues (queue, number);
+CREATE TABLE IF NOT EXISTS issue_details (
+    issue_key TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (issue_key, kind)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS export_state (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+def _pack(obj) -> bytes:
+    return zlib.compress(json.dumps(obj, ensure_ascii=False).encode('utf-8'))
+
+def _unpack(data: bytes):
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+def _issue_number(issue_key: str) -> int:
+    try:
+        return int(issue_key.rsplit('-', 1)[1])
+    except (IndexError, ValueError):
+        return 0
+
+class SnapshotStore:
+    """База снимка (потокобезопасная)"""
+
+    def __init__(self, path: str = SNAPSHOT_DB):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def _write_many(self, sql: str, rows: List[tuple]):
+        with self.lock:
+            self.conn.execute('BEGIN')
+            try:
+                self.conn.executemany(sql, rows)
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def get_state(self, name: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM export_state WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, name: str, value: str):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO export_state (name, value) VALUES (?, ?)', (name, value))
+
+    def reset_queue_states(self):
+        """Сброс отметок о выгруженных очередях: задачи будут выгружены заново"""
+        with self.lock:
+            self.conn.execute("DELETE FROM export_state WHERE name LIKE 'issues:%'")
+
+    def save_users(self, users: List[Dict]):
+        self._write_many('INSERT OR REPLACE INTO users (id, login, data) VALUES (?, ?, ?)',
+                         [(str(user.get('id') or user.get('uid') or user.get('login')), user.get('login'), _pack(user))
+                          for user in users])
+
+    def save_queues(self, queues: List[Dict]):
+        self._write_many('INSERT OR REPLACE INTO queues (key, data) VALUES (?, ?)',
+                         [(queue.get('key'), _pack(queue)) for queue in queues])
+
+    def save_queue_statuses(self, queue_key: str, statuses: List[Dict]):
+        self._write_many('INSERT OR REPLACE INTO queue_statuses (queue_key, data) VALUES (?, ?)',
+                         [(queue_key, _pack(statuses))])
+
+    def save_statuses(self, statuses: List[Dict]):
+        self._write_many('INSERT OR REPLACE INTO statuses (id, data) VALUES (?, ?)',
+                         [(str(status.get('id') or status.get('key')), _pack(status)) for status in statuses])
+
+    def save_issues(self, queue_key: str, issues: List[Dict]):
+        self._write_many(
+            'INSERT OR REPLACE INTO issues (key, queue, number, updated_at, data) VALUES (?, ?, ?, ?, ?)',
+            [(issue.get('key'), queue_key, _issue_number(issue.get('key', '')), issue.get('updatedAt'), _pack(issue))
+             for issue in issues]
+        )
+
+    def save_issue_detail(self, issue_key: str, kind: str, data: List[Dict]):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO issue_details (issue_key, kind, data) VALUES (?, ?, ?)',
+                              (issue_key, kind, _pack(data)))
+
+    def invalidate_details(self, issue_keys: List[str]):
+        """Удаление устаревших разделов задач, которые не удалось перевыгрузить: снимок снова
+        считается неполным, недостающие данные догружает следующий export"""
+        self._write_many('DELETE FROM issue_details WHERE issue_key = ?', [(key,) for key in issue_keys])
+        self.set_state('completed_at', '')
+
+    def load_all(self, table: str, order: str) -> List[Dict]:
+        with self.lock:
+            rows = self.conn.execute(f'SELECT data FROM {table} ORDER BY {order}').fetchall()
+        return [_unpack(row[0]) for row in rows]
+
+    def load_queue_statuses(self, queue_key: str) -> Optional[List[Dict]]:
+        with self.lock:
+            row = self.conn.execute('SELECT data FROM queue_statuses WHERE queue_key = ?', (queue_key,)).fetchone()
+        return _unpack(row[0]) if row else None
+
+    def iter_issues(self, queue_key: str, batch_size: int = 1000) -> Iterator[List[Dict]]:
+        """Задачи очереди пачками в порядке номеров"""
+        last_number = -1
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    'SELECT number, data FROM issues WHERE queue = ? AND number > ? ORDER BY number LIMIT ?',
+                    (queue_key, last_number, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            last_number = rows[-1][0]
+            yield [_unpack(row[1]) for row in rows]
+
+    def load_issue(self, issue_key: str) -> Optional[Dict]:
+        with self.lock:
+            row = self.conn.execute('SELECT data FROM issues WHERE key = ?', (issue_key,)).fetchone()
+        return _unpack(row[0]) if row else None
+
+    def load_issue_detail(self, issue_key: str, kind: str) -> Optional[List[Dict]]:
+        with self.lock:
+            row = self.conn.execute('SELECT data FROM issue_details WHERE issue_key = ? AND kind = ?',
+                                    (issue_key, kind)).fetchone()
+        return _unpack(row[0]) if row else None
+
+    def issues_missing_detail(self, queue_key: str, kind: str) -> List[str]:
+        """Ключи задач очереди, для которых раздел еще не выгружен"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT key FROM issues WHERE queue = ? AND NOT EXISTS '
+                '(SELECT 1 FROM issue_details d WHERE d.issue_key = issues.key AND d.kind = ?) ORDER BY number',
+                (queue_key, kind)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self, table: str, where: str = '', params: tuple = ()) -> int:
+        with self.lock:
+            return self.conn.execute(f'SELECT COUNT(*) FROM {table} {where}', params).fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class YandexExportClient:
+    """Клиент Yandex Tracker API для выгрузки снимка"""
+
+    def __init__(self, token: str, org_id: str, is_cloud_org: bool = False, pool_size: int = 10,
+                 filters: Optional[MigrationFilters] = None):
+        self.base_url = "https://api.tracker.yandex.net/v2"
+        self.filters = filters or MigrationFilters()
+        self.session = create_session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # Выбираем правильный заголовок для организации
+        org_header = 'X-Cloud-Org-Id' if is_cloud_org else 'X-Org-ID'
+        self.session.headers.update({
+            'Authorization': f'OAuth {token}',
+            org_header: org_id,
+            'Content-Type': 'application/json'
+        })
+
+    def get_paged(self, path: str, per_page: int = 50) -> List[Dict]:
+        """Получение всех страниц списка (исключение при ошибке)"""
+        result = []
+        page = 1
+        while True:
+            response = self.session.get(f"{self.base_url}/{path}", params={'page': page, 'perPage': per_page})
+            response.raise_for_status()
+            items = response.json()
+            result.extend(items)
+            if len(items) < per_page:
+                return result
+            page += 1
+
+    def get_list(self, path: str) -> List[Dict]:
+        response = self.session.get(f"{self.base_url}/{path}")
+        response.raise_for_status()
+        return response.json()
+
+    def get_users(self) -> List[Dict]:
+        return self.get_paged('users')
+
+    def get_queues(self) -> List[Dict]:
+        return self.get_paged('queues')
+
+    def iter_issue_pages(self, queue_key: str, per_scroll: int = 1000) -> Iterator[List[Dict]]:
+        """Задачи очереди через scroll-курсор _search (с учетом фильтров миграции)"""
+        issue_filter = self.filters.issue_filter(queue_key)
+        scroll_id = scroll_token = None
+        while True:
+            params = {'scrollTTLMillis': SCROLL_TTL_MS}
+            headers = {}
+            if scroll_id:
+                params['scrollId'] = scroll_id
+                if scroll_token:
+                    headers['X-Scroll-Token'] = scroll_token
+            else:
+                params.update({'scrollType': 'unsorted', 'perScroll': per_scroll})
+
+            response = self.session.post(f"{self.base_url}/issues/_search", params=params,
+                                         json={'filter': issue_filter}, headers=headers,
+                                         idempotent=not scroll_id)
+            response.raise_for_status()
+            issues = response.json()
+            if not issues:
+                return
+            scroll_id = response.headers.get('X-Scroll-Id', scroll_id)
+            scroll_token = response.headers.get('X-Scroll-Token', scroll_token)
+            yield issues
+
+    def get_issues(self, queue_key: str) -> List[Dict]:
+        return [issue for issues in self.iter_issue_pages(queue_key) for issue in issues]
+
+    def count_issues(self, queue_key: str) -> int:
+        """Число задач очереди через _count (с учетом фильтров миграции), без выгрузки задач"""
+        response = self.session.post(f"{self.base_url}/issues/_count",
+                                     json={'filter': self.filters.issue_filter(queue_key)}, idempotent=True)
+        response.raise_for_status()
+        return int(response.json())
+
+    def get_issue(self, issue_key: str) -> Optional[Dict]:
+        """Одна задача по ключу (None при ошибке)"""
+        try:
+            response = self.session.get(f"{self.base_url}/issues/{issue_key}")
+            response.raise_for_status()
+            return response.json()
+        except requests.RequestException as e:
+            logger.error(f"Ошибка получения задачи {issue_key}: {e}")
+            return None
+
+    def get_issue_detail(self, issue_key: str, kind: str) -> List[Dict]:
+        return self.get_list(f"issues/{issue_key}/{ISSUE_DETAILS[kind]}")
+
+    def get_issue_comments(self, issue_key: str) -> Optional[List[Dict]]:
+        try:
+            return self.get_issue_detail(issue_key, 'comments')
+        except requests.RequestException as e:
+            logger.error(f"Ошибка получения комментариев для задачи {issue_key}: {e}")
+            return None
+
+    def get_issue_links(self, issue_key: str) -> Optional[List[Dict]]:
+        try:
+            return self.get_issue_detail(issue_key, 'links')
+        except requests.RequestException as e:
+            logger.error(f"Ошибка получения связей для задачи {issue_key}: {e}")
+            return None
+
+class SnapshotExporter:
+    """Выгрузка снимка с продолжением после сбоя: готовые очереди и данные задач не перевыгружаются"""
+
+    def __init__(self, client: YandexExportClient, snapshot: SnapshotStore,
+                 max_workers: int = 8, scroll_batch_size: int = 1000):
+        self.client = client
+        self.snapshot = snapshot
+        self.max_workers = max(1, max_workers)
+        self.scroll_batch_size = scroll_batch_size
+        self.errors = 0
+
+    def export_directories(self):
+        """Пользователи, очереди и статусы"""
+        users = self.client.get_users()
+        self.snapshot.save_users(users)
+        logger.info(f"👥 Пользователей: {len(users)}")
+
+        queues = self.client.filters.filter_queues(self.client.get_queues())
+        self.snapshot.save_queues(queues)
+        logger.info(f"📁 Очередей: {len(queues)}")
+
+        self.snapshot.save_statuses(self.client.get_list('statuses'))
+        for queue in queues:
+            self.snapshot.save_queue_statuses(queue['key'], self.client.get_list(f"queues/{queue['key']}/statuses"))
+        return queues
+
+    def export_queue(self, queue_key: str):
+        """Задачи очереди и их комментарии, связи и вложения"""
+        if self.snapshot.get_state(f"issues:{queue_key}") != 'done':
+            exported = 0
+            for issues in self.client.iter_issue_pages(queue_key, self.scroll_batch_size):
+                self.snapshot.save_issues(queue_key, issues)
+                exported += len(issues)
+            self.snapshot.set_state(f"issues:{queue_key}", 'done')
+            logger.info(f"  📝 {queue_key}: выгружено {exported} задач")
+
+        for kind in ISSUE_DETAILS:
+            missing = self.snapshot.issues_missing_detail(queue_key, kind)
+            if not missing:
+                continue
+            logger.info(f"  📎 {queue_key}: выгружаем {kind} для {len(missing)} задач")
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='snapshot') as executor:
+                for issue_key, ok in zip(missing, executor.map(lambda key: self.export_detail(key, kind), missing)):
+                    if not ok:
+                        self.errors += 1
+
+    def export_issue_details(self, issue_key: str) -> bool:
+        return all([self.export_detail(issue_key, kind) for kind in ISSUE_DETAILS])
+
+    def refresh_issues(self, issues: List[Dict]) -> bool:
+        """Обновление измененных задач в снимке: задачи и их разделы перевыгружаются точечно,
+        поэтому завершенный снимок остается завершенным. Разделы, которые не удалось получить,
+        удаляются, и снимок помечается неполным до следующего export"""
+        by_queue: Dict[str, List[Dict]] = {}
+        for issue in issues:
+            by_queue.setdefault(queue_of(issue['key']), []).append(issue)
+        for queue_key, queue_issues in by_queue.items():
+            self.snapshot.save_issues(queue_key, queue_issues)
+
+        issue_keys = [issue['key'] for issue in issues]
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='snapshot') as executor:
+            failed = [issue_key for issue_key, ok in zip(issue_keys, executor.map(self.export_issue_details, issue_keys))
+                      if not ok]
+        if failed:
+            self.errors += len(failed)
+            self.snapshot.invalidate_details(failed)
+        return not failed
+
+    def export_detail(self, issue_key: str, kind: str) -> bool:
+        try:
+            self.snapshot.save_issue_detail(issue_key, kind, self.client.get_issue_detail(issue_key, kind))
+            return True
+        except requests.RequestException as e:
+            logger.error(f"Ошибка выгрузки {kind} задачи {issue_key}: {e}")
+            return False
+
+    def run(self, queue_keys: Optional[List[str]] = None) -> bool:
+        self.snapshot.set_state('completed_at', '')
+        # Время начала первой выгрузки: изменения после него подхватит дельта-синхронизация
+        if not self.snapshot.get_state('started_at'):
+            self.snapshot.set_state('started_at', datetime.now(timezone.utc).isoformat())
+        # Выгрузка с другими фильтрами: задачи очередей выгружаются заново
+        filters = json.dumps(self.client.filters.to_dict(), sort_keys=True)
+        previous = self.snapshot.get_state('filters')
+        if previous is not None and previous != filters:
+            logger.warning("⚠ Фильтры изменились с прошлой выгрузки, задачи очередей будут выгружены заново")
+            self.snapshot.reset_queue_states()
+        self.snapshot.set_state('filters', filters)
+
+        queues = self.export_directories()
+        for i, queue in enumerate(queues, 1):
+            if queue_keys and queue['key'] not in queue_keys:
+                continue
+            logger.info(f"[{i}/{len(queues)}] 📁 Выгружаем очередь {queue['key']}")
+            try:
+                self.export_queue(queue['key'])
+            except requests.RequestException as e:
+                logger.error(f"✗ Ошибка выгрузки очереди {queue['key']}: {e}")
+                self.errors += 1
+
+        # Снимок считается завершенным, только когда выгружены все очереди
+        pending = [queue['key'] for queue in queues if self.snapshot.get_state(f"issues:{queue['key']}") != 'done']
+        if self.errors == 0 and not pending:
+            self.snapshot.set_state('completed_at', datetime.now().isoformat())
+        elif pending:
+            logger.warning(f"⚠ Не выгружены очереди: {', '.join(pending)}")
+        return self.errors == 0 and not pending
+
+class SnapshotYandexClient:
+    """Чтение данных Yandex Tracker из снимка; повторяет методы клиентов этапов миграции"""
+
+    def __init__(self, path: str = SNAPSHOT_DB, filters: Optional[MigrationFilters] = None):
+        self.snapshot = SnapshotStore(path)
+        # Снимок может быть выгружен с более широкими фильтрами, чем текущие
+        self.filters = filters or MigrationFilters()
+
+    def started_at(self) -> Optional[str]:
+        """Время начала выгрузки снимка (UTC, ISO)"""
+        return self.snapshot.get_state('started_at')
+
+    def get_users(self) -> List[Dict]:
+        return self.snapshot.load_all('users', 'id')
+
+    def get_queues(self) -> List[Dict]:
+        return self.filters.filter_queues(self.snapshot.load_all('queues', 'key'))
+
+    def get_queue_statuses(self, queue_key: str) -> List[Dict]:
+        return self.snapshot.load_queue_statuses(queue_key) or []
+
+    def iter_issue_pages(self, queue_key: str, per_page: int = 50) -> Iterator[List[Dict]]:
+        total = 0
+        for issues in self.snapshot.iter_issues(queue_key, per_page):
+            issues = [issue for issue in issues if self.filters.matches_issue(issue)]
+            if not issues:
+                continue
+            total += len(issues)
+            yield issues
+        logger.info(f"  📝 Всего получено {total} задач для очереди {queue_key} (снимок)")
+
+    def iter_issue_pages_scroll(self, queue_key: str, per_scroll: int = 1000) -> Iterator[List[Dict]]:
+        return self.iter_issue_pages(queue_key, per_scroll)
+
+    def get_issues(self, queue_key: str, per_page: int = 1000) -> List[Dict]:
+        return [issue for issues in self.snapshot.iter_issues(queue_key, per_page) for issue in issues
+                if self.filters.matches_issue(issue)]
+
+    def count_issues(self, queue_key: str) -> int:
+        if not (self.filters.created_from or self.filters.created_to):
+            return self.snapshot.count('issues', 'WHERE queue = ?', (queue_key,))
+        return len(self.get_issues(queue_key))
+
+    def get_issue(self, issue_key: str) -> Optional[Dict]:
+        return self.snapshot.load_issue(issue_key)
+
+    def _detail(self, issue_key: str, kind: str) -> Optional[List[Dict]]:
+        data = self.snapshot.load_issue_detail(issue_key, kind)
+        if data is None:
+            logger.error(f"Раздел {kind} задачи {issue_key} отсутствует в снимке, повторите выгрузку")
+        return data
+
+    def get_issue_comments(self, issue_key: str) -> Optional[List[Dict]]:
+        return self._detail(issue_key, 'comments')
+
+    def get_issue_links(self, issue_key: str) -> Optional[List[Dict]]:
+        return self._detail(issue_key, 'links')
+
+    def get_issue_attachments(self, issue_key: str) -> Optional[List[Dict]]:
+        return self._detail(issue_key, 'attachments')
+
+def open_snapshot(config: Dict, path: str = SNAPSHOT_DB) -> Optional[SnapshotYandexClient]:
+    """Клиент снимка, если выгрузка завершена и не отключена в migration_options.use_snapshot"""
+    if not config.get('migration_options', {}).get('use_snapshot', True) or not os.path.exists(path):
+        return None
+
+    filters = MigrationFilters.from_config(config)
+    client = SnapshotYandexClient(path, filters)
+    completed_at = client.snapshot.get_state('completed_at')
+    if not completed_at:
+        logger.warning(f"⚠ Снимок {path} не завершен, данные запрашиваются у Yandex Tracker. "
+                       f"Завершите выгрузку: python yandex_snapshot.py export")
+        client.snapshot.close()
+        return None
+
+    snapshot_filters = MigrationFilters.from_dict(json.loads(client.snapshot.get_state('filters') or '{}'))
+    if not snapshot_filters.covers(filters):
+        logger.warning(f"⚠ Снимок {path} выгружен с более узкими фильтрами ({snapshot_filters.describe()}), "
+                       f"данные запрашиваются у Yandex Tracker. Обновите снимок: python yandex_snapshot.py export")
+        client.snapshot.close()
+        return None
+
+    logger.info(f"📦 Данные Yandex Tracker читаются из снимка {path} от {completed_at}")
+    return client
+
+def main():
+    """Выгрузка снимка Yandex Tracker"""
+    parser = argparse.ArgumentParser(description='Локальный снимок данных Yandex Tracker')
+    parser.add_argument('action', choices=['export', 'stats'],
+                        help='export - выгрузить (или дополнить) снимок, stats - содержимое снимка')
+    parser.add_argument('--db', default=SNAPSHOT_DB, help='Файл снимка')
+    parser.add_argument('--queues', nargs='*', help='Выгрузить только указанные очереди')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('snapshot.log'),
+            logging.StreamHandler()
+        ]
+    )
+
+    snapshot = SnapshotStore(args.db)
+
+    if args.action == 'stats':
+        logger.info(f"Пользователей: {snapshot.count('users')}, очередей: {snapshot.count('queues')}, "
+                    f"задач: {snapshot.count('issues')}")
+        for kind in ISSUE_DETAILS:
+            logger.info(f"{kind}: выгружено для {snapshot.count('issue_details', 'WHERE kind = ?', (kind,))} задач")
+        logger.info(f"Завершен: {snapshot.get_state('completed_at') or 'нет'}")
+        return
+
+    try:
+        with open('migration_config.json', 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        logger.error("Файл migration_config.json не найден")
+        exit(1)
+
+    configure_http(config)
+    migration_options = config.get('migration_options', {})
+    max_workers = migration_options.get('max_workers', 8)
+
+    client = YandexExportClient(
+        config['yandex_tracker']['token'],
+        config['yandex_tracker']['org_id'],
+        config['yandex_tracker'].get('is_cloud_org', False),
+        pool_size=max_workers,
+        filters=load_filters(config)
+    )
+
+    logger.info("=" * 50)
+    logger.info("ВЫГРУЗКА СНИМКА YANDEX TRACKER")
+    logger.info("=" * 50)
+
+    exporter = SnapshotExporter(client, snapshot, max_workers=max_workers,
+                                scroll_batch_size=migration_options.get('scroll_batch_size', 1000))
+    success = exporter.run(args.queues)
+
+    logger.info("=" * 50)
+    logger.info(f"📝 Задач в снимке: {snapshot.count('issues')}")
+    logger.info(f"✗ Ошибок: {exporter.errors}")
+    log_http_stats(logger)
+    logger.info("=" * 50)
+
+    if success:
+        logger.info("🎉 Снимок выгружен, этапы миграции будут читать данные из него")
+    else:
+        logger.warning("⚠ Снимок выгружен не полностью, повторите запуск для догрузки")
+
+    snapshot.close()
+
+if __name__ == "__main__":
+    main()
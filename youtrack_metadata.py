@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Кэш метаданных схемы YouTrack: прототипы полей (id поля State), типы связей,
+state bundles и проекты по shortName.
+Метаданные запрашиваются один раз за запуск, а не для каждого проекта, и сохраняются
+в migration_state.db (через соединение MappingStore этапа) со сроком жизни: следующие
+этапы и повторные запуски берут их из кэша.
+Операции записи (создание проекта или bundle) обновляют или сбрасывают свой раздел кэша
+"""
+
+import json
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from mapping_store import MappingStore
+
+logger = logging.getLogger(__name__)
+
+# Срок жизни сохраненных метаданных, секунд (migration_options.metadata_cache_ttl)
+METADATA_TTL = 3600
+
+# Размер страницы при постраничном чтении списков YouTrack
+PAGE_SIZE = 100
+
+class YouTrackMetadata:
+    """Кэш метаданных одного экземпляра YouTrack (потокобезопасный)"""
+
+    def __init__(self, session, base_url: str, store: MappingStore, headers: Optional[Dict] = None,
+                 ttl: float = METADATA_TTL):
+        self.session = session
+        self.base_url = base_url.rstrip('/')
+        self.headers = headers
+        self.ttl = ttl
+        # Кэш пишется через соединение и блокировку хранилища этапа, а не через отдельное соединение
+        self.store = store
+        self.memory: Dict[str, Any] = {}
+        self.lock = threading.RLock()
+
+    def _key(self, name: str) -> str:
+        # Разные экземпляры YouTrack не должны делить кэш
+        return f"{self.base_url}|{name}"
+
+    def get(self, name: str, loader: Callable[[], Any]) -> Any:
+        """Значение из памяти, из базы (если не устарело) или от loader.
+        Загрузка выполняется под блокировкой: параллельные потоки не запрашивают одно и то же"""
+        with self.lock:
+            if name in self.memory:
+                return self.memory[name]
+
+            row = self.store.get_metadata(self._key(name))
+            if row and time.time() - row[1] < self.ttl:
+                self.memory[name] = json.loads(row[0])
+                return self.memory[name]
+
+            value = loader()
+            if value is not None:
+                self.put(name, value)
+            return value
+
+    def put(self, name: str, value: Any):
+        with self.lock:
+            self.memory[name] = value
+            self.store.set_metadata(self._key(name), json.dumps(value, ensure_ascii=False), time.time())
+
+    def invalidate(self, name: str):
+        """Сброс раздела после изменения данных в YouTrack"""
+        with self.lock:
+            self.memory.pop(name, None)
+            self.store.delete_metadata(self._key(name))
+
+    def fetch_all(self, path: str, fields: str) -> Optional[List[Dict]]:
+        """Постраничное чтение списка YouTrack (None при ошибке - такой результат не кэшируется)"""
+        items = []
+        skip = 0
+        try:
+            while True:
+                response = self.session.get(f"{self.base_url}{path}", headers=self.headers,
+                                            params={'fields': fields, '$top': PAGE_SIZE, '$skip': skip})
+                response.raise_for_status()
+                page = response.json()
+                items.extend(page)
+                if len(page) < PAGE_SIZE:
+                    return items
+                skip += PAGE_SIZE
+        except Exception as e:
+            logger.error(f"Ошибка получения метаданных YouTrack {path}: {e}")
+            return None
+
+    def custom_fields(self) -> List[Dict]:
+        """Прототипы пользовательских полей"""
+        return self.get('custom_fields', lambda: self.fetch_all(
+            '/api/admin/customFieldSettings/customFields', 'id,name,fieldType(id)')) or []
+
+    def state_field_id(self) -> Optional[str]:
+        """ID прототипа поля State"""
+        for field in self.custom_fields():
+            field_type = field.get('fieldType') or ''
+            if isinstance(field_type, dict):
+                field_type = field_type.get('id') or ''
+            if field.get('name') == 'State' and 'state' in field_type.lower():
+                return field.get('id')
+        return None
+
+    def link_types(self) -> List[Dict]:
+        """Типы связей задач"""
+        return self.get('link_types', lambda: self.fetch_all(
+            '/api/admin/issueLinkTypes', 'name,sourceToTarget,targetToSource,directed')) or []
+
+    def state_bundles(self) -> List[Dict]:
+        """State bundles (id, имя)"""
+        return self.get('state_bundles', lambda: self.fetch_all(
+            '/api/admin/customFieldSettings/bundles/state', 'id,name')) or []
+
+    def add_state_bundle(self, bundle: Dict):
+        """Учет созданного bundle: загруженный список дополняется, иначе раздел сбрасывается"""
+        with self.lock:
+            if 'state_bundles' not in self.memory:
+                self.invalidate('state_bundles')
+                return
+            bundles = [b for b in self.memory['state_bundles'] if b.get('id') != bundle.get('id')]
+            self.put('state_bundles', bundles + [{'id': bundle.get('id'), 'name': bundle.get('name')}])
+
+    def projects(self) -> Dict[str, str]:
+        """Проекты: shortName -> id"""
+        def load():
+            projects = self.fetch_all('/api/admin/projects', 'id,shortName')
+            if projects is None:
+                return None
+            return {project.get('shortName'): project.get('id') for project in projects}
+        return self.get('projects', load) or {}
+
+    def project_id(self, short_name: str) -> Optional[str]:
+        """ID проекта по shortName; при промахе кэш перечитывается один раз"""
+        project_id = self.projects().get(short_name)
+        if not project_id:
+            self.invalidate('projects')
+            project_id = self.projects().get(short_name)
+        return project_id
+
+    def add_project(self, short_name: str, project_id: str):
+        """Учет созданного проекта: загруженный список дополняется, иначе раздел сбрасывается"""
+        with self.lock:
+            if 'projects' not in self.memory:
+                self.invalidate('projects')
+                return
+            self.put('projects', dict(self.memory['projects'], **{short_name: project_id}))
+
+def metadata_ttl(config: Dict) -> float:
+    """Срок жизни кэша из migration_options.metadata_cache_ttl"""
+    return config.get('migration_options', {}).get('metadata_cache_ttl', METADATA_TTL)